@@ -0,0 +1,70 @@
+# Extraction throughput of the newspaper and lxml backends on the saved html fixtures.
+# Run from the repository root: python -m benchmarks.bench_extract [--repeat N] [--json PATH]
+import argparse
+import glob
+import json
+import os
+import time
+from utils import parse_site_content, clean_content
+from extractor import extract_text, NEWSPAPER_EXTRACTOR, LXML_EXTRACTOR
+
+FIXTURE_DIR = "./tests/test_data/html"
+
+def extract_newspaper(html: bytes) -> str:
+    return clean_content(parse_site_content("https://example.com/fixture", html.decode("utf-8")))
+
+BACKENDS = {
+    NEWSPAPER_EXTRACTOR: extract_newspaper,
+    LXML_EXTRACTOR: extract_text,
+}
+
+def load_fixtures(fixture_dir: str = FIXTURE_DIR) -> dict[str, bytes]:
+    fixtures = {}
+    for path in sorted(glob.glob(os.path.join(fixture_dir, "*.html"))):
+        with open(path, "rb") as f:
+            fixtures[os.path.basename(path)] = f.read()
+    return fixtures
+
+def bench_backend(extract, fixtures: dict[str, bytes], repeat: int) -> dict:
+    # cpu time rather than wall time, so the numbers are per core
+    for html in fixtures.values():
+        extract(html)
+    start = time.process_time()
+    for _ in range(repeat):
+        for html in fixtures.values():
+            extract(html)
+    seconds = time.process_time() - start
+    pages = repeat * len(fixtures)
+    total_bytes = repeat * sum(len(html) for html in fixtures.values())
+    return {
+        "pages": pages,
+        "cpu_seconds": seconds,
+        "pages_per_second": pages / seconds if seconds else 0.0,
+        "mb_per_second": total_bytes / seconds / 1e6 if seconds else 0.0,
+        "chars": {name: len(extract(html)) for name, html in fixtures.items()}
+    }
+
+def run(repeat: int = 20, fixture_dir: str = FIXTURE_DIR) -> dict:
+    fixtures = load_fixtures(fixture_dir)
+    return {name: bench_backend(extract, fixtures, repeat) for name, extract in BACKENDS.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark html text extraction backends.")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--fixtures", default=FIXTURE_DIR)
+    parser.add_argument("--json", dest="json_path", help="also save the results to this file")
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.fixtures)
+    print(f"{'backend':<12}{'pages/s/core':>14}{'MB/s/core':>12}")
+    for name, result in results.items():
+        print(f"{name:<12}{result['pages_per_second']:>14.1f}{result['mb_per_second']:>12.2f}")
+    baseline = results[NEWSPAPER_EXTRACTOR]["pages_per_second"]
+    if baseline:
+        print(f"lxml speedup: {results[LXML_EXTRACTOR]['pages_per_second'] / baseline:.1f}x")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+# Microbenchmarks for the prompt rendering hot paths, driven by the test data and
+# synthetic scale-ups of it. LOD generation is stubbed, nothing calls the API.
+# Run from the repository root:
+#   python -m benchmarks.bench_prompts [--repeat N] [--only NAME] [--json PATH] [--compare PATH]
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import prompts
+from schemas import ResearchActionPlanSchema, PaperSchema, SectionSchema, SearchResultSummary
+from utils import load_summary, load_research_action_plan, parse_raw_summary, token_count_cache
+from prompts import get_l2_write_prompt, get_l3_write_prompt
+from prompt_renderer import render_writing_prompt
+from research_index import ResearchIndex
+
+SUMMARY_FILE = "./tests/test_data/summary.json"
+PLAN_FILE = "./tests/test_data/parsed_user_prompt_for_research.json"
+SECTION_FILE = "./tests/test_data/example_intro_full.txt"
+
+SUMMARY_COUNTS = (10, 50, 200)
+SECTION_COUNTS = (5, 20, 50)
+CONTEXT_LIMIT = 4000
+
+def make_plan(num_sections: int) -> ResearchActionPlanSchema:
+    plan = load_research_action_plan(PLAN_FILE)
+    structure = list(plan.paper_structure)
+    structure += [f"Section {i}" for i in range(len(structure), num_sections)]
+    plan.paper_structure = structure[:num_sections]
+    return plan
+
+def make_summaries(num_summaries: int, plan: ResearchActionPlanSchema) -> list[SearchResultSummary]:
+    # copies of the test summaries with their own links, shuffled details and
+    # relevancy for every section of the plan
+    base = load_summary(SUMMARY_FILE)
+    rng = random.Random(num_summaries)
+    summaries = []
+    for i in range(num_summaries):
+        summary = base[i % len(base)]
+        details = list(summary.details)
+        rng.shuffle(details)
+        summaries.append(summary.model_copy(update={
+            "source_material": summary.source_material.model_copy(update={"link": f"{summary.source_material.link}#copy-{i}"}),
+            "details": details,
+            "relevancy": {section: rng.randint(0, 10) for section in plan.paper_structure}
+        }))
+    return summaries
+
+def make_paper(plan: ResearchActionPlanSchema, num_written: int) -> PaperSchema:
+    with open(SECTION_FILE) as f:
+        text = f.read()
+    return PaperSchema(sections=[SectionSchema(name=name, lods=[text]) for name in plan.paper_structure[:num_written]])
+
+def raw_summary_text(summary: SearchResultSummary) -> str:
+    # the model's answer format that parse_raw_summary reads
+    details = "\n".join(f"- {detail}" for detail in summary.details)
+    relevancy = "\n".join(f"- {section}: {score}" for section, score in summary.relevancy.items())
+    return f"Author(s): {', '.join(summary.authors) or 'not found'}\nDate: {summary.date or 'not found'}\n{details}\nRelevancy:\n{relevancy}\n"
+
+async def stub_generate_lods(section: SectionSchema, action_plan: ResearchActionPlanSchema) -> SectionSchema:
+    words = section.lods[0].split()
+    # short enough that even 50 sections fit at the critical LOD
+    section.lods += ["\n".join("- " + " ".join(words[i:i + 12]) for i in range(0, min(len(words), 120), 12)), " ".join(words[:8])]
+    section.max_lod_generated = True
+    return section
+
+@contextlib.contextmanager
+def stubbed_lods():
+    generate_lods = prompts.generate_lods
+    prompts.generate_lods = stub_generate_lods
+    try:
+        yield
+    finally:
+        prompts.generate_lods = generate_lods
+
+# every case is (name, setup), where setup builds the inputs and returns the function
+# to time; setup runs again before every repeat because some paths mutate their inputs
+
+def load_summary_case(num_summaries: int):
+    def setup():
+        plan = make_plan(6)
+        data = [summary.to_json() for summary in make_summaries(num_summaries, plan)]
+        fd, path = tempfile.mkstemp(suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+
+        def run():
+            try:
+                load_summary(path)
+            finally:
+                os.remove(path)
+        return run
+    return f"load_summary[summaries={num_summaries}]", setup
+
+def parse_raw_summary_case(num_summaries: int):
+    def setup():
+        plan = make_plan(6)
+        summaries = make_summaries(num_summaries, plan)
+        raw = [(raw_summary_text(summary), summary.source_material) for summary in summaries]
+        return lambda: [parse_raw_summary(text, source) for text, source in raw]
+    return f"parse_raw_summary[summaries={num_summaries}]", setup
+
+def l3_case(num_summaries: int, num_sections: int):
+    def setup():
+        plan = make_plan(num_sections)
+        summaries = make_summaries(num_summaries, plan)
+
+        def run():
+            # one index per paper, notes for every section
+            research_index = ResearchIndex(summaries, plan.paper_structure)
+            for section in plan.paper_structure:
+                get_l3_write_prompt(section, summaries, CONTEXT_LIMIT // 2, research_index)
+        return run
+    return f"get_l3_write_prompt[summaries={num_summaries},sections={num_sections}]", setup
+
+def l2_case(num_sections: int):
+    def setup(loop):
+        plan = make_plan(num_sections)
+        paper = make_paper(plan, num_sections - 1)
+        # the last section sees every other one and has to reduce most of them
+        return lambda: loop.run_until_complete(get_l2_write_prompt(plan, num_sections - 1, paper, CONTEXT_LIMIT // 2))
+    return f"get_l2_write_prompt[sections={num_sections}]", setup
+
+def render_case(num_summaries: int, num_sections: int):
+    def setup(loop):
+        plan = make_plan(num_sections)
+        summaries = make_summaries(num_summaries, plan)
+        paper = make_paper(plan, num_sections)
+
+        async def render_all():
+            research_index = ResearchIndex(summaries, plan.paper_structure)
+            for curr_section in range(num_sections):
+                curr_paper = PaperSchema(sections=paper.sections[:curr_section])
+                await render_writing_prompt(plan, curr_paper, curr_section, summaries, total_tokens=CONTEXT_LIMIT, research_index=research_index)
+        return lambda: loop.run_until_complete(render_all())
+    return f"render_writing_prompt[summaries={num_summaries},sections={num_sections}]", setup
+
+def all_cases():
+    cases = []
+    cases += [(load_summary_case(n), False) for n in SUMMARY_COUNTS]
+    cases += [(parse_raw_summary_case(n), False) for n in SUMMARY_COUNTS]
+    cases += [(l3_case(n, s), False) for n in SUMMARY_COUNTS for s in SECTION_COUNTS]
+    cases += [(l2_case(s), True) for s in SECTION_COUNTS]
+    cases += [(render_case(n, s), True) for n in SUMMARY_COUNTS for s in SECTION_COUNTS]
+    return cases
+
+def measure(setup, needs_loop: bool, repeat: int) -> dict:
+    loop = asyncio.new_event_loop() if needs_loop else None
+    make_run = (lambda: setup(loop)) if needs_loop else setup
+    times = []
+    tokenizer_calls = 0
+    token_lookups = 0
+    try:
+        with stubbed_lods(), contextlib.redirect_stdout(io.StringIO()):
+            # warm up encoders and imports outside the timed runs
+            make_run()()
+            for _ in range(repeat):
+                run = make_run()
+                # every repeat starts with a cold token cache, so misses are the real encodes
+                token_count_cache.clear()
+                start = time.perf_counter()
+                run()
+                times.append(time.perf_counter() - start)
+                tokenizer_calls = token_count_cache.misses
+                token_lookups = token_count_cache.hits + token_count_cache.misses
+
+            # memory is measured on a separate run, tracemalloc slows everything down
+            run = make_run()
+            token_count_cache.clear()
+            tracemalloc.start()
+            try:
+                run()
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+    finally:
+        if loop is not None:
+            loop.close()
+    return {
+        "median_s": statistics.median(times),
+        "min_s": min(times),
+        "tokenizer_calls": tokenizer_calls,
+        "token_lookups": token_lookups,
+        "peak_kib": peak / 1024
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(repeat: int = 5, only: str = None) -> dict:
+    results = {
+        "meta": {"commit": git_commit(), "python": platform.python_version(), "repeat": repeat, "timestamp": time.time()},
+        "cases": {}
+    }
+    for (name, setup), needs_loop in all_cases():
+        if only and only not in name:
+            continue
+        results["cases"][name] = measure(setup, needs_loop, repeat)
+        case = results["cases"][name]
+        print(f"{name:<62}{case['median_s'] * 1000:>10.2f} ms{case['tokenizer_calls']:>8} enc{case['peak_kib']:>10.0f} KiB", flush=True)
+    return results
+
+def compare(results: dict, baseline: dict):
+    print(f"\nagainst {baseline['meta'].get('commit')}:")
+    for name, case in results["cases"].items():
+        old = baseline["cases"].get(name)
+        if old is None:
+            continue
+        ratio = case["median_s"] / old["median_s"] if old["median_s"] else float("inf")
+        print(f"{name:<62}{ratio:>8.2f}x time{case['tokenizer_calls'] - old['tokenizer_calls']:>+8} enc{case['peak_kib'] - old['peak_kib']:>+10.0f} KiB")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the prompt rendering hot paths.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", help="only run cases whose name contains this")
+    parser.add_argument("--json", dest="json_path", help="save the results to this file")
+    parser.add_argument("--compare", dest="compare_path", help="results saved by an earlier run to compare against")
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.only)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=4)
+    if args.compare_path:
+        with open(args.compare_path) as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# Local stand-in for the open web: serves the html fixtures and one article page per
+# test summary, and a search function that hands out those pages for any query.
+from aiohttp import web
+from collections import namedtuple
+import glob
+import html
+import json
+import os
+
+HTML_DIR = "./tests/test_data/html"
+SUMMARY_FILE = "./tests/test_data/summary.json"
+
+FixtureSearchResult = namedtuple("FixtureSearchResult", ["url", "title", "description"])
+
+ARTICLE_TEMPLATE = """<html><head><title>{title}</title></head><body>
+<nav><a href="/">Home</a></nav>
+<article>
+<h1>{title}</h1>
+{paragraphs}
+</article>
+<footer>Fixture web</footer>
+</body></html>"""
+
+def load_pages() -> dict[str, tuple[str, str]]:
+    # page name -> (title, html)
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(HTML_DIR, "*.html"))):
+        name = os.path.basename(path)
+        with open(path) as f:
+            pages[name] = (name.removesuffix(".html"), f.read())
+    with open(SUMMARY_FILE) as f:
+        summaries = json.load(f)
+    for i, summary in enumerate(summaries):
+        title = summary["source_material"]["title"]
+        paragraphs = "\n".join(f"<p>{html.escape(detail)}</p>" for detail in summary["details"])
+        pages[f"article-{i}.html"] = (title, ARTICLE_TEMPLATE.format(title=html.escape(title), paragraphs=paragraphs))
+    return pages
+
+class FixtureWeb:
+    def __init__(self):
+        self.pages = load_pages()
+        self.requests = 0
+        self._runner: web.AppRunner = None
+        self.base_url: str = None
+
+    async def page(self, request: web.Request):
+        self.requests += 1
+        name = request.match_info["name"]
+        if name not in self.pages:
+            raise web.HTTPNotFound()
+        return web.Response(text=self.pages[name][1], content_type="text/html")
+
+    def search_fn(self, query: str, num_results: int) -> list[FixtureSearchResult]:
+        # every query gets its own rotation through the pages, so queries overlap a little
+        names = list(self.pages)
+        offset = sum(query.encode("utf-8")) % len(names)
+        picked = [names[(offset + i) % len(names)] for i in range(min(num_results, len(names)))]
+        return [FixtureSearchResult(f"{self.base_url}/pages/{name}", self.pages[name][0], "") for name in picked]
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/pages/{name}", self.page)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._runner.cleanup()
@@ -0,0 +1,144 @@
+# Offline end-to-end load test: runs whole pipelines against the stub OpenAI server
+# and the fixture web, so planning, crawling, summarization, LOD generation and
+# writing all run for real with nothing leaving the machine.
+# Run from the repository root:
+#   python -m benchmarks.load_harness [--runs N] [--concurrency N] [--latency default=lognormal:0.2:0.5]
+#                                     [--error-rate-429 P] [--error-rate-500 P] [--streaming] [--json PATH]
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import math
+import os
+import random
+import tempfile
+import time
+from benchmarks.openai_stub import OpenAIStub, Latency, canned_responder
+from benchmarks.fixture_web import FixtureWeb
+from benchmarks.bench_prompts import git_commit
+from page_cache import PageCache
+from pipeline import run_stages
+from llm_client import llm_session, DEFAULT_POOL_SIZE
+
+PLAN_FILE = "./tests/test_data/parsed_user_prompt_for_research.json"
+PROMPT = "Write a briefing on Taylor Morrison for a business meeting"
+STAGES = ("plan", "search", "summarize", "write", "total")
+
+def percentile(values: list[float], pct: float) -> float:
+    # nearest rank, None without samples
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+def parse_latency(specs: list[str], seed: int = None) -> dict[str, Latency]:
+    # "kind=distribution" pairs, kind is plan, summary, lod, section or default
+    rng = random.Random(seed)
+    latency = {}
+    for spec in specs:
+        kind, _, distribution = spec.partition("=")
+        latency[kind] = Latency(distribution, rng)
+    return latency
+
+async def run_one(run_index: int, web: FixtureWeb, work_dir: str, semaphore: asyncio.Semaphore, **kwargs) -> dict:
+    async with semaphore:
+        # every run starts cold: its own page cache and output directory
+        run_dir = os.path.join(work_dir, f"run-{run_index}")
+        timings = {}
+        start = time.monotonic()
+        try:
+            await run_stages(
+                PROMPT, PageCache(cache_dir=os.path.join(run_dir, "pages")),
+                search_fn=web.search_fn,
+                output_dir=os.path.join(run_dir, "outputs"),
+                convert_pdf=False,
+                timings=timings,
+                **kwargs
+            )
+            error = None
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        timings["total"] = time.monotonic() - start
+        return {"run": run_index, "timings": timings, "error": error}
+
+async def run_load(runs: int = 4, concurrency: int = 2, latency: dict = None, error_rate_429: float = 0.0, error_rate_500: float = 0.0, seed: int = 0, **kwargs) -> dict:
+    with open(PLAN_FILE) as f:
+        research_action_plan = json.load(f)
+    stub = OpenAIStub(canned_responder(research_action_plan), latency=latency, error_rate_429=error_rate_429, error_rate_500=error_rate_500, seed=seed)
+    semaphore = asyncio.Semaphore(concurrency)
+    with tempfile.TemporaryDirectory() as work_dir:
+        async with stub, FixtureWeb() as web:
+            start = time.monotonic()
+            # the runs share one connection pool, like jobs of one process would
+            async with llm_session(pool_size=kwargs.pop("llm_pool_size", DEFAULT_POOL_SIZE)):
+                results = await asyncio.gather(*[run_one(i, web, work_dir, semaphore, **kwargs) for i in range(runs)])
+            elapsed = time.monotonic() - start
+
+    succeeded = [result for result in results if result["error"] is None]
+    report = {
+        "meta": {"commit": git_commit(), "runs": runs, "concurrency": concurrency, "error_rate_429": error_rate_429, "error_rate_500": error_rate_500, "seed": seed, "timestamp": time.time()},
+        "elapsed_s": elapsed,
+        "papers_per_minute": 60 * len(succeeded) / elapsed if elapsed else None,
+        "succeeded": len(succeeded),
+        "failed": len(results) - len(succeeded),
+        "errors": [result["error"] for result in results if result["error"] is not None],
+        # failed runs stop part way, so only finished runs count towards the latency
+        "stages": {
+            stage: {f"p{pct}_s": percentile([result["timings"][stage] for result in succeeded if stage in result["timings"]], pct) for pct in (50, 95, 99)}
+            for stage in STAGES
+        },
+        "llm_requests": {},
+        "max_concurrent_llm_requests": stub.max_active
+    }
+    for kind, status, seconds in stub.log:
+        counts = report["llm_requests"].setdefault(kind, {"ok": 0, "429": 0, "500": 0})
+        counts["ok" if status == 200 else str(status)] += 1
+    return report
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"{report['succeeded']} of {report['succeeded'] + report['failed']} runs succeeded in {report['elapsed_s']:.2f}s, {report['papers_per_minute']:.1f} papers/min",
+        f"{'stage':<12}{'p50':>10}{'p95':>10}{'p99':>10}"
+    ]
+    for stage, pcts in report["stages"].items():
+        if pcts["p50_s"] is None:
+            continue
+        lines.append(f"{stage:<12}" + "".join(f"{pcts[name]:>9.2f}s" for name in ("p50_s", "p95_s", "p99_s")))
+    lines.append(f"{'requests':<12}{'ok':>10}{'429':>10}{'500':>10}")
+    for kind, counts in report["llm_requests"].items():
+        lines.append(f"{kind:<12}{counts['ok']:>10}{counts['429']:>10}{counts['500']:>10}")
+    lines.append(f"max concurrent llm requests: {report['max_concurrent_llm_requests']}")
+    lines += [f"error: {error}" for error in report["errors"]]
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the whole pipeline offline.")
+    parser.add_argument("--runs", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=2, help="pipelines running at once")
+    parser.add_argument("--latency", action="append", default=[], help="KIND=constant:S|uniform:LOW:HIGH|lognormal:MEDIAN:SIGMA, KIND is plan, summary, lod, section or default")
+    parser.add_argument("--error-rate-429", type=float, default=0.0)
+    parser.add_argument("--error-rate-500", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--streaming", action="store_true", help="use the streaming search and summarize pipeline")
+    parser.add_argument("--parallel-sections", action="store_true")
+    parser.add_argument("--json", dest="json_path", help="save the report to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's own logging and output")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        report = asyncio.run(run_load(
+            args.runs, args.concurrency, parse_latency(args.latency, args.seed),
+            args.error_rate_429, args.error_rate_500, args.seed,
+            streaming=args.streaming, parallel_sections=args.parallel_sections
+        ))
+    print(format_report(report))
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=4)
+
+if __name__ == "__main__":
+    main()
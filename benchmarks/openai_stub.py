@@ -0,0 +1,173 @@
+from aiohttp import web
+import asyncio
+import json
+import math
+import random
+import re
+import openai
+import time
+
+RAW_SUMMARY = """Author(s): not found
+Date: not found
+- A detail
+Relevancy:
+- Introduction: 5
+"""
+
+def default_responder(body: dict) -> str:
+    return RAW_SUMMARY
+
+class Latency:
+    # Seconds to wait before answering, drawn from a distribution:
+    # "constant:S", "uniform:LOW:HIGH" or "lognormal:MEDIAN:SIGMA"
+    def __init__(self, spec: str = "constant:0", rng: random.Random = None):
+        self.spec = spec
+        self.rng = rng or random.Random()
+        kind, *params = spec.split(":")
+        self.kind = kind
+        self.params = [float(param) for param in params]
+        if kind not in ("constant", "uniform", "lognormal"):
+            raise Exception(f"Unknown latency distribution '{spec}'")
+
+    def sample(self) -> float:
+        if self.kind == "constant":
+            return self.params[0]
+        if self.kind == "uniform":
+            return self.rng.uniform(self.params[0], self.params[1])
+        return self.rng.lognormvariate(math.log(self.params[0]), self.params[1])
+
+# request kinds the canned responder tells apart
+PLAN = "plan"
+SUMMARY = "summary"
+LOD = "lod"
+SECTION = "section"
+
+def request_kind(body: dict) -> str:
+    text = "\n".join(message["content"] for message in body["messages"])
+    if "Parse it into the following" in text:
+        return PLAN
+    if "You are a researcher reading source material" in text:
+        return SUMMARY
+    if "Create a concise bullet point summary" in text:
+        return LOD
+    return SECTION
+
+SECTIONS_RE = re.compile(r"The sections of this paper are: (.*?)\.\n")
+
+def canned_responder(research_action_plan: dict, rng: random.Random = None):
+    # answers every call site of the pipeline in the format its parser expects
+    rng = rng or random.Random(0)
+
+    def respond(body: dict) -> str:
+        kind = request_kind(body)
+        text = "\n".join(message["content"] for message in body["messages"])
+        if kind == PLAN:
+            return json.dumps(research_action_plan)
+        if kind == SUMMARY:
+            match = SECTIONS_RE.search(text)
+            sections = match.group(1).split(", ") if match else research_action_plan["paper_structure"]
+            relevancy = "\n".join(f"- {section}: {rng.randint(0, 10)}" for section in sections)
+            details = "\n".join(f"- Detail {i} from the source material about {research_action_plan['topic_of_research']}." for i in range(rng.randint(2, 6)))
+            return f"Author(s): not found\nDate: not found\n{details}\nRelevancy:\n{relevancy}\n"
+        if kind == LOD:
+            return "Key Details:\n- The section covers its topic.\n- It cites the research notes.\nCritical Info: The section makes one key point."
+        paragraph = f"This section discusses {research_action_plan['topic_of_research']} for {research_action_plan['primary_audience']}. " * 6
+        return f"## Section\n{paragraph}\n\n{paragraph}"
+
+    return respond
+
+class OpenAIStub:
+    # OpenAI-compatible chat completions endpoint on localhost. Every request waits
+    # `delay` seconds, or a sample of the latency for its kind, and a share of them
+    # fail with a 429 (with Retry-After) or a 500 instead of being answered.
+    def __init__(self, responder=default_responder, delay: float = 0.0, latency: dict = None, error_rate_429: float = 0.0, error_rate_500: float = 0.0, retry_after: float = 1, seed: int = None):
+        self.responder = responder
+        self.delay = delay
+        # request kind -> Latency, "default" applies to every kind without its own
+        self.latency = latency or {}
+        self.error_rate_429 = error_rate_429
+        self.error_rate_500 = error_rate_500
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.requests: list[dict] = []
+        self.peers: set = set()
+        self.active = 0
+        self.max_active = 0
+        # (kind, status, seconds) per request
+        self.log: list[tuple[str, int, float]] = []
+        self._runner: web.AppRunner = None
+        self.api_base: str = None
+
+    def sample_delay(self, kind: str) -> float:
+        latency = self.latency.get(kind, self.latency.get("default"))
+        return latency.sample() if latency is not None else self.delay
+
+    async def chat_completions(self, request: web.Request):
+        start = time.monotonic()
+        body = await request.json()
+        kind = request_kind(body)
+        self.requests.append(body)
+        self.peers.add(request.transport.get_extra_info("peername"))
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            delay = self.sample_delay(kind)
+            if delay:
+                await asyncio.sleep(delay)
+        finally:
+            self.active -= 1
+        roll = self.rng.random()
+        if roll < self.error_rate_429:
+            self.log.append((kind, 429, time.monotonic() - start))
+            return web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                status=429, headers={"Retry-After": str(self.retry_after)}
+            )
+        if roll < self.error_rate_429 + self.error_rate_500:
+            self.log.append((kind, 500, time.monotonic() - start))
+            return web.json_response({"error": {"message": "The server had an error", "type": "server_error"}}, status=500)
+
+        content = self.responder(body)
+        if body.get("stream"):
+            response = await self.stream_response(request, body, content)
+        else:
+            response = web.json_response({
+                "id": f"chatcmpl-{len(self.requests)}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}
+            })
+        self.log.append((kind, 200, time.monotonic() - start))
+        return response
+
+    async def stream_response(self, request: web.Request, body: dict, content: str):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        words = content.split(" ")
+        for i, word in enumerate(words):
+            piece = word if i == 0 else " " + word
+            chunk = {"object": "chat.completion.chunk", "model": body["model"], "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.api_base = f"http://127.0.0.1:{port}/v1"
+        self._previous = (openai.api_base, openai.api_key)
+        openai.api_base = self.api_base
+        openai.api_key = "sk-test"
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        openai.api_base, openai.api_key = self._previous
+        await self._runner.cleanup()
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, asdict
+from schemas import ModelEnum, SearchResultSchema, str_to_model_enum
+
+logger = logging.getLogger(__name__)
+
+# share of the budget or deadline used up before the governor starts saving
+DEFAULT_SOFT_LIMIT = 0.8
+# under pressure only this many of each query's top search results are still summarized
+DEFAULT_KEEP_RANKS = 1
+
+class BudgetExceeded(Exception):
+    pass
+
+@dataclass
+class ModelUsage:
+    requests: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cost: float = 0.0
+    # estimated cost of requests that may have been billed without reporting usage,
+    # see llm_client.may_be_billed
+    estimated_unbilled: float = 0.0
+
+    def to_json(self):
+        return asdict(self)
+
+@dataclass
+class GovernorActions:
+    summaries_skipped: int = 0
+    lods_downgraded: int = 0
+    cancelled: str = None
+
+    def to_json(self):
+        return asdict(self)
+
+class BudgetGovernor:
+    # Run-level cost and time ceiling fed by the usage of every completion as it
+    # comes back. Past soft_limit of either ceiling it saves where it can: low ranked
+    # search results are no longer summarized and LODs are generated on the 4K model.
+    # At the ceiling itself every call still in flight is cancelled and the run fails
+    # with BudgetExceeded.
+    def __init__(self, max_cost: float = None, deadline: float = None, soft_limit: float = DEFAULT_SOFT_LIMIT, keep_ranks: int = DEFAULT_KEEP_RANKS):
+        self.max_cost = max_cost
+        # seconds from the start of the run
+        self.deadline = deadline
+        self.soft_limit = soft_limit
+        self.keep_ranks = keep_ranks
+        self.started_at = time.monotonic()
+        self.usage: dict[ModelEnum, ModelUsage] = {}
+        self.actions = GovernorActions()
+        self._task: asyncio.Task = None
+        self._deadline_handle: asyncio.TimerHandle = None
+
+    @property
+    def cost(self) -> float:
+        return sum(usage.cost + usage.estimated_unbilled for usage in self.usage.values())
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def pressure(self) -> float:
+        # the larger of the budget and the deadline used up so far, 0 without limits
+        pressures = [0.0]
+        if self.max_cost is not None:
+            pressures.append(self.cost / self.max_cost if self.max_cost > 0 else 1.0)
+        if self.deadline is not None:
+            pressures.append(self.elapsed / self.deadline if self.deadline > 0 else 1.0)
+        return max(pressures)
+
+    def under_pressure(self) -> bool:
+        return self.pressure() >= self.soft_limit
+
+    def exceeded(self) -> str:
+        # why the run has to stop, or None
+        if self.max_cost is not None and self.cost >= self.max_cost:
+            return f"cost ${self.cost:.4f} reached the budget of ${self.max_cost:.4f}"
+        if self.deadline is not None and self.elapsed >= self.deadline:
+            return f"run time {self.elapsed:.1f}s reached the deadline of {self.deadline:.1f}s"
+        return None
+
+    def check(self):
+        # called before every completion, nothing new starts past a ceiling
+        reason = self.exceeded()
+        if reason is not None:
+            raise BudgetExceeded(reason)
+
+    def record(self, model_name: str, input_tokens: int, output_tokens: int):
+        model = str_to_model_enum(model_name)
+        if model is None:
+            return
+        usage = self.usage.setdefault(model, ModelUsage())
+        pricing = model.value.pricing
+        usage.requests += 1
+        usage.input_tokens += input_tokens
+        usage.output_tokens += output_tokens
+        usage.cost += (input_tokens * pricing["input"] + output_tokens * pricing["output"]) / 1000
+        reason = self.exceeded()
+        if reason is not None:
+            self.cancel(reason)
+
+    def record_unbilled(self, model_name: str, input_tokens: int, output_tokens: int):
+        # a request that reported no usage, charged by estimate without counting as a request
+        model = str_to_model_enum(model_name)
+        if model is None:
+            return
+        pricing = model.value.pricing
+        self.usage.setdefault(model, ModelUsage()).estimated_unbilled += (input_tokens * pricing["input"] + output_tokens * pricing["output"]) / 1000
+        reason = self.exceeded()
+        if reason is not None:
+            self.cancel(reason)
+
+    def admit_summary(self, search_result: SearchResultSchema) -> bool:
+        # search rank stands in for relevancy, which is only known after summarizing
+        if search_result.rank is None or search_result.rank < self.keep_ranks or not self.under_pressure():
+            return True
+        self.actions.summaries_skipped += 1
+        logger.info(f"Budget governor: skipping {search_result.link} (rank {search_result.rank}) at {self.pressure():.0%} of the budget")
+        return False
+
+    def lod_model(self, model: ModelEnum) -> ModelEnum:
+        if model == ModelEnum.GPT3_5_TURBO_4K or not self.under_pressure():
+            return model
+        self.actions.lods_downgraded += 1
+        return ModelEnum.GPT3_5_TURBO_4K
+
+    def cancel(self, reason: str):
+        if self._task is None or self.actions.cancelled is not None:
+            return
+        logger.error(f"Budget governor: cancelling the run, {reason}")
+        self.actions.cancelled = reason
+        self._task.cancel()
+
+    @asynccontextmanager
+    async def enforce(self):
+        # cancels the enclosing task, and with it every call it is waiting on, once a
+        # ceiling is reached; the cancellation comes out as BudgetExceeded
+        self._task = asyncio.current_task()
+        if self.deadline is not None:
+            remaining = max(0.0, self.deadline - self.elapsed)
+            self._deadline_handle = asyncio.get_running_loop().call_later(remaining, self.cancel, f"run time reached the deadline of {self.deadline:.1f}s")
+        try:
+            yield self
+        except asyncio.CancelledError:
+            if self.actions.cancelled is None:
+                raise
+            self._task.uncancel()
+            raise BudgetExceeded(self.actions.cancelled)
+        finally:
+            if self._deadline_handle is not None:
+                self._deadline_handle.cancel()
+            self._task = None
+
+    def to_json(self):
+        return {
+            "cost": self.cost,
+            "elapsed": self.elapsed,
+            "usage": {model.value.official_name: usage.to_json() for model, usage in self.usage.items()},
+            "actions": self.actions.to_json()
+        }
+
+# governor of the running pipeline, None means no limits
+_governor: BudgetGovernor = None
+
+def set_budget_governor(governor: BudgetGovernor):
+    global _governor
+    _governor = governor
+
+def get_budget_governor() -> BudgetGovernor:
+    return _governor
@@ -0,0 +1,129 @@
+import glob
+import json
+import os
+import time
+import uuid
+from schemas import ResearchActionPlanSchema, SearchResultSchema, SearchResultSummary, SectionSchema
+from utils import search_result_from_json, summary_from_json
+
+DEFAULT_RUNS_DIR = "./runs"
+
+class RunCheckpoint:
+    # Everything a run has finished, under runs/<run_id>/, so a crashed run can be
+    # resumed without repeating any LLM or network call. Whole files are written to a
+    # temporary name and renamed into place, and summaries go one line at a time to
+    # summaries.jsonl, where only a torn last line can ever be lost. That line is cut off
+    # when the run is picked up again, so the next summary starts on a line of its own.
+    #   meta.json             prompt and the stages that are done
+    #   plan.json             research action plan
+    #   search_results.json   every search result, written once the search stage is done
+    #   summaries.jsonl       one summary per line, in the order they finished
+    #   sections/NNN.json     each written section with the LODs generated for it so far
+    def __init__(self, run_id: str = None, runs_dir: str = DEFAULT_RUNS_DIR):
+        self.run_id = run_id or time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+        self.run_dir = os.path.join(runs_dir, self.run_id)
+        self.sections_dir = os.path.join(self.run_dir, "sections")
+        os.makedirs(self.sections_dir, exist_ok=True)
+        self.meta = self._read_json("meta.json") or {"run_id": self.run_id, "created_at": time.time(), "completed": []}
+        self._drop_torn_summary()
+
+    @classmethod
+    def resume(cls, run_id: str, runs_dir: str = DEFAULT_RUNS_DIR) -> "RunCheckpoint":
+        if not os.path.exists(os.path.join(runs_dir, run_id, "meta.json")):
+            raise Exception(f"No checkpoint for run '{run_id}' in {runs_dir}")
+        return cls(run_id, runs_dir)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.run_dir, name)
+
+    def _write_atomic(self, path: str, data):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _read_json(self, name: str):
+        try:
+            with open(self._path(name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_complete(self, stage: str) -> bool:
+        return stage in self.meta["completed"]
+
+    def complete(self, stage: str):
+        if stage not in self.meta["completed"]:
+            self.meta["completed"].append(stage)
+            self._write_atomic(self._path("meta.json"), self.meta)
+
+    def save_prompt(self, prompt: str):
+        self.meta["prompt"] = prompt
+        self._write_atomic(self._path("meta.json"), self.meta)
+
+    @property
+    def prompt(self) -> str:
+        return self.meta.get("prompt")
+
+    def save_plan(self, plan: ResearchActionPlanSchema):
+        self._write_atomic(self._path("plan.json"), plan.model_dump(mode="json"))
+        self.complete("plan")
+
+    def load_plan(self) -> ResearchActionPlanSchema:
+        if not self.is_complete("plan"):
+            return None
+        return ResearchActionPlanSchema.model_validate(self._read_json("plan.json"))
+
+    def save_search_results(self, results: list[SearchResultSchema]):
+        self._write_atomic(self._path("search_results.json"), [result.to_json() for result in results])
+        self.complete("search")
+
+    def load_search_results(self) -> list[SearchResultSchema]:
+        if not self.is_complete("search"):
+            return None
+        return [search_result_from_json(result) for result in self._read_json("search_results.json")]
+
+    def append_summary(self, summary: SearchResultSummary):
+        with open(self._path("summaries.jsonl"), "a") as f:
+            f.write(json.dumps(summary.to_json()) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _drop_torn_summary(self):
+        # everything after the last newline is what a crash left of the last summary
+        try:
+            with open(self._path("summaries.jsonl"), "rb+") as f:
+                data = f.read()
+                if data and not data.endswith(b"\n"):
+                    f.truncate(data.rfind(b"\n") + 1)
+        except OSError:
+            pass
+
+    def load_summaries(self) -> dict[str, SearchResultSummary]:
+        # link -> summary of every summary that made it to disk whole
+        summaries = {}
+        try:
+            with open(self._path("summaries.jsonl")) as f:
+                for line in f:
+                    try:
+                        summary = summary_from_json(json.loads(line))
+                    except ValueError:
+                        # torn write from a crash
+                        continue
+                    summaries[summary.source_material.link] = summary
+        except OSError:
+            pass
+        return summaries
+
+    def save_section(self, index: int, section: SectionSchema):
+        self._write_atomic(os.path.join(self.sections_dir, f"{index:03d}.json"), section.to_json())
+
+    def load_sections(self) -> dict[int, SectionSchema]:
+        # index -> section, parallel runs can leave gaps
+        sections = {}
+        for path in glob.glob(os.path.join(self.sections_dir, "*.json")):
+            with open(path) as f:
+                sections[int(os.path.basename(path).split(".")[0])] = SectionSchema(**json.load(f))
+        return sections
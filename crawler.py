@@ -0,0 +1,262 @@
+import asyncio
+import logging
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+from googlesearch import search
+from schemas import ResearchActionPlanSchema, SearchResultSchema
+from utils import parse_site_content, clean_content, build_search_result, build_search_results, MAX_SUMMARY_CHUNKS, DEFAULT_TOKENIZER_THREADS
+from page_cache import PageCache
+from extractor import extract_text, is_html_content_type, EXTRACTORS, NEWSPAPER_EXTRACTOR, LXML_EXTRACTOR
+from dedup import NearDuplicateIndex, DEFAULT_MAX_DISTANCE
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONNECTIONS = 16
+DEFAULT_MAX_PER_HOST = 2
+DEFAULT_MAX_SEARCHES = 4
+DEFAULT_FETCH_TIMEOUT = 15
+DEFAULT_RESULTS_PER_QUERY = 3
+DEFAULT_MAX_PAGE_BYTES = 5 * 1024 * 1024
+READ_CHUNK_BYTES = 64 * 1024
+DEFAULT_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/117.0 Safari/537.36"
+
+def google_search(query: str, num_results: int):
+    return list(search(query, num_results=num_results, advanced=True))
+
+class CrawlerPool:
+    # One pooled aiohttp session for every page fetch and the slots for running searches.
+    # The connector caps open connections globally and per host and keeps them alive
+    # between requests. The papers of a batch or the service share one pool, so the
+    # limits hold for the whole process rather than for each paper.
+    def __init__(self,
+                 max_connections: int = DEFAULT_MAX_CONNECTIONS,
+                 max_per_host: int = DEFAULT_MAX_PER_HOST,
+                 max_searches: int = DEFAULT_MAX_SEARCHES,
+                 fetch_timeout: float = DEFAULT_FETCH_TIMEOUT):
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.fetch_timeout = fetch_timeout
+        self.session: ClientSession = None
+        # googlesearch is blocking, so queries run in worker threads a few at a time
+        self.search_semaphore = asyncio.Semaphore(max_searches)
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        if self.session is None:
+            connector = TCPConnector(limit=self.max_connections, limit_per_host=self.max_per_host)
+            self.session = ClientSession(
+                connector=connector,
+                timeout=ClientTimeout(total=self.fetch_timeout),
+                headers={"User-Agent": DEFAULT_USER_AGENT}
+            )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+class Crawler:
+    # Searches and fetches the pages of one paper. Without a pool it opens its own,
+    # with the given limits, and closes it again on the way out.
+    def __init__(self,
+                 max_connections: int = DEFAULT_MAX_CONNECTIONS,
+                 max_per_host: int = DEFAULT_MAX_PER_HOST,
+                 max_searches: int = DEFAULT_MAX_SEARCHES,
+                 fetch_timeout: float = DEFAULT_FETCH_TIMEOUT,
+                 pool: CrawlerPool = None,
+                 results_per_query: int = DEFAULT_RESULTS_PER_QUERY,
+                 search_fn=google_search,
+                 page_cache: PageCache = None,
+                 dedup: bool = True,
+                 dedup_max_distance: int = DEFAULT_MAX_DISTANCE,
+                 chunk_oversized: bool = False,
+                 max_chunks: int = MAX_SUMMARY_CHUNKS,
+                 tokenizer_threads: int = DEFAULT_TOKENIZER_THREADS,
+                 extractor: str = NEWSPAPER_EXTRACTOR,
+                 max_page_bytes: int = DEFAULT_MAX_PAGE_BYTES):
+        if extractor not in EXTRACTORS:
+            raise Exception(f"Unknown extractor '{extractor}', expected one of {', '.join(EXTRACTORS)}")
+        self._owns_pool = pool is None
+        self.pool = pool if pool is not None else CrawlerPool(max_connections, max_per_host, max_searches, fetch_timeout)
+        self.results_per_query = results_per_query
+        self.search_fn = search_fn
+        self.page_cache = page_cache
+        # syndicated and mirrored pages are dropped before they reach summarization
+        self.dedup_index = NearDuplicateIndex(dedup_max_distance) if dedup else None
+        # pages too long for any summary model are kept and summarized in chunks instead of dropped
+        self.chunk_oversized = chunk_oversized
+        self.max_chunks = max_chunks
+        self.tokenizer_threads = tokenizer_threads
+        self.extractor = extractor
+        # downloads are streamed and abandoned once they pass this size, None reads everything
+        self.max_page_bytes = max_page_bytes
+        # the same url showing up under several queries is only fetched once
+        self._page_tasks: dict[str, asyncio.Task] = {}
+        # best search rank each url reached under any query
+        self._search_ranks: dict[str, int] = {}
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    @property
+    def session(self) -> ClientSession:
+        return self.pool.session
+
+    async def open(self):
+        await self.pool.open()
+
+    async def close(self):
+        for task in self._page_tasks.values():
+            task.cancel()
+        self._page_tasks.clear()
+        # a shared pool outlives the paper
+        if self._owns_pool:
+            await self.pool.close()
+
+    async def search(self, query: str) -> list:
+        async with self.pool.search_semaphore:
+            with span("search", query=query) as search_span:
+                results = await asyncio.to_thread(self.search_fn, query, self.results_per_query)
+                search_span.set(results=len(results))
+        for rank, search_result in enumerate(results):
+            self._search_ranks[search_result.url] = min(rank, self._search_ranks.get(search_result.url, rank))
+        return results
+
+    async def fetch_html(self, url: str, headers: dict = None):
+        async with self.session.get(url, headers=headers) as response:
+            if response.status == 304:
+                return response.status, None, response.headers
+            response.raise_for_status()
+            content_type = response.headers.get("Content-Type")
+            if not is_html_content_type(content_type):
+                raise Exception(f"{url} is not html ({content_type})")
+            limit = self.max_page_bytes
+            if limit is not None and response.content_length is not None and response.content_length > limit:
+                raise Exception(f"{url} is larger than {limit} bytes")
+            body = bytearray()
+            async for chunk in response.content.iter_chunked(READ_CHUNK_BYTES):
+                body += chunk
+                if limit is not None and len(body) > limit:
+                    raise Exception(f"{url} is larger than {limit} bytes")
+            return response.status, bytes(body), response.headers
+
+    async def _fetch_page_content(self, url: str) -> str:
+        with span("fetch", url=url, extractor=self.extractor) as fetch_span:
+            cache = self.page_cache
+            cached = None
+            if cache is not None:
+                entry = cache.lookup(url)
+                if entry is not None:
+                    fetch_span.set(cache="hit")
+                    return entry.text
+                if cache.read_only:
+                    raise Exception(f"{url} is not in the page cache")
+                cached = cache.get(url)
+                if cached is None:
+                    cache.record_miss()
+                fetch_span.set(cache="miss" if cached is None else "stale")
+
+            status, html, headers = await self.fetch_html(url, cache.conditional_headers(cached) if cache else None)
+            if status == 304:
+                if cached is None:
+                    # nothing was asked to be revalidated, so there is no body to fall back on
+                    raise Exception(f"{url} answered 304 Not Modified without a cached copy")
+                fetch_span.set(cache="revalidated")
+                return cache.revalidated(cached, headers.get("ETag"), headers.get("Last-Modified")).text
+
+            fetch_span.set(bytes=len(html), status=status)
+            # parsing is CPU bound, keep it off the event loop
+            if self.extractor == LXML_EXTRACTOR:
+                text = await asyncio.to_thread(extract_text, html)
+                if text == "":
+                    raise Exception("Article text is empty")
+            else:
+                text = await asyncio.to_thread(parse_site_content, url, html)
+                text = clean_content(text)
+            fetch_span.set(chars=len(text))
+            if cache is not None:
+                cache.store(url, html, text, headers.get("ETag"), headers.get("Last-Modified"))
+            return text
+
+    async def fetch_page_content(self, url: str) -> str:
+        task = self._page_tasks.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_page_content(url))
+            self._page_tasks[url] = task
+        return await asyncio.shield(task)
+
+    async def fetch_candidate(self, search_result) -> tuple[str, str, str]:
+        # (title, link, content) of a search hit, None when the page cannot be fetched
+        try:
+            site_content = await self.fetch_page_content(search_result.url)
+        except Exception:
+            return None
+        return search_result.title, search_result.url, site_content
+
+    async def fetch_search_result(self, search_result, research_action_plan: ResearchActionPlanSchema):
+        candidate = await self.fetch_candidate(search_result)
+        if candidate is None:
+            return None
+        result = build_search_result(*candidate, research_action_plan, self.chunk_oversized, self.max_chunks)
+        if result is not None:
+            result.rank = self._search_ranks.get(result.link)
+        return result
+
+    async def fetch_query_candidates(self, query: str) -> list[tuple[str, str, str]]:
+        try:
+            res = await self.search(query)
+        except Exception as e:
+            logger.warning(f"Search failed for query '{query}': {e}")
+            return []
+        candidates = await asyncio.gather(*[self.fetch_candidate(search_result) for search_result in res])
+        return [candidate for candidate in candidates if candidate is not None]
+
+    async def build_search_results(self, candidates: list[tuple[str, str, str]], research_action_plan: ResearchActionPlanSchema) -> list[SearchResultSchema]:
+        # every page is tokenized in one batched call, off the event loop
+        results = await asyncio.to_thread(build_search_results, candidates, research_action_plan, self.chunk_oversized, self.max_chunks, self.tokenizer_threads)
+        results = [result for result in results if result is not None]
+        for result in results:
+            result.rank = self._search_ranks.get(result.link)
+        return results
+
+    async def crawl_query(self, query: str, research_action_plan: ResearchActionPlanSchema) -> list[SearchResultSchema]:
+        return await self.build_search_results(await self.fetch_query_candidates(query), research_action_plan)
+
+    async def stream_query(self, query_index: int, query: str, research_action_plan: ResearchActionPlanSchema, out_queue: asyncio.Queue):
+        # puts ((query_index, rank), result) on the queue as soon as each page is extracted,
+        # waiting whenever the queue is full
+        try:
+            res = await self.search(query)
+        except Exception as e:
+            logger.warning(f"Search failed for query '{query}': {e}")
+            return
+
+        async def fetch_one(rank: int, search_result):
+            result = await self.fetch_search_result(search_result, research_action_plan)
+            # pages arrive out of order here, so the first copy to be extracted is the one kept
+            if result is not None and (self.dedup_index is None or self.dedup_index.add(result) is None):
+                await out_queue.put(((query_index, rank), result))
+
+        await asyncio.gather(*[fetch_one(rank, search_result) for rank, search_result in enumerate(res)])
+
+async def crawl_search_results(research_action_plan: ResearchActionPlanSchema, crawler: Crawler = None, **kwargs) -> list[SearchResultSchema]:
+    # same output as the old sequential loop: results in query order, then search rank
+    if crawler is None:
+        async with Crawler(**kwargs) as crawler:
+            return await crawl_search_results(research_action_plan, crawler)
+
+    per_query = await asyncio.gather(*[crawler.fetch_query_candidates(query) for query in research_action_plan.search_queries])
+    results = await crawler.build_search_results([candidate for candidates in per_query for candidate in candidates], research_action_plan)
+    if crawler.dedup_index is not None:
+        results = crawler.dedup_index.filter(results)
+    return results
@@ -0,0 +1,104 @@
+import hashlib
+import logging
+import re
+from dataclasses import dataclass, asdict
+import numpy as np
+from schemas import SearchResultSchema
+from utils import est_tokens_search_result
+
+logger = logging.getLogger(__name__)
+
+SHINGLE_SIZE = 5
+FINGERPRINT_BITS = 64
+# the fingerprint is split into bands for bucketing, two fingerprints within
+# NUM_BANDS - 1 bits of each other always share at least one whole band
+NUM_BANDS = 4
+BAND_BITS = FINGERPRINT_BITS // NUM_BANDS
+# 3 of 64 bits is roughly 95% similar shingles
+DEFAULT_MAX_DISTANCE = 3
+
+WORD_RE = re.compile(r"\w+")
+
+def simhash(text: str) -> int:
+    # 64 bit SimHash over word shingles, returns None for text without words
+    words = WORD_RE.findall(text.lower())
+    if not words:
+        return None
+    shingles = [" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))]
+    hashes = np.array([int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big") for shingle in shingles], dtype=np.uint64)
+    # count the shingles that set each bit, the fingerprint keeps the majority bits
+    bits = np.unpackbits(hashes.astype(">u8").view(np.uint8).reshape(-1, 8), axis=1)
+    majority = bits.sum(axis=0) * 2 > len(shingles)
+    return int.from_bytes(np.packbits(majority).tobytes(), "big")
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+@dataclass
+class DedupStats:
+    pages: int = 0
+    duplicates: int = 0
+    # one summarization call is skipped per duplicate
+    llm_calls_saved: int = 0
+    input_tokens_saved: int = 0
+    output_tokens_saved: int = 0
+    cost_saved: float = 0.0
+
+    def to_json(self):
+        return asdict(self)
+
+class NearDuplicateIndex:
+    # Online near-duplicate filter for search results. Each page is fingerprinted
+    # once and only compared against the pages sharing one of its bands, so a run
+    # stays linear in the number of pages. The first copy of a page is kept.
+    def __init__(self, max_distance: int = DEFAULT_MAX_DISTANCE):
+        if max_distance >= NUM_BANDS:
+            raise Exception(f"max_distance must be below {NUM_BANDS} for banding to find every duplicate.")
+        self.max_distance = max_distance
+        self.stats = DedupStats()
+        self._buckets: list[dict[int, list[int]]] = [{} for _ in range(NUM_BANDS)]
+        self._kept: list[tuple[int, SearchResultSchema]] = []
+
+    def _bands(self, fingerprint: int) -> list[int]:
+        mask = (1 << BAND_BITS) - 1
+        return [(fingerprint >> (band * BAND_BITS)) & mask for band in range(NUM_BANDS)]
+
+    def find(self, fingerprint: int) -> SearchResultSchema:
+        for band, value in enumerate(self._bands(fingerprint)):
+            for kept_index in self._buckets[band].get(value, []):
+                kept_fingerprint, kept_result = self._kept[kept_index]
+                if hamming_distance(fingerprint, kept_fingerprint) <= self.max_distance:
+                    return kept_result
+        return None
+
+    def add(self, result: SearchResultSchema) -> SearchResultSchema:
+        # returns the earlier result this one duplicates, or None if it was kept
+        self.stats.pages += 1
+        fingerprint = simhash(result.content)
+        if fingerprint is None:
+            return None
+        original = self.find(fingerprint)
+        if original is not None:
+            self.record_duplicate(result, original)
+            return original
+        kept_index = len(self._kept)
+        self._kept.append((fingerprint, result))
+        for band, value in enumerate(self._bands(fingerprint)):
+            self._buckets[band].setdefault(value, []).append(kept_index)
+        return None
+
+    def record_duplicate(self, result: SearchResultSchema, original: SearchResultSchema):
+        input_tokens, output_tokens = est_tokens_search_result(result)
+        self.stats.duplicates += 1
+        self.stats.llm_calls_saved += 1
+        self.stats.input_tokens_saved += input_tokens
+        self.stats.output_tokens_saved += output_tokens
+        self.stats.cost_saved += result.cost
+        logger.info(f"Dropping {result.link}, near duplicate of {original.link}")
+
+    def filter(self, results: list[SearchResultSchema]) -> list[SearchResultSchema]:
+        return [result for result in results if self.add(result) is None]
+
+def dedupe_search_results(results: list[SearchResultSchema], max_distance: int = DEFAULT_MAX_DISTANCE) -> tuple[list[SearchResultSchema], DedupStats]:
+    index = NearDuplicateIndex(max_distance)
+    return index.filter(results), index.stats
@@ -0,0 +1,71 @@
+import re
+from lxml import etree, html as lxml_html
+
+# extractor backends the crawler can use
+NEWSPAPER_EXTRACTOR = "newspaper"
+LXML_EXTRACTOR = "lxml"
+EXTRACTORS = (NEWSPAPER_EXTRACTOR, LXML_EXTRACTOR)
+
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+
+# elements whose text is never part of the article
+SKIPPED_TAGS = {"head", "title", "script", "style", "noscript", "template", "svg", "iframe", "form", "button", "nav", "header", "footer", "aside"}
+# elements that start a new line of text
+BLOCK_TAGS = {
+    "p", "div", "section", "article", "main", "h1", "h2", "h3", "h4", "h5", "h6",
+    "ul", "ol", "li", "dl", "dt", "dd", "table", "tr", "td", "th", "blockquote",
+    "pre", "figure", "figcaption", "br", "hr"
+}
+
+WHITESPACE_RE = re.compile(r"\s+")
+# marks the edges of block elements while the text is collected, newlines in the
+# html source itself are just whitespace (\x1e is whitespace to the regex too)
+BLOCK_BREAK = "\x1e"
+
+def is_html_content_type(content_type: str) -> bool:
+    # pages served without a content type are given the benefit of the doubt
+    if not content_type:
+        return True
+    return content_type.split(";")[0].strip().lower() in HTML_CONTENT_TYPES
+
+def normalize_text(text: str, line_break: str = "\n") -> str:
+    # clean_content in one pass: whitespace runs with a line break become one
+    # newline, every other run becomes one space
+    return WHITESPACE_RE.sub(lambda match: "\n" if line_break in match.group() else " ", text).strip()
+
+def find_content_root(document):
+    # a single <article> is the page's story, several are usually a listing
+    articles = document.findall(".//article")
+    if len(articles) == 1:
+        return articles[0]
+    main = document.find(".//main")
+    if main is not None:
+        return main
+    body = document.find(".//body")
+    return body if body is not None else document
+
+def extract_text(html) -> str:
+    # lightweight alternative to newspaper's Article.parse, the result is already normalized
+    try:
+        document = lxml_html.document_fromstring(html)
+    except (etree.ParserError, ValueError):
+        return ""
+    pieces = []
+    walker = etree.iterwalk(find_content_root(document), events=("start", "end"))
+    for event, element in walker:
+        # comments and processing instructions only contribute their tail
+        tag = element.tag if isinstance(element.tag, str) else None
+        if event == "start":
+            if tag is None or tag in SKIPPED_TAGS:
+                walker.skip_subtree()
+                continue
+            if tag in BLOCK_TAGS:
+                pieces.append(BLOCK_BREAK)
+            if element.text:
+                pieces.append(element.text)
+        else:
+            if tag in BLOCK_TAGS:
+                pieces.append(BLOCK_BREAK)
+            if element.tail:
+                pieces.append(element.tail)
+    return normalize_text("".join(pieces), BLOCK_BREAK)
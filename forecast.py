@@ -0,0 +1,174 @@
+import math
+from dataclasses import dataclass, asdict, field
+from schemas import ModelEnum, ResearchActionPlanSchema, SearchResultSchema, SectionSchema
+from utils import est_tokens_search_result, est_cost_search_result, str_cost_analysis, get_num_tokens, SUMMARY_OUTPUT_TOKENS
+from prompts import get_research_summary_prompt, get_l1_write_prompt, get_l2_outline_prompt_text, get_lod_generation_prompt
+from llm_client import LatencyProfile
+from writer import DEFAULT_MAX_CONCURRENCY
+
+# max_tokens of a section write and of a LOD generation
+SECTION_OUTPUT_TOKENS = 1024
+LOD_OUTPUT_TOKENS = 512
+
+# latency of a model nothing has been measured for: a fixed overhead plus generation time
+DEFAULT_REQUEST_OVERHEAD = 1.0
+DEFAULT_SECONDS_PER_OUTPUT_TOKEN = {
+    ModelEnum.GPT4_8K: 0.05,
+    ModelEnum.GPT4_32K: 0.06,
+    ModelEnum.GPT3_5_TURBO_4K: 0.015,
+    ModelEnum.GPT3_5_TURBO_16K: 0.015,
+}
+
+@dataclass
+class StageForecast:
+    calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cost: float = 0.0
+    wall_time: float = 0.0
+    # calls per model
+    models: dict[str, int] = field(default_factory=dict)
+
+    def add(self, model: ModelEnum, calls: int, input_tokens: int, output_tokens: int, cost: float):
+        self.calls += calls
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        self.cost += cost
+        self.models[model.value.official_name] = self.models.get(model.value.official_name, 0) + calls
+
+    def to_json(self):
+        return asdict(self)
+
+@dataclass
+class RunForecast:
+    stages: dict[str, StageForecast] = field(default_factory=dict)
+    # stages the dry run actually executed, in seconds
+    measured: dict[str, float] = field(default_factory=dict)
+    search_results: int = 0
+
+    @property
+    def input_tokens(self) -> int:
+        return sum(stage.input_tokens for stage in self.stages.values())
+
+    @property
+    def output_tokens(self) -> int:
+        return sum(stage.output_tokens for stage in self.stages.values())
+
+    @property
+    def cost(self) -> float:
+        return sum(stage.cost for stage in self.stages.values())
+
+    @property
+    def wall_time(self) -> float:
+        # the llm stages run one after the other, LOD generation overlaps writing
+        return sum(self.measured.values()) + sum(stage.wall_time for stage in self.stages.values())
+
+    def to_json(self):
+        return {
+            "stages": {name: stage.to_json() for name, stage in self.stages.items()},
+            "measured": self.measured,
+            "search_results": self.search_results,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cost": self.cost,
+            "wall_time": self.wall_time
+        }
+
+def request_latency(model: ModelEnum, output_tokens: int, latency_profile: LatencyProfile = None) -> float:
+    measured = latency_profile.mean(model.value.official_name) if latency_profile is not None else None
+    if measured is not None:
+        return measured
+    return DEFAULT_REQUEST_OVERHEAD + output_tokens * DEFAULT_SECONDS_PER_OUTPUT_TOKEN[model]
+
+def forecast_wall_time(model: ModelEnum, calls: int, tokens: int, output_tokens_per_call: int, concurrency: int, latency_profile: LatencyProfile = None, quota_share: float = 1.0) -> float:
+    if calls == 0:
+        return 0.0
+    waves = math.ceil(calls / concurrency)
+    latency_bound = waves * request_latency(model, output_tokens_per_call, latency_profile)
+    # the first minute of quota is available at once, everything past it is spread out by the rate limiter
+    rpm = model.value.rpm * quota_share
+    tpm = model.value.tpm * quota_share
+    rate_bound = 60 * max(max(0, calls - rpm) / rpm, max(0, tokens - tpm) / tpm)
+    return max(latency_bound, rate_bound)
+
+def forecast_summarization(search_results: list[SearchResultSchema], research_action_plan: ResearchActionPlanSchema, concurrency: int, latency_profile: LatencyProfile = None, quota_share: float = 1.0) -> StageForecast:
+    stage = StageForecast()
+    system_prompt = get_research_summary_prompt(research_action_plan)
+    per_model: dict[ModelEnum, StageForecast] = {}
+    for search_result in search_results:
+        # chunked pages cost one call per chunk, each with the system prompt
+        calls = max(1, len(search_result.chunks))
+        input_tokens, output_tokens = est_tokens_search_result(search_result)
+        input_tokens += calls * get_num_tokens(system_prompt, search_result.model)
+        cost = est_cost_search_result(search_result) + calls * str_cost_analysis(input=system_prompt, model=search_result.model)
+        stage.add(search_result.model, calls, input_tokens, output_tokens, cost)
+        per_model.setdefault(search_result.model, StageForecast()).add(search_result.model, calls, input_tokens, output_tokens, cost)
+    # every model has its own quota, so they make progress side by side
+    stage.wall_time = max([
+        forecast_wall_time(model, model_stage.calls, model_stage.input_tokens + model_stage.output_tokens, SUMMARY_OUTPUT_TOKENS, concurrency, latency_profile, quota_share)
+        for model, model_stage in per_model.items()
+    ], default=0.0)
+    return stage
+
+def forecast_lods(research_action_plan: ResearchActionPlanSchema, parallel: bool = False) -> StageForecast:
+    stage = StageForecast()
+    if parallel:
+        # parallel sections only see the outline, no LODs are generated
+        return stage
+    model = ModelEnum.GPT3_5_TURBO_4K
+    pricing = model.value.pricing
+    # every section but the last, each generated while the next section is written
+    for section_name in research_action_plan.paper_structure[:-1]:
+        prompt = get_lod_generation_prompt(SectionSchema(name=section_name, lods=[""]), research_action_plan)
+        input_tokens = get_num_tokens(prompt, model) + SECTION_OUTPUT_TOKENS
+        stage.add(model, 1, input_tokens, LOD_OUTPUT_TOKENS, (input_tokens * pricing["input"] + LOD_OUTPUT_TOKENS * pricing["output"]) / 1000)
+    return stage
+
+def forecast_writing(research_action_plan: ResearchActionPlanSchema, context_limit: int, num_summaries: int, parallel: bool = False, max_concurrency: int = 1, latency_profile: LatencyProfile = None, quota_share: float = 1.0) -> StageForecast:
+    stage = StageForecast()
+    model = ModelEnum.GPT4_8K
+    pricing = model.value.pricing
+    # at most every summary's details end up in the notes
+    notes_tokens = num_summaries * SUMMARY_OUTPUT_TOKENS
+    for curr_section, section_name in enumerate(research_action_plan.paper_structure):
+        # same split as render_writing_prompt: l1 in full, then half of the rest for l2
+        # with whatever it leaves unused going to the notes in l3
+        l1_tokens = get_num_tokens(get_l1_write_prompt(research_action_plan, section_name), model)
+        remaining = context_limit - l1_tokens
+        if parallel:
+            l2_tokens = min(remaining // 2, get_num_tokens(get_l2_outline_prompt_text(research_action_plan, curr_section), model))
+        else:
+            l2_tokens = min(remaining // 2, curr_section * SECTION_OUTPUT_TOKENS)
+        l3_tokens = min(remaining - l2_tokens, notes_tokens)
+        input_tokens = l1_tokens + l2_tokens + l3_tokens
+        stage.add(model, 1, input_tokens, SECTION_OUTPUT_TOKENS, (input_tokens * pricing["input"] + SECTION_OUTPUT_TOKENS * pricing["output"]) / 1000)
+    concurrency = max_concurrency if parallel else 1
+    stage.wall_time = forecast_wall_time(model, stage.calls, stage.input_tokens + stage.output_tokens, SECTION_OUTPUT_TOKENS, concurrency, latency_profile, quota_share)
+    return stage
+
+def forecast_run(research_action_plan: ResearchActionPlanSchema, search_results: list[SearchResultSchema], **kwargs) -> RunForecast:
+    latency_profile: LatencyProfile = kwargs.get("latency_profile")
+    quota_share = kwargs.get("quota_share", 1.0)
+    parallel = kwargs.get("parallel_sections", False)
+    forecast = RunForecast(search_results=len(search_results))
+    forecast.stages["summarize"] = forecast_summarization(search_results, research_action_plan, kwargs.get("summarize_concurrency", len(search_results) or 1), latency_profile, quota_share)
+    forecast.stages["lods"] = forecast_lods(research_action_plan, parallel)
+    forecast.stages["write"] = forecast_writing(
+        research_action_plan,
+        kwargs.get("context_limit", ModelEnum.GPT4_8K.value.max_context),
+        len(search_results),
+        parallel,
+        kwargs.get("max_section_concurrency", DEFAULT_MAX_CONCURRENCY),
+        latency_profile,
+        quota_share
+    )
+    return forecast
+
+def format_forecast(forecast: RunForecast) -> str:
+    lines = [f"{'stage':<12}{'calls':>8}{'input':>10}{'output':>10}{'cost':>12}{'time':>10}"]
+    for name, seconds in forecast.measured.items():
+        lines.append(f"{name:<12}{'':>8}{'':>10}{'':>10}{'':>12}{seconds:>9.1f}s")
+    for name, stage in forecast.stages.items():
+        lines.append(f"{name:<12}{stage.calls:>8}{stage.input_tokens:>10}{stage.output_tokens:>10}{'$' + format(stage.cost, '.4f'):>12}{stage.wall_time:>9.1f}s")
+    lines.append(f"{'total':<12}{'':>8}{forecast.input_tokens:>10}{forecast.output_tokens:>10}{'$' + format(forecast.cost, '.4f'):>12}{forecast.wall_time:>9.1f}s")
+    return "\n".join(lines)
@@ -4,6 +4,8 @@ from dotenv import load_dotenv
 from enum import Enum
 from utils import generate_search_results
 from schemas import ResearchActionPlanSchema
+from llm_client import llm_session, call_with_retries
+from tracing import span
 
 INITIAL_PROMPT_PARSE_SYSTEM_PROMPT = """
 Based on the given user prompt for research:
@@ -24,19 +26,23 @@ Provide the result in the following JSON format:
 """
 
 async def parse_user_prompt_for_research(user_prompt: str, api_key: str) -> ResearchActionPlanSchema:
-    gpt_json = GPTJSON[ResearchActionPlanSchema](api_key)
+    # retries go through our retry policy like every other call, not gpt_json's own
+    gpt_json = GPTJSON[ResearchActionPlanSchema](api_key, openai_max_retries=1)
     
-    payload = await gpt_json.run(
-        messages=[
-            GPTMessage(
-                role=GPTMessageRole.SYSTEM,
-                content=INITIAL_PROMPT_PARSE_SYSTEM_PROMPT,
-            ),
-            GPTMessage(
-                role=GPTMessageRole.USER,
-                content=f"Prompt: {user_prompt}",
-            )
-        ]
-    )
+    # gpt_json goes through openai, so it picks up the run's pooled session
+    with span("parse_prompt", model=gpt_json.model, retries=0, hedges=0) as parse_span:
+        async with llm_session():
+            payload = await call_with_retries("parse_prompt", gpt_json.model, lambda: gpt_json.run(
+                messages=[
+                    GPTMessage(
+                        role=GPTMessageRole.SYSTEM,
+                        content=INITIAL_PROMPT_PARSE_SYSTEM_PROMPT,
+                    ),
+                    GPTMessage(
+                        role=GPTMessageRole.USER,
+                        content=f"Prompt: {user_prompt}",
+                    )
+                ]
+            ), parse_span)
     
     return payload.response
\ No newline at end of file
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, asdict
+
+DEFAULT_CACHE_PATH = "./cache/llm_responses.sqlite3"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# request parameters that decide what the model returns, everything else
+# (api keys, timeouts, ...) is left out of the cache key
+KEY_PARAMS = ("model", "messages", "temperature", "max_tokens", "top_p", "frequency_penalty", "presence_penalty", "stop", "n", "logit_bias", "functions", "function_call")
+
+@dataclass
+class CallSiteStats:
+    hits: int = 0
+    misses: int = 0
+    # calls that were never looked up, e.g. sampled at temperature > 0 without opting in
+    bypassed: int = 0
+
+def cache_key(params: dict) -> str:
+    keyed = {name: params[name] for name in KEY_PARAMS if name in params}
+    return hashlib.sha256(json.dumps(keyed, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+class LLMResponseCache:
+    # SQLite-backed cache of chat completions keyed on model, messages and sampling
+    # parameters. Responses sampled at temperature > 0 are only reused when
+    # reuse_sampled is set, since a fresh call would give a different answer.
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES, reuse_sampled: bool = False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.reuse_sampled = reuse_sampled
+        self.stats: dict[str, CallSiteStats] = {}
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._conn.commit()
+
+    def _site_stats(self, site: str) -> CallSiteStats:
+        if site not in self.stats:
+            self.stats[site] = CallSiteStats()
+        return self.stats[site]
+
+    def is_cacheable(self, params: dict) -> bool:
+        if params.get("stream"):
+            return False
+        # openai samples at temperature 1 when none is given
+        return params.get("temperature", 1) == 0 or self.reuse_sampled
+
+    def get(self, params: dict, site: str = "default") -> dict:
+        stats = self._site_stats(site)
+        if not self.is_cacheable(params):
+            stats.bypassed += 1
+            return None
+        key = cache_key(params)
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                stats.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        stats.hits += 1
+        return json.loads(row[0])
+
+    def put(self, params: dict, response: dict):
+        if not self.is_cacheable(params):
+            return
+        data = json.dumps(response)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (cache_key(params), params.get("model", ""), data, len(data), now, now)
+            )
+            self._conn.commit()
+            self._evict()
+
+    def size(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def _evict(self):
+        # drop least recently used responses until the cache is back under its bound
+        excess = self.size() - self.max_bytes
+        if excess <= 0:
+            return
+        keys = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            if excess <= 0:
+                break
+            keys.append((key,))
+            excess -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+        self._conn.commit()
+
+    def stats_json(self) -> dict:
+        return {site: asdict(stats) for site, stats in self.stats.items()}
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,352 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+import openai
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, asdict
+from aiohttp import ClientSession, TCPConnector
+from openai.openai_object import OpenAIObject
+from llm_cache import LLMResponseCache
+from tracing import span, Span
+from budget import get_budget_governor
+from schemas import str_to_model_enum
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 32
+DEFAULT_KEEPALIVE_TIMEOUT = 60
+# latencies kept per model for the hedging percentile
+RECENT_LATENCIES = 200
+
+# response cache shared by every completion in the process, None disables caching
+_response_cache: LLMResponseCache = None
+
+def set_response_cache(cache: LLMResponseCache):
+    global _response_cache
+    _response_cache = cache
+
+def get_response_cache() -> LLMResponseCache:
+    return _response_cache
+
+DEFAULT_LATENCY_PROFILE_PATH = "./cache/latency.json"
+
+class LatencyProfile:
+    # Wall time of every completion that actually went to the API, per model.
+    # Saved between runs so forecasts can use measured latency instead of defaults.
+    def __init__(self):
+        # model name -> [requests, total seconds], as saved by earlier runs and as measured since
+        self.saved: dict[str, list] = {}
+        self.measured: dict[str, list] = {}
+        # the latest latencies of this process, not saved
+        self.recent: dict[str, deque] = {}
+
+    def record(self, model: str, seconds: float):
+        samples = self.measured.setdefault(model, [0, 0.0])
+        samples[0] += 1
+        samples[1] += seconds
+        self.recent.setdefault(model, deque(maxlen=RECENT_LATENCIES)).append(seconds)
+
+    def percentile(self, model: str, pct: float, min_samples: int = 1) -> float:
+        # None until min_samples requests to the model were measured
+        recent = sorted(self.recent.get(model, ()))
+        if len(recent) < max(1, min_samples):
+            return None
+        return recent[min(len(recent) - 1, int(len(recent) * pct / 100))]
+
+    def totals(self) -> dict[str, list]:
+        totals = {model: list(samples) for model, samples in self.saved.items()}
+        for model, (requests, seconds) in self.measured.items():
+            samples = totals.setdefault(model, [0, 0.0])
+            samples[0] += requests
+            samples[1] += seconds
+        return totals
+
+    def mean(self, model: str) -> float:
+        # None until the model has been measured
+        samples = self.totals().get(model)
+        if not samples or samples[0] == 0:
+            return None
+        return samples[1] / samples[0]
+
+    def load(self, path: str = DEFAULT_LATENCY_PROFILE_PATH):
+        try:
+            with open(path) as f:
+                self.saved = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def save(self, path: str = DEFAULT_LATENCY_PROFILE_PATH):
+        totals = self.totals()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(totals, f)
+        os.replace(tmp_path, path)
+        self.saved = totals
+        self.measured = {}
+
+latency_profile = LatencyProfile()
+
+def get_latency_profile() -> LatencyProfile:
+    return latency_profile
+
+@asynccontextmanager
+async def llm_session(pool_size: int = DEFAULT_POOL_SIZE, keepalive_timeout: float = DEFAULT_KEEPALIVE_TIMEOUT):
+    # Installs one connection-pooled aiohttp session for every openai call made inside
+    # the block, including calls from tasks it spawns. Nested blocks reuse the
+    # enclosing session, so a run-scoped session set up by the pipeline wins.
+    session = openai.aiosession.get()
+    if session is not None:
+        yield session
+        return
+
+    connector = TCPConnector(limit=pool_size, keepalive_timeout=keepalive_timeout)
+    session = ClientSession(connector=connector)
+    token = openai.aiosession.set(session)
+    try:
+        yield session
+    finally:
+        openai.aiosession.reset(token)
+        await session.close()
+
+@dataclass
+class RetryPolicy:
+    # Failed completions are retried with jittered exponential backoff, waiting at least
+    # as long as a Retry-After header asks. attempt_timeout bounds every attempt and
+    # deadline the whole call with its retries. With hedge_percentile set, an attempt
+    # still running past that percentile of the model's recent latencies gets a
+    # duplicate request and the first answer wins.
+    max_retries: int = 4
+    base_delay: float = 1.0
+    max_delay: float = 30.0
+    attempt_timeout: float = 120.0
+    deadline: float = 600.0
+    hedge_percentile: float = None
+    # the percentile is only trusted after this many requests to the model
+    hedge_min_samples: int = 20
+
+    def backoff(self, retry: int, retry_after: float = None) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+@dataclass
+class CallStats:
+    calls: int = 0
+    retries: int = 0
+    # attempts that ran past attempt_timeout
+    timeouts: int = 0
+    hedges: int = 0
+    # hedges that answered before the attempt they duplicated
+    hedge_wins: int = 0
+    # calls that gave up
+    failures: int = 0
+
+    def to_json(self):
+        return asdict(self)
+
+_retry_policy = RetryPolicy()
+# per-site counters of every call made in the process
+_call_stats: dict[str, CallStats] = {}
+
+def set_retry_policy(policy: RetryPolicy):
+    global _retry_policy
+    _retry_policy = policy
+
+def get_retry_policy() -> RetryPolicy:
+    return _retry_policy
+
+def get_call_stats() -> dict[str, CallStats]:
+    return _call_stats
+
+def is_retryable(error: BaseException) -> bool:
+    # timeouts, rate limits, dropped connections and server errors; bad requests,
+    # auth errors and the budget governor are final
+    if isinstance(error, (TimeoutError, openai.error.Timeout, openai.error.TryAgain, openai.error.APIConnectionError, openai.error.RateLimitError, openai.error.ServiceUnavailableError)):
+        return True
+    return isinstance(error, openai.error.APIError) and (error.http_status or 0) >= 500
+
+def get_retry_after(error: BaseException) -> float:
+    # seconds from a Retry-After header, None without one or for an http date
+    headers = getattr(error, "headers", None) or {}
+    for name, value in headers.items():
+        if name.lower() == "retry-after":
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                return None
+    return None
+
+async def hedged_attempt(model: str, make_call, policy: RetryPolicy, stats: CallStats, streamed: bool = False, call_span: Span = None):
+    async def attempt():
+        start = time.monotonic()
+        result = await asyncio.wait_for(make_call(), policy.attempt_timeout)
+        # a stream is timed by its consumer once it is read to the end
+        if not streamed:
+            latency_profile.record(model, time.monotonic() - start)
+        return result
+
+    # a duplicated stream could only be told apart once both are read
+    threshold = None
+    if policy.hedge_percentile is not None and not streamed:
+        threshold = latency_profile.percentile(model, policy.hedge_percentile, policy.hedge_min_samples)
+    if threshold is None:
+        return await attempt()
+
+    first = asyncio.ensure_future(attempt())
+    tasks = {first}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=threshold)
+        if done:
+            return first.result()
+        stats.hedges += 1
+        if call_span is not None:
+            call_span.add("hedges")
+        hedge = asyncio.ensure_future(attempt())
+        tasks.add(hedge)
+        error = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            answered = [task for task in done if task.exception() is None]
+            if answered:
+                if answered[0] is hedge:
+                    stats.hedge_wins += 1
+                return answered[0].result()
+            error = [task.exception() for task in done][0]
+        # both failed, the retry loop decides what happens next
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+        # let the cancelled attempts finish so they are counted before the call returns
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+def may_be_billed(error: BaseException) -> bool:
+    # the attempt timed out or was cancelled in flight, or the server failed after taking
+    # the request; rate limits and other 4xx are turned away before any work is done
+    if isinstance(error, (asyncio.CancelledError, TimeoutError, openai.error.Timeout)):
+        return True
+    return isinstance(error, openai.error.APIError) and (error.http_status or 0) >= 500
+
+async def call_with_retries(site: str, model: str, make_call, call_span: Span = None, streamed: bool = False, on_unbilled_attempts=None):
+    # awaits make_call() until it answers, retrying and hedging as the retry policy says;
+    # on_unbilled_attempts(attempts) is told how many failed attempts may still have been billed
+    policy = _retry_policy
+    stats = _call_stats.setdefault(site, CallStats())
+    stats.calls += 1
+    retry = 0
+    unbilled_attempts = 0
+
+    async def counted_call():
+        nonlocal unbilled_attempts
+        try:
+            return await make_call()
+        except BaseException as e:
+            if may_be_billed(e):
+                unbilled_attempts += 1
+            raise
+
+    try:
+        async with asyncio.timeout(policy.deadline):
+            while True:
+                try:
+                    return await hedged_attempt(model, counted_call, policy, stats, streamed, call_span)
+                except Exception as e:
+                    if isinstance(e, TimeoutError):
+                        stats.timeouts += 1
+                    if not is_retryable(e) or retry >= policy.max_retries:
+                        raise
+                    delay = policy.backoff(retry, get_retry_after(e))
+                    retry += 1
+                    stats.retries += 1
+                    if call_span is not None:
+                        call_span.add("retries")
+                    logger.warning(f"{site}: {type(e).__name__} from {model}, retry {retry} of {policy.max_retries} in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+    except Exception:
+        stats.failures += 1
+        raise
+    finally:
+        if unbilled_attempts > 0 and on_unbilled_attempts is not None:
+            on_unbilled_attempts(unbilled_attempts)
+
+def count_message_tokens(params: dict) -> int:
+    # input tokens of a request, for replies that do not report their usage
+    from utils import get_num_tokens
+    model = str_to_model_enum(params.get("model", ""))
+    if model is None:
+        return 0
+    return sum(get_num_tokens(message["content"], model) for message in params.get("messages", []))
+
+def record_unbilled_attempts(params: dict, attempts: int):
+    # each counts as the whole prompt plus max_tokens of reply
+    governor = get_budget_governor()
+    if governor is None:
+        return
+    input_tokens = count_message_tokens(params)
+    for _ in range(attempts):
+        governor.record_unbilled(params.get("model", ""), input_tokens, params.get("max_tokens") or 0)
+
+async def chat_completion(site: str, **params):
+    # single entry point for chat completions, `site` names the caller for per-site stats
+    with span("completion", site=site, model=params.get("model"), retries=0, hedges=0) as completion_span:
+        cache = _response_cache
+        if cache is not None:
+            cached = cache.get(params, site)
+            if cached is not None:
+                completion_span.set(cached=True)
+                return OpenAIObject.construct_from(cached)
+
+        governor = get_budget_governor()
+        if governor is not None:
+            governor.check()
+        # retried and hedged, each answered attempt's latency is recorded on the way
+        completion = await call_with_retries(site, params.get("model", ""), lambda: openai.ChatCompletion.acreate(**params), completion_span, on_unbilled_attempts=lambda attempts: record_unbilled_attempts(params, attempts))
+        usage = completion.get("usage")
+        if usage:
+            completion_span.set(prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"))
+            if governor is not None:
+                governor.record(params.get("model", ""), usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
+
+        if cache is not None:
+            cache.put(params, completion.to_dict_recursive())
+        return completion
+
+async def stream_chat_completion(site: str, **params):
+    # yields the reply's content piece by piece as it arrives; a cached reply to the
+    # same request comes back as a single piece
+    with span("completion", activate=False, site=site, model=params.get("model"), retries=0, hedges=0, streamed=True) as completion_span:
+        cache = _response_cache
+        if cache is not None:
+            cached = cache.get(params, site)
+            if cached is not None:
+                completion_span.set(cached=True)
+                yield cached["choices"][0]["message"]["content"]
+                return
+
+        governor = get_budget_governor()
+        if governor is not None:
+            governor.check()
+        pieces = []
+        start = time.monotonic()
+        # only opening the stream is retried, a reply cut off part way fails the call
+        chunks = await call_with_retries(site, params.get("model", ""), lambda: openai.ChatCompletion.acreate(stream=True, **params), completion_span, streamed=True, on_unbilled_attempts=lambda attempts: record_unbilled_attempts(params, attempts))
+        async for chunk in chunks:
+            delta = chunk.choices[0].delta.get("content")
+            if delta:
+                pieces.append(delta)
+                yield delta
+        latency_profile.record(params.get("model", ""), time.monotonic() - start)
+        # streamed replies carry no usage, each chunk is about one token
+        completion_span.set(completion_tokens=len(pieces))
+        if governor is not None:
+            governor.record(params.get("model", ""), count_message_tokens(params), len(pieces))
+
+        if cache is not None:
+            cache.put(params, {"choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(pieces)}, "finish_reason": "stop"}]})
@@ -1,14 +1,16 @@
+import argparse
 import logging
 from dotenv import load_dotenv
-from init_prompt_parser import parse_user_prompt_for_research
 from schemas import ResearchActionPlanSchema, PaperSchema, SearchResultSchema, str_to_model_enum, SearchResultSummary, SectionSchema, ModelEnum
 import os
-from utils import generate_search_results, summarize_results, convert_paper_to_pdf
 import asyncio
 import openai
-from writer import write_paper
+from pipeline import run_pipeline, run_dry_run, run_batch, STAGES
+from extractor import EXTRACTORS
+from service import serve
 
 # 1. Set up the logger
+os.makedirs('./logs', exist_ok=True)
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s',
                     handlers=[logging.StreamHandler(),
@@ -23,34 +25,59 @@ def main(prompt, **kwargs):
         raise Exception("Prompt is required")
     
     openai.api_key = os.getenv("OPENAI_API_KEY")
-    if not openai.api_key:
+    # a dry run from a saved plan never calls the API
+    if not openai.api_key and not (kwargs.get("dry_run") and kwargs.get("plan_path")):
         logger.error("OPENAI_API_KEY is required")  # Logging error
         raise Exception("OPENAI_API_KEY is required")
 
-    logger.info("Parsing the user prompt for research...")  # User feedback
-    action_plan:ResearchActionPlanSchema = asyncio.run(parse_user_prompt_for_research(prompt, openai.api_key))
+    if kwargs.pop("serve", False):
+        # warm process taking jobs over http, see service.py
+        serve(**kwargs)
+        return
 
-    logger.info("Generating search results...")
-    search_results: list[SearchResultSchema] = generate_search_results(action_plan)
+    if kwargs.get("batch_path"):
+        # every prompt of the file, in one event loop, see run_batch
+        asyncio.run(run_batch(kwargs.pop("batch_path"), **kwargs))
+        logger.info("Batch completed!")
+        return
 
-    logger.info("Summarizing research results...")
-    summarized_research = asyncio.run(summarize_results(search_results, action_plan))
-    
-    logger.info("Writing the research paper...")
-    paper: PaperSchema = asyncio.run(write_paper(action_plan, summarized_research, context_limit=kwargs.get("context_limit", ModelEnum.GPT4_8K.value.max_context)))
-
-    # save the paper to a file in outputs
-    logger.info("Saving raw paper to './outputs/paper.json'...")
-    with open('./outputs/paper.json', 'w') as outfile:
-        import json
-        json.dump(paper.to_json(), outfile, indent=4)
+    if kwargs.get("dry_run"):
+        # forecast tokens, cost and time instead of writing the paper
+        asyncio.run(run_dry_run(prompt, **kwargs))
+        logger.info("Dry run completed successfully!")
+        return
 
-    # convert the json paper to a pdf
-    logger.info("Converting to pdf...")
-    convert_paper_to_pdf(paper)
+    # one event loop for the whole run, see pipeline.py for the stages
+    asyncio.run(run_pipeline(prompt, **kwargs))
 
     logger.info("Operation completed successfully!")
 
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Research and write a paper from a prompt.")
+    parser.add_argument("prompt", nargs="?", default="Please write a paper introducing me as a Software Engineer what HuggingFace is and its applications.")
+    parser.add_argument("--context-limit", type=int, default=4000, help="token budget of each section prompt")
+    parser.add_argument("--dry-run", action="store_true", help="search, fetch and count tokens, then forecast the cost and time of the rest of the run")
+    parser.add_argument("--plan", dest="plan_path", help="research plan json to use instead of parsing the prompt")
+    parser.add_argument("--extractor", choices=EXTRACTORS, help="html text extraction backend, newspaper by default")
+    parser.add_argument("--max-cost", type=float, help="budget in dollars, a run is cancelled when its spend reaches it and a dry run fails when the forecast is higher; with --batch it is the budget of the whole batch, not of each paper")
+    parser.add_argument("--deadline", type=float, help="seconds the run may take before it is cancelled; with --batch the whole batch gets this long, not each paper")
+    parser.add_argument("--max-retries", type=int, help="retries of a failed or rate limited LLM call, 4 by default")
+    parser.add_argument("--attempt-timeout", type=float, help="seconds one LLM request may take before it is retried, 120 by default")
+    parser.add_argument("--hedge-percentile", type=float, help="send a duplicate of an LLM request still running past this percentile of the model's latency, off by default")
+    parser.add_argument("--trace-path", help="JSON lines file the run's spans are appended to, ./outputs/trace.jsonl by default")
+    parser.add_argument("--batch", dest="batch_path", help="JSON lines file of {\"prompt\": ..., \"id\": ...} objects to write papers for instead of the prompt")
+    parser.add_argument("--max-papers", type=int, help="papers of a batch in flight at once, 4 by default")
+    parser.add_argument("--serve", action="store_true", help="run as an http service taking research jobs instead of writing one paper")
+    parser.add_argument("--host", help="address the service listens on, 127.0.0.1 by default")
+    parser.add_argument("--port", type=int, help="port the service listens on, 8080 by default")
+    parser.add_argument("--workers", dest="max_workers", type=int, help="papers the service writes at once, 2 by default")
+    parser.add_argument("--max-queued-jobs", type=int, help="jobs the service queues before turning new ones away, 64 by default")
+    parser.add_argument("--run-id", help="name of the run or batch, running a batch again under the same name resumes it")
+    parser.add_argument("--resume", metavar="RUN_ID", help="continue a crashed run from its checkpoint, its prompt is used instead of the one given")
+    parser.add_argument("--runs-dir", help="where run checkpoints are kept, ./runs by default")
+    parser.add_argument("--profile-stage", dest="profile_stages", action="append", choices=STAGES, help="cProfile and tracemalloc this stage, can be repeated")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
-    prompt = "Please write a paper introducing me as a Software Engineer what HuggingFace is and its applications."
-    main(prompt, context_limit=4000)
+    args = parse_args()
+    main(args.prompt, **{name: value for name, value in vars(args).items() if name != "prompt" and value is not None})
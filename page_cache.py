@@ -0,0 +1,226 @@
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass, asdict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+DEFAULT_CACHE_DIR = "./cache/pages"
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# eviction frees space down to this share of max_bytes, so the stores right after it
+# do not each have to rescan every entry again
+DEFAULT_LOW_WATER = 0.9
+
+# query parameters that only track where a click came from and never change the page
+TRACKING_PARAMS = ("utm_", "fbclid", "gclid", "mc_cid", "mc_eid")
+
+def canonical_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    port = parts.port
+    if port and not ((scheme == "http" and port == 80) or (scheme == "https" and port == 443)):
+        host = f"{host}:{port}"
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not k.lower().startswith(TRACKING_PARAMS)]
+    query.sort()
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), ""))
+
+@dataclass
+class PageCacheEntry:
+    url: str
+    text: str
+    content_hash: str
+    html_size: int
+    fetched_at: float
+    etag: str = None
+    last_modified: str = None
+
+@dataclass
+class PageCacheStats:
+    hits: int = 0
+    misses: int = 0
+    revalidated: int = 0
+    stores: int = 0
+    evictions: int = 0
+    bytes_saved: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.revalidated + self.misses
+        return (self.hits + self.revalidated) / total if total else 0.0
+
+    def to_json(self):
+        return {**asdict(self), "hit_rate": self.hit_rate}
+
+class PageCache:
+    # Persistent cache of downloaded pages. Entries are keyed by canonical url and
+    # point at the raw html, which is stored once per content hash, alongside the
+    # clean_content-normalized text so cache hits skip both the download and the parse.
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, ttl: float = DEFAULT_TTL, max_bytes: int = DEFAULT_MAX_BYTES, read_only: bool = False, low_water: float = DEFAULT_LOW_WATER):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.read_only = read_only
+        self.stats = PageCacheStats()
+        # bytes on disk, measured on first use and kept up to date by store and evict
+        self._size: int = None
+        self._entries_dir = os.path.join(cache_dir, "entries")
+        self._html_dir = os.path.join(cache_dir, "html")
+        if not read_only:
+            os.makedirs(self._entries_dir, exist_ok=True)
+            os.makedirs(self._html_dir, exist_ok=True)
+
+    def _entry_path(self, url: str) -> str:
+        key = hashlib.sha256(canonical_url(url).encode("utf-8")).hexdigest()
+        return os.path.join(self._entries_dir, key + ".json")
+
+    def _html_path(self, content_hash: str) -> str:
+        return os.path.join(self._html_dir, content_hash + ".html")
+
+    def _write_atomic(self, path: str, data: bytes):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, url: str) -> PageCacheEntry:
+        try:
+            with open(self._entry_path(url)) as f:
+                return PageCacheEntry(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def get_html(self, entry: PageCacheEntry) -> bytes:
+        with open(self._html_path(entry.content_hash), "rb") as f:
+            return f.read()
+
+    def is_fresh(self, entry: PageCacheEntry) -> bool:
+        return time.time() - entry.fetched_at < self.ttl
+
+    def lookup(self, url: str) -> PageCacheEntry:
+        # returns an entry that can be served without touching the network,
+        # stale entries are still served in read only mode
+        entry = self.get(url)
+        if entry is not None and (self.read_only or self.is_fresh(entry)):
+            self.record_hit(entry)
+            return entry
+        return None
+
+    def conditional_headers(self, entry: PageCacheEntry) -> dict:
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def record_hit(self, entry: PageCacheEntry):
+        self.stats.hits += 1
+        self.stats.bytes_saved += entry.html_size
+        self._touch(entry)
+
+    def record_miss(self):
+        self.stats.misses += 1
+
+    def revalidated(self, entry: PageCacheEntry, etag: str = None, last_modified: str = None) -> PageCacheEntry:
+        # the server answered 304, so the stored copy is good for another ttl
+        self.stats.revalidated += 1
+        self.stats.bytes_saved += entry.html_size
+        entry.fetched_at = time.time()
+        entry.etag = etag or entry.etag
+        entry.last_modified = last_modified or entry.last_modified
+        if not self.read_only:
+            self._write_atomic(self._entry_path(entry.url), json.dumps(asdict(entry)).encode("utf-8"))
+        return entry
+
+    def store(self, url: str, html: bytes, text: str, etag: str = None, last_modified: str = None) -> PageCacheEntry:
+        content_hash = hashlib.sha256(html).hexdigest()
+        entry = PageCacheEntry(
+            url=url,
+            text=text,
+            content_hash=content_hash,
+            html_size=len(html),
+            fetched_at=time.time(),
+            etag=etag,
+            last_modified=last_modified
+        )
+        if self.read_only:
+            return entry
+        size = self.size()
+        html_path = self._html_path(content_hash)
+        if not os.path.exists(html_path):
+            self._write_atomic(html_path, html)
+            size += len(html)
+        entry_path = self._entry_path(url)
+        if os.path.exists(entry_path):
+            size -= os.path.getsize(entry_path)
+        entry_data = json.dumps(asdict(entry)).encode("utf-8")
+        self._write_atomic(entry_path, entry_data)
+        self._size = size + len(entry_data)
+        self.stats.stores += 1
+        self.evict()
+        return entry
+
+    def _touch(self, entry: PageCacheEntry):
+        # entry mtime doubles as the last access time for lru eviction
+        if self.read_only:
+            return
+        try:
+            os.utime(self._entry_path(entry.url))
+        except OSError:
+            pass
+
+    def size(self) -> int:
+        if self._size is not None:
+            return self._size
+        total = 0
+        for directory in (self._entries_dir, self._html_dir):
+            if os.path.isdir(directory):
+                for name in os.listdir(directory):
+                    total += os.path.getsize(os.path.join(directory, name))
+        self._size = total
+        return total
+
+    def evict(self):
+        if self.read_only or self.size() <= self.max_bytes:
+            return
+        entries = []
+        for name in os.listdir(self._entries_dir):
+            path = os.path.join(self._entries_dir, name)
+            try:
+                with open(path) as f:
+                    content_hash = json.load(f)["content_hash"]
+            except (OSError, ValueError, KeyError):
+                content_hash = None
+            entries.append((os.path.getmtime(path), path, content_hash))
+        entries.sort()
+
+        # drop least recently used entries until the cache is back under its low water mark,
+        # html is shared between urls with identical content so it goes with its last entry
+        referenced = {}
+        for _, _, content_hash in entries:
+            referenced[content_hash] = referenced.get(content_hash, 0) + 1
+        # html left behind by urls whose content has since changed goes first
+        for name in os.listdir(self._html_dir):
+            if name.endswith(".html") and name[:-len(".html")] not in referenced:
+                os.remove(os.path.join(self._html_dir, name))
+        self._size = None
+        total = self.size()
+        target = int(self.max_bytes * self.low_water)
+        for _, path, content_hash in entries:
+            if total <= target:
+                break
+            total -= os.path.getsize(path)
+            os.remove(path)
+            self.stats.evictions += 1
+            referenced[content_hash] -= 1
+            if content_hash is not None and referenced[content_hash] == 0:
+                html_path = self._html_path(content_hash)
+                if os.path.exists(html_path):
+                    total -= os.path.getsize(html_path)
+                    os.remove(html_path)
+        self._size = total
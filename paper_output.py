@@ -0,0 +1,24 @@
+import json
+import os
+from schemas import SectionSchema
+
+class PaperOutput:
+    # Appends each finished section to ./outputs/paper.jsonl and ./outputs/paper.md the
+    # moment it is written, so a crash part way through keeps everything before it.
+    def __init__(self, output_dir: str = "./outputs"):
+        os.makedirs(output_dir, exist_ok=True)
+        self.jsonl_path = os.path.join(output_dir, "paper.jsonl")
+        self.markdown_path = os.path.join(output_dir, "paper.md")
+        # start a fresh artifact for every run
+        for path in (self.jsonl_path, self.markdown_path):
+            open(path, "w").close()
+
+    def _append(self, path: str, text: str):
+        with open(path, "a") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def append_section(self, section: SectionSchema):
+        self._append(self.jsonl_path, json.dumps(section.to_json()) + "\n")
+        self._append(self.markdown_path, section.lods[0] + "\n\n")
@@ -0,0 +1,434 @@
+import asyncio
+import contextlib
+import dataclasses
+import json
+import logging
+import os
+import sys
+import time
+import openai
+from init_prompt_parser import parse_user_prompt_for_research
+from schemas import ResearchActionPlanSchema, PaperSchema, SearchResultSchema, SearchResultSummary, SectionSchema, ModelEnum
+from utils import summarize_results, summarize_result_scheduled, convert_paper_to_pdf, load_research_action_plan, MAX_SUMMARY_CHUNKS
+from crawler import Crawler, CrawlerPool, crawl_search_results, DEFAULT_MAX_PAGE_BYTES
+from extractor import NEWSPAPER_EXTRACTOR
+from dedup import DEFAULT_MAX_DISTANCE
+from writer import write_paper, call_callback, DEFAULT_MAX_CONCURRENCY
+from paper_output import PaperOutput
+from page_cache import PageCache, DEFAULT_CACHE_DIR, DEFAULT_TTL
+from llm_cache import LLMResponseCache, DEFAULT_CACHE_PATH
+from llm_client import set_response_cache, llm_session, get_latency_profile, get_retry_policy, set_retry_policy, get_call_stats, DEFAULT_POOL_SIZE, DEFAULT_LATENCY_PROFILE_PATH
+from rate_limiter import RateLimitScheduler
+from forecast import RunForecast, forecast_run, format_forecast
+from tracing import Tracer, span, set_tracer
+from budget import BudgetGovernor, set_budget_governor, DEFAULT_SOFT_LIMIT
+from checkpoint import RunCheckpoint, DEFAULT_RUNS_DIR
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 8
+DEFAULT_NUM_SUMMARIZERS = 8
+# papers of a batch written at once
+DEFAULT_MAX_PAPERS = 4
+# names of the stage spans, in the order they run
+STAGES = ("plan", "search", "summarize", "write", "pdf")
+
+async def gather_or_cancel(*coros):
+    # like asyncio.gather, but the first failure cancels everything still running
+    # instead of leaving producers blocked on a queue nobody reads anymore
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+async def search_and_summarize_streaming(research_action_plan: ResearchActionPlanSchema, crawler: Crawler, scheduler: RateLimitScheduler, queue_size: int = DEFAULT_QUEUE_SIZE, num_summarizers: int = DEFAULT_NUM_SUMMARIZERS, done_summaries: dict[str, SearchResultSummary] = None, on_summary=None) -> list[SearchResultSummary]:
+    # Each search result is handed to a summarizer as soon as its page is extracted,
+    # so crawling and LLM latency overlap. The bounded queue holds the crawler back
+    # when summarization falls behind. Pages in done_summaries are not summarized again.
+    done_summaries = done_summaries or {}
+    queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    summaries: list[tuple[tuple[int, int], SearchResultSummary]] = []
+
+    async def produce():
+        await asyncio.gather(*[
+            crawler.stream_query(query_index, query, research_action_plan, queue)
+            for query_index, query in enumerate(research_action_plan.search_queries)
+        ])
+        # only on success: after a failure gather_or_cancel stops the summarizers, and
+        # waiting for room in a queue nobody reads anymore would hang the run
+        for _ in range(num_summarizers):
+            await queue.put(None)
+
+    async def summarize():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            position, search_result = item
+            summary = done_summaries.get(search_result.link)
+            if summary is None:
+                summary = await summarize_result_scheduled(search_result, research_action_plan, scheduler)
+                if summary is not None and on_summary is not None:
+                    on_summary(summary)
+            if summary is not None:
+                summaries.append((position, summary))
+
+    async with llm_session():
+        await gather_or_cancel(produce(), *[summarize() for _ in range(num_summarizers)])
+
+    # same order as the phased pipeline: query order, then search rank
+    summaries.sort(key=lambda item: item[0])
+    return [summary for _, summary in summaries]
+
+@contextlib.contextmanager
+def stage(name: str, timings: dict[str, float], on_stage=None):
+    # one span per pipeline stage, its duration also goes into timings; on_stage(name)
+    # is told when it starts
+    if on_stage is not None:
+        on_stage(name)
+    with span("stage", stage=name) as stage_span:
+        yield stage_span
+    timings[name] = stage_span.duration
+
+def print_section_token(section_name: str, delta: str):
+    sys.stdout.write(delta)
+    sys.stdout.flush()
+
+async def get_action_plan(prompt: str, **kwargs) -> ResearchActionPlanSchema:
+    # a plan saved by an earlier run skips the parsing call
+    if kwargs.get("plan_path"):
+        logger.info(f"Loading the research plan from '{kwargs['plan_path']}'...")
+        return load_research_action_plan(kwargs["plan_path"])
+    logger.info("Parsing the user prompt for research...")  # User feedback
+    return await parse_user_prompt_for_research(prompt, openai.api_key)
+
+def make_crawler(page_cache: PageCache, **kwargs) -> Crawler:
+    # the http pool is shared when shared_resources made one, the dedup index is per paper
+    return Crawler(
+        page_cache=page_cache,
+        pool=kwargs.get("crawler_pool"),
+        dedup=kwargs.get("dedup", True),
+        dedup_max_distance=kwargs.get("dedup_max_distance", DEFAULT_MAX_DISTANCE),
+        chunk_oversized=kwargs.get("chunk_oversized_pages", False),
+        max_chunks=kwargs.get("max_chunks", MAX_SUMMARY_CHUNKS),
+        extractor=kwargs.get("extractor", NEWSPAPER_EXTRACTOR),
+        max_page_bytes=kwargs.get("max_page_bytes", DEFAULT_MAX_PAGE_BYTES),
+        **{name: kwargs[name] for name in ("search_fn", "results_per_query") if name in kwargs}
+    )
+
+async def search_and_summarize(action_plan: ResearchActionPlanSchema, page_cache: PageCache, checkpoint: RunCheckpoint = None, **kwargs) -> list[SearchResultSummary]:
+    scheduler: RateLimitScheduler = kwargs["scheduler"]
+    timings: dict[str, float] = kwargs.get("timings", {})
+    # summaries and search results a checkpointed attempt already has are reused, so a
+    # resumed run only crawls and summarizes what is missing
+    done_summaries = checkpoint.load_summaries() if checkpoint is not None else {}
+    on_summary = checkpoint.append_summary if checkpoint is not None else None
+    search_results = checkpoint.load_search_results() if checkpoint is not None else None
+    if checkpoint is not None and checkpoint.is_complete("summarize"):
+        if search_results is None:
+            return list(done_summaries.values())
+        return [done_summaries[result.link] for result in search_results if result.link in done_summaries]
+
+    crawler = make_crawler(page_cache, **kwargs)
+    async with crawler:
+        if kwargs.get("streaming", False) and search_results is None:
+            logger.info("Searching and summarizing research results...")
+            # the streaming pipeline overlaps both, so its time is all summarize
+            with stage("summarize", timings, kwargs.get("on_stage")):
+                summarized_research = await search_and_summarize_streaming(
+                    action_plan, crawler, scheduler,
+                    queue_size=kwargs.get("queue_size", DEFAULT_QUEUE_SIZE),
+                    num_summarizers=kwargs.get("num_summarizers", DEFAULT_NUM_SUMMARIZERS),
+                    done_summaries=done_summaries,
+                    on_summary=on_summary
+                )
+        else:
+            if search_results is None:
+                logger.info("Generating search results...")
+                with stage("search", timings, kwargs.get("on_stage")):
+                    search_results = await crawl_search_results(action_plan, crawler)
+                if checkpoint is not None:
+                    checkpoint.save_search_results(search_results)
+
+            logger.info("Summarizing research results...")
+            with stage("summarize", timings, kwargs.get("on_stage")):
+                remaining = [result for result in search_results if result.link not in done_summaries]
+                for summary in await summarize_results(remaining, action_plan, scheduler=scheduler, on_summary=on_summary):
+                    done_summaries[summary.source_material.link] = summary
+            summarized_research = [done_summaries[result.link] for result in search_results if result.link in done_summaries]
+    if checkpoint is not None:
+        checkpoint.complete("summarize")
+    if crawler.dedup_index is not None:
+        dedup_stats = crawler.dedup_index.stats
+        logger.info(f"Near-duplicate pages: {dedup_stats.duplicates} of {dedup_stats.pages} dropped, saving {dedup_stats.llm_calls_saved} LLM calls, ~{dedup_stats.input_tokens_saved + dedup_stats.output_tokens_saved} tokens and ${dedup_stats.cost_saved:.4f}")
+    return summarized_research
+
+async def run_stages(prompt: str, page_cache: PageCache, **kwargs) -> PaperSchema:
+    # seconds spent in each stage, filled in for callers that pass a dict
+    timings: dict[str, float] = kwargs.get("timings", {})
+    output_dir = kwargs.get("output_dir", "./outputs")
+    # every finished unit of work is saved here when given, see checkpoint.py
+    checkpoint: RunCheckpoint = kwargs.get("checkpoint")
+
+    with stage("plan", timings, kwargs.get("on_stage")):
+        action_plan: ResearchActionPlanSchema = checkpoint.load_plan() if checkpoint is not None else None
+        if action_plan is None:
+            action_plan = await get_action_plan(prompt, **kwargs)
+            if checkpoint is not None:
+                checkpoint.save_plan(action_plan)
+
+    # papers of a batch share one, see shared_resources
+    scheduler: RateLimitScheduler = kwargs.get("scheduler") or RateLimitScheduler(share=kwargs.get("quota_share", 1.0))
+
+    summarized_research = await search_and_summarize(action_plan, page_cache, **dict(kwargs, scheduler=scheduler))
+
+    logger.info("Writing the research paper...")
+    # finished sections land in ./outputs/paper.jsonl and paper.md straight away, and with
+    # stream_sections the text is echoed to stdout as it is generated
+    paper_output = PaperOutput(output_dir)
+    # sections kept from an earlier attempt come through on_section like new ones
+    resume_sections = checkpoint.load_sections() if checkpoint is not None else {}
+    # on_section(section) is called with every finished section, after it is saved
+    on_section = kwargs.get("on_section")
+
+    async def append_section(section: SectionSchema):
+        paper_output.append_section(section)
+        if on_section is not None:
+            await call_callback(on_section, section)
+
+    with stage("write", timings, kwargs.get("on_stage")):
+        paper: PaperSchema = await write_paper(
+            action_plan, summarized_research,
+            context_limit=kwargs.get("context_limit", ModelEnum.GPT4_8K.value.max_context),
+            parallel=kwargs.get("parallel_sections", False),
+            max_concurrency=kwargs.get("max_section_concurrency", DEFAULT_MAX_CONCURRENCY),
+            on_token=kwargs.get("on_token", print_section_token if kwargs.get("stream_sections", False) else None),
+            on_section=append_section,
+            resume_sections=resume_sections,
+            on_progress=checkpoint.save_section if checkpoint is not None else None
+        )
+    if checkpoint is not None:
+        checkpoint.complete("write")
+
+    # save the paper to a file in outputs
+    paper_path = os.path.join(output_dir, "paper.json")
+    logger.info(f"Saving raw paper to '{paper_path}'...")
+    with open(paper_path, 'w') as outfile:
+        json.dump(paper.to_json(), outfile, indent=4)
+
+    # convert the json paper to a pdf
+    if kwargs.get("convert_pdf", True):
+        logger.info("Converting to pdf...")
+        with stage("pdf", timings, kwargs.get("on_stage")):
+            # weasyprint blocks for seconds, the other papers of the process keep going
+            await asyncio.to_thread(convert_paper_to_pdf, paper, output_dir)
+    return paper
+
+@contextlib.asynccontextmanager
+async def shared_resources(**kwargs):
+    # Everything the papers of one process share: the LLM response and page caches, the
+    # latency profile, the tracer, the budget governor, one rate limiter per api key, one
+    # keep-alive connection pool for the LLM calls and one for the page fetches and
+    # searches. Yields the page cache, the rate limiter and the crawler pool.
+    # identical requests from earlier runs are answered from disk; our call sites sample at
+    # temperature 0.7, so reusing their answers has to be asked for explicitly
+    llm_cache = LLMResponseCache(
+        path=kwargs.get("llm_cache_path", DEFAULT_CACHE_PATH),
+        reuse_sampled=kwargs.get("reuse_sampled_responses", False)
+    )
+    set_response_cache(llm_cache)
+
+    # pages downloaded by earlier runs are reused, offline reruns only read from the cache
+    page_cache = PageCache(
+        cache_dir=kwargs.get("page_cache_dir", DEFAULT_CACHE_DIR),
+        ttl=kwargs.get("page_cache_ttl", DEFAULT_TTL),
+        read_only=kwargs.get("offline", False)
+    )
+    # leave room for the other jobs sharing the api key
+    scheduler = RateLimitScheduler(share=kwargs.get("quota_share", 1.0))
+    # request latencies measured by earlier runs feed the dry run forecast
+    latency_profile_path = kwargs.get("latency_profile_path", DEFAULT_LATENCY_PROFILE_PATH)
+    get_latency_profile().load(latency_profile_path)
+    # every stage, request, fetch and llm call of the run is traced to a JSON lines file
+    tracer = Tracer(
+        run_id=kwargs.get("run_id"),
+        path=kwargs.get("trace_path", os.path.join(kwargs.get("output_dir", "./outputs"), "trace.jsonl")),
+        profile_stages=kwargs.get("profile_stages"),
+        keep_spans=kwargs.get("keep_spans", True)
+    )
+    set_tracer(tracer)
+    # real spend and run time are held to max_cost dollars and deadline seconds
+    governor = BudgetGovernor(
+        max_cost=kwargs.get("max_cost"),
+        deadline=kwargs.get("deadline"),
+        soft_limit=kwargs.get("budget_soft_limit", DEFAULT_SOFT_LIMIT)
+    )
+    set_budget_governor(governor)
+    # failed and rate limited completions are retried, slow ones hedged past hedge_percentile
+    retry_policy = get_retry_policy()
+    set_retry_policy(dataclasses.replace(retry_policy, **{name: kwargs[name] for name in ("max_retries", "attempt_timeout", "hedge_percentile") if name in kwargs}))
+    try:
+        # every LLM call in the run shares one keep-alive connection pool, every page fetch another
+        with span("run", run_id=tracer.run_id) as run_span:
+            try:
+                async with governor.enforce(), llm_session(pool_size=kwargs.get("llm_pool_size", DEFAULT_POOL_SIZE)), CrawlerPool() as crawler_pool:
+                    yield page_cache, scheduler, crawler_pool
+            finally:
+                run_span.set(budget=governor.to_json())
+    finally:
+        set_tracer(None)
+        set_budget_governor(None)
+        set_retry_policy(retry_policy)
+        set_response_cache(None)
+        llm_cache.close()
+        get_latency_profile().save(latency_profile_path)
+
+    for name, span_totals in tracer.summary().items():
+        logger.info(f"Trace [{name}]: {span_totals['count']} spans, {span_totals['seconds']:.2f}s total, {span_totals['errors']} failed")
+    logger.info(f"Trace written to '{tracer.path}'")
+
+    for model, usage in governor.usage.items():
+        logger.info(f"Usage [{model.value.official_name}]: {usage.requests} requests, {usage.input_tokens} input and {usage.output_tokens} output tokens, ${usage.cost:.4f}, ~${usage.estimated_unbilled:.4f} for failed requests")
+    if governor.actions.summaries_skipped or governor.actions.lods_downgraded:
+        logger.info(f"Budget governor: {governor.actions.summaries_skipped} summaries skipped, {governor.actions.lods_downgraded} LOD generations downgraded")
+
+    for model, queue_stats in scheduler.stats().items():
+        logger.info(f"Rate limiter [{model}]: {queue_stats['admitted']} admitted, {queue_stats['queued']} queued, max queue depth {queue_stats['max_queue_depth']}, avg wait {queue_stats['avg_wait']:.2f}s")
+
+    page_cache_stats = page_cache.stats
+    logger.info(f"Page cache: {page_cache_stats.hits + page_cache_stats.revalidated} hits ({page_cache_stats.revalidated} revalidated), {page_cache_stats.misses} misses, hit rate {page_cache_stats.hit_rate:.0%}, {page_cache_stats.bytes_saved / 1024:.1f} KiB saved")
+
+    for site, site_stats in llm_cache.stats.items():
+        logger.info(f"LLM cache [{site}]: {site_stats.hits} hits, {site_stats.misses} misses, {site_stats.bypassed} bypassed")
+
+    for site, call_stats in get_call_stats().items():
+        logger.info(f"LLM calls [{site}]: {call_stats.calls} calls, {call_stats.retries} retries, {call_stats.timeouts} timeouts, {call_stats.hedges} hedged ({call_stats.hedge_wins} won), {call_stats.failures} failed")
+
+async def run_pipeline(prompt: str, **kwargs) -> PaperSchema:
+    # finished work is saved under runs/<run_id> as it happens, resuming a run picks up
+    # its prompt and everything it already did from there
+    runs_dir = kwargs.get("runs_dir", DEFAULT_RUNS_DIR)
+    if kwargs.get("resume") is not None:
+        checkpoint = RunCheckpoint.resume(kwargs["resume"], runs_dir)
+        prompt = checkpoint.prompt
+        logger.info(f"Resuming run '{checkpoint.run_id}', done: {', '.join(checkpoint.meta['completed']) or 'nothing'}")
+    else:
+        checkpoint = RunCheckpoint(kwargs.get("run_id"), runs_dir)
+        checkpoint.save_prompt(prompt)
+
+    async with shared_resources(**dict(kwargs, run_id=checkpoint.run_id)) as (page_cache, scheduler, crawler_pool):
+        paper = await run_stages(prompt, page_cache, **dict(kwargs, checkpoint=checkpoint, scheduler=scheduler, crawler_pool=crawler_pool))
+    logger.info(f"Checkpoint of run '{checkpoint.run_id}' in '{checkpoint.run_dir}'")
+    return paper
+
+def load_batch(file_path: str) -> list[dict]:
+    # one {"prompt": ..., "id": ...} object per line, id defaults to the line number
+    jobs = []
+    with open(file_path) as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            job = json.loads(line)
+            if not job.get("prompt"):
+                raise Exception(f"No prompt on line {line_number} of {file_path}")
+            jobs.append({"id": str(job.get("id", f"{line_number:03d}")), "prompt": job["prompt"]})
+    if len({job["id"] for job in jobs}) != len(jobs):
+        raise Exception(f"Duplicate ids in {file_path}")
+    return jobs
+
+async def run_batch_job(job: dict, result: dict, page_cache: PageCache, scheduler: RateLimitScheduler, semaphore: asyncio.Semaphore, **kwargs):
+    # one paper of a batch, checkpointed as result["run_id"] and written to result["output_dir"];
+    # the outcome goes into result, which stays "cancelled" if the batch is stopped first
+    async with semaphore:
+        checkpoint = RunCheckpoint(result["run_id"], kwargs.get("runs_dir", DEFAULT_RUNS_DIR))
+        if checkpoint.is_complete("write"):
+            # finished by an earlier attempt of the same batch
+            result["status"] = "skipped"
+            return
+        checkpoint.save_prompt(job["prompt"])
+        start = time.monotonic()
+        try:
+            with span("paper", id=job["id"], run_id=checkpoint.run_id):
+                await run_stages(job["prompt"], page_cache, **dict(kwargs, checkpoint=checkpoint, scheduler=scheduler, output_dir=result["output_dir"]))
+            result["status"] = "done"
+        except Exception as e:
+            # one failed paper does not stop the others, rerunning the batch resumes it
+            logger.error(f"Paper '{job['id']}' failed: {type(e).__name__}: {e}")
+            result["status"] = "failed"
+            result["error"] = f"{type(e).__name__}: {e}"
+        finally:
+            result["seconds"] = time.monotonic() - start
+
+async def run_batch(batch_path: str, **kwargs) -> list[dict]:
+    # Writes a paper for every prompt of a JSON lines file in one event loop. The papers
+    # share the caches, the connection pools, the rate limiter and the budget, and at most
+    # max_papers of them are in flight at once. Running a batch again with its run_id
+    # resumes the papers that failed and skips the finished ones.
+    jobs = load_batch(batch_path)
+    batch_id = kwargs.pop("run_id", None) or time.strftime("%Y%m%d-%H%M%S") + "-batch"
+    batch_dir = os.path.join(kwargs.pop("output_dir", "./outputs"), batch_id)
+    os.makedirs(batch_dir, exist_ok=True)
+    semaphore = asyncio.Semaphore(kwargs.pop("max_papers", DEFAULT_MAX_PAPERS))
+    logger.info(f"Batch '{batch_id}': {len(jobs)} prompts, writing to '{batch_dir}'")
+
+    # papers the budget governor stops before they finish are left "cancelled"
+    results = [
+        {"id": job["id"], "run_id": f"{batch_id}-{job['id']}", "output_dir": os.path.join(batch_dir, job["id"]), "status": "cancelled", "seconds": 0.0, "error": None}
+        for job in jobs
+    ]
+    start = time.monotonic()
+    try:
+        async with shared_resources(run_id=batch_id, output_dir=batch_dir, **kwargs) as (page_cache, scheduler, crawler_pool):
+            await asyncio.gather(*[run_batch_job(job, result, page_cache, scheduler, semaphore, **dict(kwargs, crawler_pool=crawler_pool)) for job, result in zip(jobs, results)])
+    finally:
+        elapsed = time.monotonic() - start
+        with open(os.path.join(batch_dir, "batch.json"), "w") as outfile:
+            json.dump({"batch_id": batch_id, "seconds": elapsed, "papers": results}, outfile, indent=4)
+        counts = {status: sum(result["status"] == status for result in results) for status in ("done", "skipped", "failed", "cancelled")}
+        logger.info(f"Batch '{batch_id}': {counts['done']} written, {counts['skipped']} skipped, {counts['failed']} failed, {counts['cancelled']} cancelled in {elapsed:.1f}s, {counts['done'] / elapsed * 3600:.1f} papers per hour")
+    return results
+
+async def run_dry_run(prompt: str, **kwargs) -> RunForecast:
+    # plans, searches, fetches and counts tokens like a real run, then forecasts the
+    # summarization, LOD and writing stages without calling the completion API for them
+    page_cache = PageCache(
+        cache_dir=kwargs.get("page_cache_dir", DEFAULT_CACHE_DIR),
+        ttl=kwargs.get("page_cache_ttl", DEFAULT_TTL),
+        read_only=kwargs.get("offline", False)
+    )
+    latency_profile = get_latency_profile()
+    latency_profile.load(kwargs.get("latency_profile_path", DEFAULT_LATENCY_PROFILE_PATH))
+
+    measured: dict[str, float] = {}
+    with stage("plan", measured):
+        async with llm_session(pool_size=kwargs.get("llm_pool_size", DEFAULT_POOL_SIZE)):
+            action_plan: ResearchActionPlanSchema = await get_action_plan(prompt, **kwargs)
+
+    logger.info("Generating search results...")
+    with stage("search", measured):
+        async with make_crawler(page_cache, **kwargs) as crawler:
+            search_results: list[SearchResultSchema] = await crawl_search_results(action_plan, crawler)
+
+    # the phased pipeline sends every summary at once, the streaming one keeps num_summarizers busy
+    summarize_concurrency = kwargs.get("num_summarizers", DEFAULT_NUM_SUMMARIZERS) if kwargs.get("streaming", False) else kwargs.get("llm_pool_size", DEFAULT_POOL_SIZE)
+    forecast = forecast_run(
+        action_plan, search_results,
+        latency_profile=latency_profile,
+        summarize_concurrency=summarize_concurrency,
+        **{name: value for name, value in kwargs.items() if name in ("context_limit", "quota_share", "parallel_sections", "max_section_concurrency")}
+    )
+    forecast.measured = measured
+
+    logger.info("Forecast for the rest of the run:\n" + format_forecast(forecast))
+    with open(kwargs.get("forecast_path", "./outputs/forecast.json"), "w") as outfile:
+        json.dump(forecast.to_json(), outfile, indent=4)
+
+    max_cost = kwargs.get("max_cost")
+    if max_cost is not None and forecast.cost > max_cost:
+        logger.error(f"Forecast cost ${forecast.cost:.4f} is over the budget of ${max_cost:.4f}")
+        raise Exception(f"Forecast cost ${forecast.cost:.4f} is over the budget of ${max_cost:.4f}")
+    return forecast
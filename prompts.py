@@ -2,7 +2,9 @@ import math
 import sys
 from typing import Tuple
 from schemas import ResearchActionPlanSchema, SearchResultSchema, PaperSchema, ModelEnum, SearchResultSummary, SectionSchema
-from utils import get_num_tokens, generate_lods
+from utils import get_num_tokens, get_encoder, generate_lods
+from research_index import ResearchIndex
+from tracing import annotate
 import asyncio
 
 def get_research_summary_prompt(research_action_plan: ResearchActionPlanSchema):
@@ -49,43 +51,85 @@ The primary audience is: {research_action_plan.primary_audience}
 The paper structure will be: {", ".join(research_action_plan.paper_structure)}
 """
 
-def get_l2_write_prompt_text(research_action_plan: ResearchActionPlanSchema, curr_section: int, curr_paper: PaperSchema, lods: list[int]):
-    prev_sections = research_action_plan.paper_structure[:curr_section]
-    prev_sections_prompt = ""
-    curr_idx = 0
-    mentioned_text = ""
-    for section in prev_sections:
-        curr_lod = lods[curr_idx]
-        if curr_lod is 0:
-            mentioned_text = f"> In the {section} section, you wrote:"
-        elif curr_lod is 1:
-            mentioned_text = f"> The key details of what you wrote in the {section} section are:"
-        else:
-            mentioned_text = f"> The critical information from what you wrote the {section} section is:"
-        prev_sections_prompt += f"""
+LOD_FULL = 0
+LOD_SUMMARY = 1
+LOD_CRITICAL = 2
+
+def get_l2_section_text(section_name: str, section: SectionSchema, lod: int):
+    if lod == LOD_FULL:
+        mentioned_text = f"> In the {section_name} section, you wrote:"
+    elif lod == LOD_SUMMARY:
+        mentioned_text = f"> The key details of what you wrote in the {section_name} section are:"
+    else:
+        mentioned_text = f"> The critical information from what you wrote the {section_name} section is:"
+    return f"""
 {mentioned_text}
-{curr_paper.sections[curr_idx].lods[curr_lod]}
+{section.lods[lod]}
 """
-        curr_idx += 1
-
 
-    full_l2 = f"""{prev_sections_prompt}
+def get_l2_instruction_text(research_action_plan: ResearchActionPlanSchema, curr_section: int):
+    return f"""
 > You are now in charge of writing the {research_action_plan.paper_structure[curr_section]} section. Make sure that your writing is information dense and fact based. Use markdown formatting.
-""".strip()
-    
+"""
+
+def get_l2_write_prompt_text(research_action_plan: ResearchActionPlanSchema, curr_section: int, curr_paper: PaperSchema, lods: list[int]):
+    prev_sections = research_action_plan.paper_structure[:curr_section]
+    prev_sections_prompt = ""
+    for curr_idx, section in enumerate(prev_sections):
+        prev_sections_prompt += get_l2_section_text(section, curr_paper.sections[curr_idx], lods[curr_idx])
+
+    full_l2 = (prev_sections_prompt + get_l2_instruction_text(research_action_plan, curr_section)).strip()
     full_l2 = "\n" + full_l2 + "\n\n"
     return full_l2
 
-LOD_FULL = 0
-LOD_SUMMARY = 1
-LOD_CRITICAL = 2
-
-async def get_l2_write_prompt(research_action_plan: ResearchActionPlanSchema, curr_section: int, curr_paper: PaperSchema, max_tokens: int) -> str:
+def get_l2_outline_prompt_text(research_action_plan: ResearchActionPlanSchema, curr_section: int, plan_steps: int = None):
+    # context for a section written alongside the others, so no previous prose is available;
+    # plan_steps keeps only the first steps of the research plan
+    research_plan_text = "\n".join(f"- {step}" for step in research_action_plan.research_plan[:plan_steps])
+    outline_text = ""
+    for i, section in enumerate(research_action_plan.paper_structure):
+        marker = " (you are writing this section)" if i == curr_section else ""
+        outline_text += f"{i + 1}. {section}{marker}\n"
+    outline_l2 = f"""
+> The research plan for the paper is:
+{research_plan_text}
+
+> The full outline of the paper is:
+{outline_text}
+> The other sections are being written at the same time by other writers. Only cover what belongs in the {research_action_plan.paper_structure[curr_section]} section and do not repeat material that belongs in the other sections.
+""" + get_l2_instruction_text(research_action_plan, curr_section)
+    return "\n" + outline_l2.strip() + "\n\n"
+
+def get_l2_outline_prompt(research_action_plan: ResearchActionPlanSchema, curr_section: int, max_tokens: int) -> str:
+    # drop research plan steps from the end until the outline fits, then cut the text
+    # from the front so the instructions for the section survive
+    plan_steps = len(research_action_plan.research_plan)
+    l2_text = get_l2_outline_prompt_text(research_action_plan, curr_section, plan_steps)
+    while get_num_tokens(l2_text, ModelEnum.GPT4_8K) > max_tokens and plan_steps > 0:
+        plan_steps -= 1
+        l2_text = get_l2_outline_prompt_text(research_action_plan, curr_section, plan_steps)
+    tokens = get_encoder(ModelEnum.GPT4_8K).encode(l2_text)
+    if len(tokens) > max_tokens:
+        l2_text = get_encoder(ModelEnum.GPT4_8K).decode(tokens[len(tokens) - max(0, max_tokens):])
+    return l2_text
+
+async def get_l2_write_prompt(research_action_plan: ResearchActionPlanSchema, curr_section: int, curr_paper: PaperSchema, max_tokens: int, lod_tasks: dict[int, asyncio.Task] = None) -> str:
     lods = [LOD_FULL] * curr_section
+    section_names = research_action_plan.paper_structure[:curr_section]
+
+    # token cost of every (section, lod) block, computed once per pair instead of
+    # re-tokenizing the whole rendered prompt after every reduction
+    costs: list[dict[int, int]] = [{} for _ in range(curr_section)]
+
+    def block_cost(i: int, lod: int) -> int:
+        if lod not in costs[i]:
+            costs[i][lod] = get_num_tokens(get_l2_section_text(section_names[i], curr_paper.sections[i], lod), ModelEnum.GPT4_8K)
+        return costs[i][lod]
+
+    for i in range(curr_section):
+        for lod in range(len(curr_paper.sections[i].lods)):
+            block_cost(i, lod)
 
-    def update_l2_text():
-        return get_l2_write_prompt_text(research_action_plan, curr_section, curr_paper, lods)
-    
     def compute_score(i: int) -> float:
         distance = abs(i - curr_section)
         detail = lods[i]
@@ -96,33 +140,64 @@ async def get_l2_write_prompt(research_action_plan: ResearchActionPlanSchema, cu
         # choose highest detail at the farthest distance
         return (detail + 1) / (distance ** 2 + 1)
 
-    curr_l2_text = update_l2_text()
-    max_iterations = 3 * len(curr_paper.sections)
-    iteration_count = 0
-
-    
-    while get_num_tokens(curr_l2_text, ModelEnum.GPT4_8K) > max_tokens and iteration_count < max_iterations:
-        iteration_count += 1
-        
-        # Compute scores for all sections
-        scores = [compute_score(i) for i in range(len(curr_paper.sections))]
-        
+    async def reduce_one_lod() -> int:
         # Get the index of the section with the lowest score to reduce its LOD
+        scores = [compute_score(i) for i in range(curr_section)]
         section_to_reduce = scores.index(min(scores))
-        
+
         # If the section with the lowest score is already at maximum LOD, raise exception
         if lods[section_to_reduce] == LOD_CRITICAL:
             raise Exception("Cannot reduce content further to meet token limit.")
-            
+
+        old_cost = block_cost(section_to_reduce, lods[section_to_reduce])
         lods[section_to_reduce] += 1
 
-        # if there is only one LOD, generate the rest
-        if len(curr_paper.sections[section_to_reduce].lods) == 1: 
-            updated_section = await generate_lods(curr_paper.sections[section_to_reduce], research_action_plan)
+        # if the reduced LOD does not exist yet, wait for the background generation started
+        # when the section was written, or generate the rest now
+        if len(curr_paper.sections[section_to_reduce].lods) <= lods[section_to_reduce]:
+            updated_section = None
+            if lod_tasks is not None and section_to_reduce in lod_tasks:
+                lod_stats["lod_waits"] += 1
+                try:
+                    updated_section = await lod_tasks.pop(section_to_reduce)
+                except Exception:
+                    updated_section = None
+            if updated_section is None or len(updated_section.lods) <= lods[section_to_reduce]:
+                lod_stats["lod_generations"] += 1
+                updated_section = await generate_lods(curr_paper.sections[section_to_reduce], research_action_plan)
             curr_paper.sections[section_to_reduce] = updated_section
 
-        curr_l2_text = update_l2_text()
+        return block_cost(section_to_reduce, lods[section_to_reduce]) - old_cost
+
+    max_iterations = 3 * len(curr_paper.sections)
+    iteration_count = 0
+    # background LODs waited on and LODs generated inline, for the trace
+    lod_stats = {"lod_waits": 0, "lod_generations": 0}
+
+    # block costs can be off by about a token at each join, so only render
+    # and count the real text once the estimate is within that slack
+    join_slack = curr_section + 2
+    est_tokens = get_num_tokens(get_l2_instruction_text(research_action_plan, curr_section), ModelEnum.GPT4_8K)
+    est_tokens += sum(block_cost(i, LOD_FULL) for i in range(curr_section))
+    curr_l2_text = None
+    while est_tokens > max_tokens and iteration_count < max_iterations:
+        if est_tokens - max_tokens <= join_slack:
+            curr_l2_text = get_l2_write_prompt_text(research_action_plan, curr_section, curr_paper, lods)
+            if get_num_tokens(curr_l2_text, ModelEnum.GPT4_8K) <= max_tokens:
+                break
+        iteration_count += 1
+        est_tokens += await reduce_one_lod()
+        curr_l2_text = None
+
+    if curr_l2_text is None:
+        curr_l2_text = get_l2_write_prompt_text(research_action_plan, curr_section, curr_paper, lods)
+    # the estimate can also come in low, in which case keep reducing against the real count
+    while get_num_tokens(curr_l2_text, ModelEnum.GPT4_8K) > max_tokens and iteration_count < max_iterations:
+        iteration_count += 1
+        await reduce_one_lod()
+        curr_l2_text = get_l2_write_prompt_text(research_action_plan, curr_section, curr_paper, lods)
 
+    annotate(l2_iterations=iteration_count, l2_lod_waits=lod_stats["lod_waits"], l2_lod_generations=lod_stats["lod_generations"])
     return curr_l2_text
 
 def get_l3_write_prompt_text(research: list[SearchResultSummary], rel_limit: int, section: str, detail_limit: int = -1):
@@ -144,14 +219,11 @@ def get_l3_write_prompt_text(research: list[SearchResultSummary], rel_limit: int
     if not research:
         return "No relevant notes found.", 0
 
-    # if detail limit is not -1, limit the number of details per summary
-    if detail_limit != -1:
-        for summary in research:
-            summary.details = summary.details[:detail_limit]
-
     for summary in research:
+        # if detail limit is not -1, limit the number of details per summary
+        details = summary.details if detail_limit == -1 else summary.details[:detail_limit]
         # add a bullet point list of all details in that summary
-        for detail in summary.details:
+        for detail in details:
             research_list_text += f"- {detail}\n"
 
     
@@ -161,23 +233,12 @@ def get_l3_write_prompt_text(research: list[SearchResultSummary], rel_limit: int
 {research_list_text}
 """, len(research)
 
-def get_l3_write_prompt(curr_section: str, curr_research: list[SearchResultSummary], max_tokens: int):
+def get_l3_write_prompt(curr_section: str, curr_research: list[SearchResultSummary], max_tokens: int, research_index: ResearchIndex = None):
     # start by including all the summaries, go down from there, filtering out the least relevant ones first
-    rel_limit = 0
-    curr_l3_text, detail_limit = get_l3_write_prompt_text(curr_research, rel_limit, curr_section)
-    # while the text is too long, increase the relevancy limit
-    while get_num_tokens(curr_l3_text, ModelEnum.GPT4_8K) > max_tokens:
-        rel_limit += 1
-        if rel_limit > 10:
-            rel_limit = 10
-            # decrease the detail limit if the relevancy limit is too high
-            detail_limit -= 1
-            if detail_limit == 0:
-                # throw an exception if the detail limit is 0
-                raise Exception("Cannot reduce content further to meet token limit.")
-        curr_l3_text, curr_len_details = get_l3_write_prompt_text(curr_research, rel_limit, curr_section, detail_limit)
-
-    return curr_l3_text.strip()
+    # and then limiting the details per summary, picking the first step that fits from the index
+    if research_index is None:
+        research_index = ResearchIndex(curr_research, [curr_section])
+    return research_index.select_notes(curr_section, max_tokens)
 
 def get_lod_generation_prompt(section: SectionSchema, action_plan: ResearchActionPlanSchema):
     return f"""The following is the {section.name.lower()} section of an in progress {action_plan.type_of_paper_to_be_written.lower()} on {action_plan.topic_of_research}. Create a concise bullet point summary of key details from this section. Finally, create one sentence that is a highlights the most critical information in the entire section. Format this as:
@@ -0,0 +1,104 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, asdict
+from schemas import ModelEnum
+
+class TokenBucket:
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    def time_until(self, amount: float) -> float:
+        self._refill()
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_second
+
+    def take(self, amount: float):
+        self._refill()
+        self.tokens -= amount
+
+@dataclass
+class ModelQueueStats:
+    admitted: int = 0
+    queued: int = 0
+    max_queue_depth: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    @property
+    def avg_wait(self) -> float:
+        return self.total_wait / self.admitted if self.admitted else 0.0
+
+    def to_json(self):
+        return {**asdict(self), "avg_wait": self.avg_wait}
+
+class ModelRateLimiter:
+    # Request and token buckets for one model. Waiters are admitted strictly in
+    # arrival order so a large request cannot be starved by a stream of small ones.
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket(rpm, rpm / 60)
+        self.tokens = TokenBucket(tpm, tpm / 60)
+        self.stats = ModelQueueStats()
+        self.queue_depth = 0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, num_tokens: int):
+        # a single request bigger than the whole bucket still has to go through eventually
+        num_tokens = min(num_tokens, self.tokens.capacity)
+        start = time.monotonic()
+        self.queue_depth += 1
+        self.stats.max_queue_depth = max(self.stats.max_queue_depth, self.queue_depth)
+        try:
+            async with self._lock:
+                while True:
+                    wait = max(self.requests.time_until(1), self.tokens.time_until(num_tokens))
+                    if wait <= 0:
+                        break
+                    await asyncio.sleep(wait)
+                self.requests.take(1)
+                self.tokens.take(num_tokens)
+        finally:
+            self.queue_depth -= 1
+        waited = time.monotonic() - start
+        self.stats.admitted += 1
+        if waited > 0.001:
+            self.stats.queued += 1
+        self.stats.total_wait += waited
+        self.stats.max_wait = max(self.stats.max_wait, waited)
+
+class RateLimitScheduler:
+    # Admits LLM requests against a token bucket per ModelEnum. `share` scales every
+    # model's quota down when the API key is shared with other jobs, and `limits`
+    # overrides the (rpm, tpm) pair for individual models.
+    def __init__(self, share: float = 1.0, limits: dict[ModelEnum, tuple[int, int]] = None):
+        self.share = share
+        self.limits = limits or {}
+        self._limiters: dict[ModelEnum, ModelRateLimiter] = {}
+
+    def limiter(self, model: ModelEnum) -> ModelRateLimiter:
+        if model not in self._limiters:
+            rpm, tpm = self.limits.get(model, (model.value.rpm, model.value.tpm))
+            self._limiters[model] = ModelRateLimiter(max(1, int(rpm * self.share)), max(1, int(tpm * self.share)))
+        return self._limiters[model]
+
+    @asynccontextmanager
+    async def admit(self, model: ModelEnum, num_tokens: int):
+        await self.limiter(model).acquire(num_tokens)
+        yield
+
+    def queue_depth(self, model: ModelEnum = None) -> int:
+        if model is not None:
+            return self.limiter(model).queue_depth
+        return sum(limiter.queue_depth for limiter in self._limiters.values())
+
+    def stats(self) -> dict:
+        return {str(model): limiter.stats.to_json() for model, limiter in self._limiters.items()}
@@ -0,0 +1,133 @@
+import numpy as np
+from schemas import SearchResultSummary, ModelEnum
+from utils import get_num_tokens
+from tracing import annotate
+
+NOTES_HEADER = "\n> Notes:\n"
+NO_NOTES_TEXT = "No relevant notes found."
+MAX_RELEVANCY = 10
+# relevancy value for summaries that did not score a section at all
+MISSING_RELEVANCY = -1
+
+class ResearchIndex:
+    # Built once per paper from the summaries. Holds a summaries x sections
+    # relevancy matrix and per-detail token counts with prefix sums, so the
+    # notes that fit any section and budget can be picked by binary search
+    # without re-filtering, re-sorting, re-tokenizing or mutating the summaries.
+    def __init__(self, research: list[SearchResultSummary], sections: list[str]):
+        self.research = research
+        self.sections = list(sections)
+        self.section_ids = {section: i for i, section in enumerate(self.sections)}
+
+        self.relevancy = np.full((len(research), len(self.sections)), MISSING_RELEVANCY, dtype=np.int32)
+        for i, summary in enumerate(research):
+            for section, score in summary.relevancy.items():
+                if section in self.section_ids:
+                    self.relevancy[i, self.section_ids[section]] = score
+
+        self.num_details = np.array([len(summary.details) for summary in research], dtype=np.int64)
+        max_details = int(self.num_details.max()) if len(research) else 0
+        # detail_prefix[i, d] is the token cost of the first d detail lines of summary i
+        detail_tokens = np.zeros((len(research), max_details), dtype=np.int64)
+        for i, summary in enumerate(research):
+            for j, detail in enumerate(summary.details):
+                detail_tokens[i, j] = get_num_tokens(f"- {detail}\n", ModelEnum.GPT4_8K)
+        self.detail_prefix = np.zeros((len(research), max_details + 1), dtype=np.int64)
+        np.cumsum(detail_tokens, axis=1, out=self.detail_prefix[:, 1:])
+
+        self.header_tokens = get_num_tokens(NOTES_HEADER + "\n", ModelEnum.GPT4_8K)
+        self.no_notes_tokens = get_num_tokens(NO_NOTES_TEXT, ModelEnum.GPT4_8K)
+
+        # per-section ordering and reduction schedule, built up front for every section
+        self._orders: dict[str, np.ndarray] = {}
+        self._states: dict[str, list[tuple[int, int]]] = {}
+        self._state_costs: dict[str, np.ndarray] = {}
+        for section in self.sections:
+            self._build_section(section)
+
+    def _section_relevancy(self, section: str) -> np.ndarray:
+        if section in self.section_ids:
+            return self.relevancy[:, self.section_ids[section]]
+        # sections outside the paper structure are scored straight from the summaries
+        return np.array([summary.relevancy.get(section, MISSING_RELEVANCY) for summary in self.research], dtype=np.int32)
+
+    def _build_section(self, section: str):
+        scores = self._section_relevancy(section)
+        # most relevant first, ties keep their original order
+        order = np.argsort(-scores, kind="stable")
+        order = order[scores[order] >= 0]
+        self._orders[section] = order
+
+        # the same reduction schedule the notes have always gone through: raise the
+        # relevancy limit one step at a time, then cap the number of details per summary
+        num_relevant = len(order)
+        states = [(0, -1)]
+        if num_relevant > 0:
+            states += [(rel_limit, num_relevant) for rel_limit in range(1, MAX_RELEVANCY + 1)]
+            states += [(MAX_RELEVANCY, detail_limit) for detail_limit in range(num_relevant - 1, 0, -1)]
+        self._states[section] = states
+        self._state_costs[section] = np.array([self._estimate_cost(section, *state) for state in states], dtype=np.int64)
+
+    def _selected(self, section: str, rel_limit: int) -> np.ndarray:
+        order = self._orders[section]
+        return order[self._section_relevancy(section)[order] >= rel_limit]
+
+    def _estimate_cost(self, section: str, rel_limit: int, detail_limit: int) -> int:
+        selected = self._selected(section, rel_limit)
+        if len(selected) == 0:
+            return self.no_notes_tokens
+        counts = self.num_details[selected]
+        if detail_limit != -1:
+            counts = np.minimum(counts, detail_limit)
+        return self.header_tokens + int(self.detail_prefix[selected, counts].sum())
+
+    def render_notes(self, section: str, rel_limit: int, detail_limit: int = -1) -> tuple[str, int]:
+        if section not in self._orders:
+            self._build_section(section)
+        selected = self._selected(section, rel_limit)
+        if len(selected) == 0:
+            return NO_NOTES_TEXT, 0
+
+        research_list_text = ""
+        for i in selected:
+            details = self.research[i].details
+            if detail_limit != -1:
+                details = details[:detail_limit]
+            # add a bullet point list of all details in that summary
+            for detail in details:
+                research_list_text += f"- {detail}\n"
+
+        return f"""{NOTES_HEADER}{research_list_text}
+""", len(selected)
+
+    def select_notes(self, section: str, max_tokens: int) -> str:
+        if section not in self._orders:
+            self._build_section(section)
+        states = self._states[section]
+        costs = self._state_costs[section]
+
+        # costs only go down along the schedule, so binary search for the first state that fits
+        k = int(np.searchsorted(-costs, -max_tokens, side="left"))
+        # notes rendered and counted before one fit, for the trace
+        renders = 0
+
+        # the estimate sums per-line token counts, which can drift by a token at the
+        # joins, so settle the boundary against the real count of the rendered text
+        if k > 0 and costs[k - 1] - max_tokens <= 2:
+            renders += 1
+            text, _ = self.render_notes(section, *states[k - 1])
+            if get_num_tokens(text, ModelEnum.GPT4_8K) <= max_tokens:
+                annotate(l3_step=k - 1, l3_steps=len(states), l3_renders=renders)
+                return text.strip()
+        while k < len(states):
+            renders += 1
+            text, _ = self.render_notes(section, *states[k])
+            if get_num_tokens(text, ModelEnum.GPT4_8K) <= max_tokens:
+                annotate(l3_step=k, l3_steps=len(states), l3_renders=renders)
+                return text.strip()
+            k += 1
+
+        if len(self._orders[section]) == 0:
+            # nothing left to drop
+            return NO_NOTES_TEXT
+        raise Exception("Cannot reduce content further to meet token limit.")
@@ -8,15 +8,18 @@ class ModelData:
     official_name: str
     max_context: int
     pricing: dict
+    # default per-key quota, requests and tokens per minute
+    rpm: int = 3500
+    tpm: int = 90000
 
     def __str__(self):
         return self.official_name
 
 class ModelEnum(Enum):
-    GPT4_8K = ModelData(official_name="gpt-4", max_context=8000, pricing={"input": 0.03, "output": 0.06})
-    GPT4_32K = ModelData(official_name="gpt-4-32k", max_context=32000, pricing={"input": 0.06, "output": 0.12})
-    GPT3_5_TURBO_4K = ModelData(official_name="gpt-3.5-turbo", max_context=4000, pricing={"input": 0.0015, "output": 0.002})
-    GPT3_5_TURBO_16K = ModelData(official_name="gpt-3.5-turbo-16k", max_context=16000, pricing={"input": 0.003, "output": 0.004})
+    GPT4_8K = ModelData(official_name="gpt-4", max_context=8000, pricing={"input": 0.03, "output": 0.06}, rpm=200, tpm=40000)
+    GPT4_32K = ModelData(official_name="gpt-4-32k", max_context=32000, pricing={"input": 0.06, "output": 0.12}, rpm=20, tpm=150000)
+    GPT3_5_TURBO_4K = ModelData(official_name="gpt-3.5-turbo", max_context=4000, pricing={"input": 0.0015, "output": 0.002}, rpm=3500, tpm=90000)
+    GPT3_5_TURBO_16K = ModelData(official_name="gpt-3.5-turbo-16k", max_context=16000, pricing={"input": 0.003, "output": 0.004}, rpm=3500, tpm=180000)
 
     def __str__(self):
         return self.value.official_name
@@ -43,6 +46,9 @@ class SearchResultSchema(BaseModel):
     content: str
     cost: float = Field(..., description="Estimated cost of processing the search result")
     model: ModelEnum = Field(..., description="Model to use for processing the search result")
+    chunks: list[str] = Field([], description="Pieces of content too long for one summary call, summarized separately and merged")
+    num_tokens: Optional[int] = Field(None, description="Tokens in the content, counted once at ingest")
+    rank: Optional[int] = Field(None, description="Position in the results of the search query that found it, 0 is the top result")
 
     def __str__(self):
         return f"Title: {self.title}\nUrl: {self.link}\nContent: {self.content}\nCost: ${self.cost}\nSummary Model: {self.model}\n\n"
@@ -53,7 +59,10 @@ class SearchResultSchema(BaseModel):
             "link": self.link,
             "content": self.content,
             "cost": self.cost,
-            "model": self.model.value.official_name
+            "model": self.model.value.official_name,
+            "chunks": self.chunks,
+            "num_tokens": self.num_tokens,
+            "rank": self.rank
         }
     
 class SearchResultSummary(BaseModel):
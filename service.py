@@ -0,0 +1,228 @@
+import asyncio
+import bisect
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from aiohttp import web
+from checkpoint import RunCheckpoint, DEFAULT_RUNS_DIR
+from pipeline import run_stages, shared_resources
+from schemas import SectionSchema
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+DEFAULT_MAX_WORKERS = 2
+# jobs waiting for a worker before new ones are turned away
+DEFAULT_MAX_QUEUED_JOBS = 64
+DEFAULT_OUTPUT_DIR = "./outputs/service"
+# statuses a job never leaves
+FINISHED = ("done", "failed")
+# finished jobs are forgotten after this many seconds, or sooner past this many of them
+DEFAULT_JOB_TTL = 60 * 60
+DEFAULT_MAX_FINISHED_JOBS = 1000
+
+@dataclass
+class Job:
+    id: str
+    prompt: str
+    output_dir: str
+    status: str = "queued"
+    stage: str = None
+    sections: int = 0
+    error: str = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: float = None
+    # (sequence number, event, data) in the order they happened, replayed to every new subscriber
+    events: list[tuple[int, str, dict]] = field(default_factory=list)
+    updated: asyncio.Event = field(default_factory=asyncio.Event)
+    next_sequence: int = 0
+
+    def publish(self, event: str, data: dict):
+        self.events.append((self.next_sequence, event, data))
+        self.next_sequence += 1
+        # wake everyone waiting on the current event and start a fresh one
+        self.updated.set()
+        self.updated = asyncio.Event()
+
+    def events_after(self, seen: int) -> list[tuple[int, str, dict]]:
+        return self.events[bisect.bisect_right(self.events, seen, key=lambda item: item[0]):]
+
+    def finish(self, status: str, error: str = None):
+        self.status = status
+        self.error = error
+        self.finished_at = time.time()
+        # the section events carry the whole text, so the tokens are not kept around
+        self.events = [item for item in self.events if item[1] != "token"]
+        self.publish(status, self.to_json())
+
+    def to_json(self):
+        return {
+            "id": self.id,
+            "prompt": self.prompt,
+            "status": self.status,
+            "stage": self.stage,
+            "sections": self.sections,
+            "error": self.error,
+            "created_at": self.created_at
+        }
+
+class ResearchService:
+    # Long-running front end for the pipeline. Jobs go into a bounded queue served by
+    # max_workers workers, all sharing one process's caches, connection pools and rate
+    # limiter, see pipeline.shared_resources. Every job is checkpointed under its id.
+    #   POST /jobs                  {"prompt": ...}, 202 with the job, 503 when the queue is full
+    #   GET  /jobs/{id}             the job's status
+    #   GET  /jobs/{id}/events      server-sent events: status, stage, token, section, done, failed
+    #   GET  /jobs/{id}/paper.json  the finished paper, and paper.pdf
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS, max_queued_jobs: int = DEFAULT_MAX_QUEUED_JOBS, output_dir: str = DEFAULT_OUTPUT_DIR, job_ttl: float = DEFAULT_JOB_TTL, max_finished_jobs: int = DEFAULT_MAX_FINISHED_JOBS, **kwargs):
+        self.max_workers = max_workers
+        self.output_dir = output_dir
+        self.job_ttl = job_ttl
+        self.max_finished_jobs = max_finished_jobs
+        # pipeline options, as run_stages takes them
+        self.kwargs = kwargs
+        self.jobs: dict[str, Job] = {}
+        self.queue: asyncio.Queue[Job] = asyncio.Queue(max_queued_jobs)
+        self._workers: asyncio.Task = None
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/jobs", self.submit)
+        app.router.add_get("/jobs/{id}", self.status)
+        app.router.add_get("/jobs/{id}/events", self.events)
+        app.router.add_get("/jobs/{id}/{name:paper\\.(json|pdf)}", self.artifact)
+        app.cleanup_ctx.append(self.lifecycle)
+        return app
+
+    async def lifecycle(self, app: web.Application):
+        self._workers = asyncio.create_task(self.run_workers())
+        self._workers.add_done_callback(self.workers_stopped)
+        yield
+        self._workers.cancel()
+        await asyncio.gather(self._workers, return_exceptions=True)
+
+    async def run_workers(self):
+        # the shared resources live as long as the workers, so they stay warm between jobs;
+        # a budget or deadline would stop the whole service, not one job
+        async with shared_resources(**dict(self.kwargs, run_id=f"service-{os.getpid()}", output_dir=self.output_dir, max_cost=None, deadline=None, keep_spans=False)) as (page_cache, scheduler, crawler_pool):
+            await asyncio.gather(*[self.worker(page_cache, scheduler, crawler_pool) for _ in range(self.max_workers)])
+
+    def workers_stopped(self, task: asyncio.Task):
+        # nothing takes jobs anymore: say why, fail what is queued and turn new jobs away
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logger.error(f"Service workers stopped: {type(task.exception()).__name__}: {task.exception()}", exc_info=task.exception())
+        while not self.queue.empty():
+            self.queue.get_nowait().finish("failed", "The service workers stopped")
+
+    async def worker(self, page_cache, scheduler, crawler_pool):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self.run_job(job, page_cache, scheduler, crawler_pool)
+            except Exception as e:
+                # run_job handles the pipeline's errors, anything else must not take the worker down
+                logger.exception(f"Worker failed on job '{job.id}'")
+                if job.status not in FINISHED:
+                    job.finish("failed", f"{type(e).__name__}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def run_job(self, job: Job, page_cache, scheduler, crawler_pool):
+        job.status = "running"
+        job.publish("status", {"status": job.status})
+
+        def on_stage(name: str):
+            job.stage = name
+            job.publish("stage", {"stage": name})
+
+        def on_token(section_name: str, delta: str):
+            job.publish("token", {"section": section_name, "text": delta})
+
+        def on_section(section: SectionSchema):
+            job.sections += 1
+            job.publish("section", section.to_json())
+
+        checkpoint = RunCheckpoint(job.id, self.kwargs.get("runs_dir", DEFAULT_RUNS_DIR))
+        try:
+            with span("job", id=job.id):
+                await run_stages(job.prompt, page_cache, **dict(
+                    self.kwargs,
+                    checkpoint=checkpoint, scheduler=scheduler, crawler_pool=crawler_pool, output_dir=job.output_dir,
+                    on_stage=on_stage, on_token=on_token, on_section=on_section
+                ))
+            job.finish("done")
+        except Exception as e:
+            # the worker moves on to the next job
+            logger.error(f"Job '{job.id}' failed: {type(e).__name__}: {e}")
+            job.finish("failed", f"{type(e).__name__}: {e}")
+
+    def forget_finished_jobs(self):
+        # jobs past their ttl, then the oldest ones past max_finished_jobs; their files
+        # stay in output_dir and runs_dir
+        finished = sorted((job for job in self.jobs.values() if job.finished_at is not None), key=lambda job: job.finished_at)
+        expired = [job for job in finished if time.time() - job.finished_at > self.job_ttl]
+        expired += finished[len(expired):max(len(expired), len(finished) - self.max_finished_jobs)]
+        for job in expired:
+            del self.jobs[job.id]
+
+    def get_job(self, request: web.Request) -> Job:
+        job = self.jobs.get(request.match_info["id"])
+        if job is None:
+            raise web.HTTPNotFound(text="No such job")
+        return job
+
+    async def submit(self, request: web.Request):
+        try:
+            body = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest(text="The body must be JSON")
+        if not isinstance(body, dict) or not isinstance(body.get("prompt"), str) or not body["prompt"].strip():
+            raise web.HTTPBadRequest(text="A prompt is required")
+        self.forget_finished_jobs()
+        if self._workers is None or self._workers.done():
+            return web.json_response({"error": "The service workers are not running"}, status=503)
+        if self.queue.full():
+            return web.json_response({"error": "Too many jobs queued, try again later"}, status=503, headers={"Retry-After": "30"})
+        checkpoint = RunCheckpoint(runs_dir=self.kwargs.get("runs_dir", DEFAULT_RUNS_DIR))
+        checkpoint.save_prompt(body["prompt"])
+        job = Job(checkpoint.run_id, body["prompt"], os.path.join(self.output_dir, checkpoint.run_id))
+        self.jobs[job.id] = job
+        self.queue.put_nowait(job)
+        job.publish("status", {"status": job.status, "position": self.queue.qsize()})
+        return web.json_response(job.to_json(), status=202)
+
+    async def status(self, request: web.Request):
+        return web.json_response(self.get_job(request).to_json())
+
+    async def events(self, request: web.Request):
+        job = self.get_job(request)
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        seen = -1
+        while True:
+            # taken before sending, anything published meanwhile has already set it
+            updated = job.updated
+            for sequence, event, data in job.events_after(seen):
+                seen = sequence
+                await response.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+            if job.status in FINISHED and seen == job.next_sequence - 1:
+                break
+            await updated.wait()
+        await response.write_eof()
+        return response
+
+    async def artifact(self, request: web.Request):
+        job = self.get_job(request)
+        path = os.path.join(job.output_dir, request.match_info["name"])
+        if job.status != "done" or not os.path.exists(path):
+            raise web.HTTPNotFound(text="Not written yet")
+        return web.FileResponse(path)
+
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, **kwargs):
+    web.run_app(ResearchService(**kwargs).app(), host=host, port=port)
@@ -0,0 +1,14 @@
+import pytest
+
+@pytest.fixture
+def run_paths(tmp_path) -> dict:
+    # keyword arguments that keep a pipeline run, batch or service inside tmp_path,
+    # with nothing read from or written to the repo's caches and outputs
+    return {
+        "output_dir": str(tmp_path / "outputs"),
+        "runs_dir": str(tmp_path / "runs"),
+        "page_cache_dir": str(tmp_path / "pages"),
+        "llm_cache_path": str(tmp_path / "llm_cache.sqlite"),
+        "latency_profile_path": str(tmp_path / "latency.json"),
+        "convert_pdf": False
+    }
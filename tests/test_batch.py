@@ -0,0 +1,90 @@
+from pipeline import run_batch, load_batch
+from budget import BudgetExceeded
+from benchmarks.openai_stub import OpenAIStub, canned_responder
+from benchmarks.fixture_web import FixtureWeb
+import asyncio
+import json
+import os
+
+PLAN_FILE = "./tests/test_data/parsed_user_prompt_for_research.json"
+
+def max_overlap(spans: list[dict]) -> int:
+    events = sorted([(s["start"], 1) for s in spans] + [(s["start"] + s["duration"], -1) for s in spans])
+    active = peak = 0
+    for _, change in events:
+        active += change
+        peak = max(peak, active)
+    return peak
+
+def test_batch_writes_every_prompt_with_shared_resources(tmp_path, run_paths):
+    batch_path = tmp_path / "prompts.jsonl"
+    with open(batch_path, "w") as f:
+        for i in range(3):
+            f.write(json.dumps({"prompt": f"Write a briefing on Taylor Morrison, take {i}"}) + "\n")
+        f.write("\n")
+        f.write(json.dumps({"id": "board", "prompt": "Write a briefing on Taylor Morrison for the board"}) + "\n")
+    assert [job["id"] for job in load_batch(str(batch_path))] == ["001", "002", "003", "board"]
+    with open(PLAN_FILE) as f:
+        responder = canned_responder(json.load(f))
+
+    async def run():
+        async with OpenAIStub(responder=responder, delay=0.01) as stub, FixtureWeb() as web:
+            results = await run_batch(
+                str(batch_path),
+                run_id="nightly",
+                max_papers=2,
+                search_fn=web.search_fn,
+                **run_paths
+            )
+            return results, stub
+
+    results, stub = asyncio.run(run())
+    assert [result["status"] for result in results] == ["done"] * 4
+    batch_dir = tmp_path / "outputs" / "nightly"
+    for result in results:
+        assert os.path.exists(os.path.join(result["output_dir"], "paper.json"))
+    assert len({result["output_dir"] for result in results}) == 4
+    assert [kind for kind, _, _ in stub.log].count("plan") == 4
+
+    with open(batch_dir / "trace.jsonl") as f:
+        spans = [json.loads(line) for line in f]
+    papers = [s for s in spans if s["name"] == "paper"]
+    assert len(papers) == 4
+    assert max_overlap(papers) <= 2
+    # one page cache: the fixture pages are only downloaded by the first papers to ask
+    fetches = [s for s in spans if s["name"] == "fetch"]
+    assert any(s["attributes"].get("cache") == "hit" for s in fetches)
+
+    # running the batch again only picks up what is unfinished
+    results, stub = asyncio.run(run())
+    assert [result["status"] for result in results] == ["skipped"] * 4
+    assert stub.log == []
+
+def test_batch_over_budget_still_writes_its_report(tmp_path, run_paths):
+    batch_path = tmp_path / "prompts.jsonl"
+    with open(batch_path, "w") as f:
+        for i in range(3):
+            f.write(json.dumps({"prompt": f"Write a briefing on Taylor Morrison, take {i}"}) + "\n")
+    with open(PLAN_FILE) as f:
+        responder = canned_responder(json.load(f))
+
+    async def run():
+        async with OpenAIStub(responder=responder, delay=0.01), FixtureWeb() as web:
+            await run_batch(
+                str(batch_path),
+                run_id="capped",
+                max_papers=2,
+                # the first reply already spends the whole budget of the batch
+                max_cost=0.00001,
+                search_fn=web.search_fn,
+                **run_paths
+            )
+
+    try:
+        asyncio.run(run())
+        assert False, "the budget was spent"
+    except BudgetExceeded:
+        pass
+    with open(tmp_path / "outputs" / "capped" / "batch.json") as f:
+        report = json.load(f)
+    assert [paper["status"] for paper in report["papers"]] == ["cancelled"] * 3
@@ -0,0 +1,45 @@
+import asyncio
+from benchmarks.bench_prompts import measure, l2_case, l3_case, compare
+from benchmarks.load_harness import run_load, parse_latency
+from llm_client import RetryPolicy, get_retry_policy, set_retry_policy
+import prompts
+
+def test_benchmark_cases_report_time_tokenizer_calls_and_memory():
+    generate_lods = prompts.generate_lods
+    name, setup = l2_case(5)
+    result = measure(setup, True, repeat=1)
+    assert name == "get_l2_write_prompt[sections=5]"
+    assert result["median_s"] > 0
+    assert result["tokenizer_calls"] > 0
+    assert result["peak_kib"] > 0
+    # the stub is only in place while the case runs
+    assert prompts.generate_lods is generate_lods
+
+    name, setup = l3_case(10, 5)
+    assert measure(setup, False, repeat=1)["tokenizer_calls"] > 0
+
+def test_compare_against_saved_results(capsys):
+    case = {"median_s": 0.02, "min_s": 0.02, "tokenizer_calls": 10, "token_lookups": 20, "peak_kib": 100.0}
+    baseline = {"meta": {"commit": "abc123"}, "cases": {"case": dict(case, median_s=0.01)}}
+    compare({"cases": {"case": case}}, baseline)
+    assert "2.00x" in capsys.readouterr().out
+
+def test_load_harness_runs_pipelines_offline():
+    report = asyncio.run(run_load(runs=2, concurrency=2, latency=parse_latency(["default=constant:0.01"])))
+    assert report["succeeded"] == 2
+    assert report["failed"] == 0
+    # every call site of the pipeline went to the stub
+    assert set(report["llm_requests"]) == {"plan", "summary", "lod", "section"}
+    for stage in ("plan", "search", "summarize", "write", "total"):
+        assert report["stages"][stage]["p50_s"] > 0
+
+def test_load_harness_reports_injected_errors():
+    previous = get_retry_policy()
+    set_retry_policy(RetryPolicy(max_retries=2, base_delay=0.001))
+    try:
+        report = asyncio.run(run_load(runs=2, concurrency=2, error_rate_500=1.0))
+    finally:
+        set_retry_policy(previous)
+    # the plan call fails every run once its retries are spent
+    assert report["failed"] == 2
+    assert report["llm_requests"]["plan"]["500"] == 6
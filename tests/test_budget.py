@@ -0,0 +1,104 @@
+from schemas import ResearchActionPlanSchema, SearchResultSchema, SectionSchema, ModelEnum
+from utils import load_research_action_plan, summarize_results, generate_lods
+from budget import BudgetGovernor, BudgetExceeded, set_budget_governor
+from benchmarks.openai_stub import OpenAIStub, canned_responder
+import asyncio
+import json
+import time
+
+PLAN_FILE = "./tests/test_data/parsed_user_prompt_for_research.json"
+
+def make_result(rank: int) -> SearchResultSchema:
+    return SearchResultSchema(title=f"Page {rank}", link=f"https://example.com/{rank}", content="Taylor Morrison builds homes. " * 20, cost=0.001, model=ModelEnum.GPT3_5_TURBO_4K, rank=rank)
+
+def test_governor_prices_usage_per_model_and_saves_under_pressure():
+    governor = BudgetGovernor(max_cost=1.0, soft_limit=0.5)
+    governor.record("gpt-4", 1000, 1000)
+    governor.record("gpt-3.5-turbo", 2000, 1000)
+    assert governor.usage[ModelEnum.GPT4_8K].cost == 0.03 + 0.06
+    assert governor.usage[ModelEnum.GPT3_5_TURBO_4K].requests == 1
+    assert not governor.under_pressure()
+    assert governor.admit_summary(make_result(2))
+    assert governor.lod_model(ModelEnum.GPT3_5_TURBO_16K) == ModelEnum.GPT3_5_TURBO_16K
+
+    governor.record("gpt-4", 15000, 0)
+    assert governor.under_pressure()
+    # the top result of every query is still summarized
+    assert governor.admit_summary(make_result(0))
+    assert not governor.admit_summary(make_result(2))
+    assert governor.lod_model(ModelEnum.GPT3_5_TURBO_16K) == ModelEnum.GPT3_5_TURBO_4K
+    assert governor.actions.summaries_skipped == 1
+    assert governor.actions.lods_downgraded == 1
+
+    governor.record("gpt-4", 20000, 0)
+    try:
+        governor.check()
+        assert False, "the budget is spent"
+    except BudgetExceeded:
+        pass
+
+def test_deadline_cancels_in_flight_requests():
+    action_plan: ResearchActionPlanSchema = load_research_action_plan(PLAN_FILE)
+    governor = BudgetGovernor(deadline=0.3)
+
+    async def run():
+        async with OpenAIStub(delay=2.5):
+            start = time.monotonic()
+            try:
+                async with governor.enforce():
+                    await summarize_results([make_result(rank) for rank in range(4)], action_plan)
+            except BudgetExceeded as e:
+                # the replies are still seconds away when the run gives up
+                return str(e), time.monotonic() - start
+
+    set_budget_governor(governor)
+    try:
+        reason, elapsed = asyncio.run(run())
+    finally:
+        set_budget_governor(None)
+    assert "deadline" in reason
+    assert elapsed < 1.5
+
+def test_spend_over_budget_cancels_the_run():
+    action_plan: ResearchActionPlanSchema = load_research_action_plan(PLAN_FILE)
+    # the first reply is already over budget, the slower ones never finish
+    governor = BudgetGovernor(max_cost=0.00001)
+    with open(PLAN_FILE) as f:
+        responder = canned_responder(json.load(f))
+
+    async def run():
+        async with OpenAIStub(responder=responder, delay=0.05) as stub:
+            async with governor.enforce():
+                await summarize_results([make_result(0)], action_plan)
+                await summarize_results([make_result(rank) for rank in range(1, 4)], action_plan)
+            return stub
+
+    set_budget_governor(governor)
+    try:
+        asyncio.run(run())
+        assert False, "the budget was spent"
+    except BudgetExceeded as e:
+        assert "budget" in str(e)
+    finally:
+        set_budget_governor(None)
+    assert governor.usage[ModelEnum.GPT3_5_TURBO_4K].requests == 1
+
+def test_lods_move_to_the_4k_model_under_pressure():
+    action_plan: ResearchActionPlanSchema = load_research_action_plan(PLAN_FILE)
+    # too long for the 4K model, so it would normally go to the 16K one
+    section = SectionSchema(name="Introduction", lods=["Taylor Morrison builds homes across many markets. " * 600])
+    with open(PLAN_FILE) as f:
+        responder = canned_responder(json.load(f))
+
+    async def run():
+        async with OpenAIStub(responder=responder) as stub:
+            await generate_lods(section, action_plan)
+            return stub
+
+    set_budget_governor(BudgetGovernor(max_cost=1.0, soft_limit=0.0))
+    try:
+        stub = asyncio.run(run())
+    finally:
+        set_budget_governor(None)
+    assert stub.requests[0]["model"] == "gpt-3.5-turbo"
+    assert len(section.lods) == 3
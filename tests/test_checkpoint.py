@@ -0,0 +1,84 @@
+from schemas import ResearchActionPlanSchema, SearchResultSummary
+from utils import load_summary, load_research_action_plan
+from checkpoint import RunCheckpoint
+from pipeline import run_pipeline
+from benchmarks.openai_stub import OpenAIStub, canned_responder, request_kind
+from benchmarks.fixture_web import FixtureWeb
+import asyncio
+import json
+import os
+
+PLAN_FILE = "./tests/test_data/parsed_user_prompt_for_research.json"
+
+def test_checkpoint_round_trip_survives_a_torn_summary_line(tmp_path):
+    action_plan: ResearchActionPlanSchema = load_research_action_plan(PLAN_FILE)
+    summaries: list[SearchResultSummary] = load_summary("./tests/test_data/summary.json")
+    checkpoint = RunCheckpoint("run-1", str(tmp_path))
+    checkpoint.save_prompt("Write about Taylor Morrison")
+    checkpoint.save_plan(action_plan)
+    checkpoint.save_search_results([summary.source_material for summary in summaries])
+    for summary in summaries[:2]:
+        checkpoint.append_summary(summary)
+    # a crash in the middle of the third one
+    with open(os.path.join(checkpoint.run_dir, "summaries.jsonl"), "a") as f:
+        f.write(json.dumps(summaries[2].to_json())[:50])
+
+    resumed = RunCheckpoint.resume("run-1", str(tmp_path))
+    assert resumed.prompt == "Write about Taylor Morrison"
+    assert resumed.load_plan() == action_plan
+    assert [result.link for result in resumed.load_search_results()] == [summary.source_material.link for summary in summaries]
+    assert list(resumed.load_summaries()) == [summary.source_material.link for summary in summaries[:2]]
+    assert not resumed.is_complete("summarize")
+    assert not any(name.endswith(".tmp") for name in os.listdir(resumed.run_dir))
+    # the resumed run summarizes the third one again and keeps it this time
+    resumed.append_summary(summaries[2])
+    assert list(RunCheckpoint.resume("run-1", str(tmp_path)).load_summaries()) == [summary.source_material.link for summary in summaries[:3]]
+    try:
+        RunCheckpoint.resume("missing", str(tmp_path))
+        assert False, "there is no such run"
+    except Exception as e:
+        assert "missing" in str(e)
+
+def test_resumed_run_repeats_no_finished_llm_calls(tmp_path, run_paths):
+    with open(PLAN_FILE) as f:
+        research_action_plan = json.load(f)
+    respond = canned_responder(research_action_plan)
+    sections_written = []
+
+    def crash_on_third_section(body: dict) -> str:
+        if request_kind(body) == "section":
+            sections_written.append(body)
+            if len(sections_written) == 3:
+                raise Exception("crash")
+        return respond(body)
+
+    async def run(responder, **kwargs):
+        async with OpenAIStub(responder=responder) as stub, FixtureWeb() as web:
+            try:
+                await run_pipeline(
+                    "Write a briefing on Taylor Morrison for a business meeting",
+                    search_fn=web.search_fn,
+                    **run_paths,
+                    **kwargs
+                )
+            except Exception as e:
+                return stub, e
+            return stub, None
+
+    # without retries the crash fails the run
+    first, error = asyncio.run(run(crash_on_third_section, run_id="crashed", max_retries=0))
+    assert "500" in str(error)
+    assert len(sections_written) == 3
+    assert not os.path.exists(tmp_path / "outputs" / "paper.json")
+    checkpoint = RunCheckpoint.resume("crashed", str(tmp_path / "runs"))
+    assert sorted(checkpoint.load_sections()) == [0, 1]
+
+    second, error = asyncio.run(run(respond, resume="crashed"))
+    assert error is None
+    kinds = [kind for kind, _, _ in second.log]
+    assert "plan" not in kinds and "summary" not in kinds
+    assert kinds.count("section") == len(research_action_plan["paper_structure"]) - 2
+    with open(tmp_path / "outputs" / "paper.json") as f:
+        assert len(json.load(f)["sections"]) == len(research_action_plan["paper_structure"])
+    assert RunCheckpoint.resume("crashed", str(tmp_path / "runs")).is_complete("write")
+    assert [kind for kind, _, _ in first.log].count("summary") > 0
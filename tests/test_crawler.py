@@ -0,0 +1,169 @@
+from schemas import ResearchActionPlanSchema, SearchResultSchema, ModelEnum
+from utils import load_research_action_plan
+from crawler import Crawler, CrawlerPool, crawl_search_results
+from page_cache import PageCache
+from aiohttp import web
+from collections import namedtuple
+import asyncio
+
+FakeSearchResult = namedtuple("FakeSearchResult", ["url", "title", "description"])
+
+PAGE_TEMPLATE = """<html><head><title>{title}</title></head><body><article>
+<h1>{title}</h1>
+<p>Taylor Morrison is one of the nation's leading homebuilders and developers, based in Scottsdale, Arizona, with operations across 19 markets in 11 states.</p>
+<p>The company serves first-time, move-up, luxury and resort lifestyle homebuyers and renters under its family of brands, and reported strong results for page {title}.</p>
+<p>With a company legacy dating back over 100 years, it is committed to developing sustainable communities in which homebuyers aspire to live.</p>
+</article></body></html>"""
+
+async def start_fixture_server(delay: float = 0.0):
+    state = {"active": 0, "max_active": 0, "requests": 0}
+
+    async def page(request: web.Request):
+        state["requests"] += 1
+        state["active"] += 1
+        state["max_active"] = max(state["max_active"], state["active"])
+        try:
+            await asyncio.sleep(delay)
+            name = request.match_info["name"]
+            if name == "missing":
+                raise web.HTTPNotFound()
+            if name == "not-modified":
+                # a server that answers 304 whatever the request asked
+                return web.Response(status=304)
+            if name == "report.pdf":
+                return web.Response(body=b"%PDF-1.4 not a web page", content_type="application/pdf")
+            if name == "huge":
+                paragraphs = "".join(f"<p>Paragraph {i} of a very long page about homebuilders.</p>" for i in range(5000))
+                return web.Response(text=PAGE_TEMPLATE.format(title=name).replace("</article>", paragraphs + "</article>"), content_type="text/html")
+            return web.Response(text=PAGE_TEMPLATE.format(title=name), content_type="text/html")
+        finally:
+            state["active"] -= 1
+
+    app = web.Application()
+    app.router.add_get("/pages/{name}", page)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}", state
+
+def make_search_fn(base_url: str, pages_per_query: dict[str, list[str]]):
+    def search_fn(query: str, num_results: int):
+        return [FakeSearchResult(f"{base_url}/pages/{name}", name, "") for name in pages_per_query[query][:num_results]]
+    return search_fn
+
+def test_crawl_search_results_keeps_query_order_and_skips_failures():
+    action_plan: ResearchActionPlanSchema = load_research_action_plan("./tests/test_data/parsed_user_prompt_for_research.json")
+    action_plan.search_queries = ["first", "second"]
+
+    async def run():
+        runner, base_url, state = await start_fixture_server(delay=0.05)
+        try:
+            search_fn = make_search_fn(base_url, {"first": ["a", "missing", "b"], "second": ["c", "a"]})
+            results = await crawl_search_results(action_plan, search_fn=search_fn, dedup=False)
+            return results, state
+        finally:
+            await runner.cleanup()
+
+    results, state = asyncio.run(run())
+    assert [result.title for result in results] == ["a", "b", "c", "a"]
+    assert all(isinstance(result, SearchResultSchema) for result in results)
+    assert all(result.model == ModelEnum.GPT3_5_TURBO_4K and result.cost > 0 for result in results)
+    # page "a" is listed under both queries but only downloaded once
+    assert state["requests"] == 4
+
+def test_crawler_respects_per_host_limit():
+    action_plan: ResearchActionPlanSchema = load_research_action_plan("./tests/test_data/parsed_user_prompt_for_research.json")
+    action_plan.search_queries = ["only"]
+
+    async def run():
+        runner, base_url, state = await start_fixture_server(delay=0.1)
+        try:
+            search_fn = make_search_fn(base_url, {"only": [f"page{i}" for i in range(6)]})
+            async with Crawler(max_per_host=2, results_per_query=6, search_fn=search_fn, dedup=False) as crawler:
+                results = await crawl_search_results(action_plan, crawler)
+            return results, state
+        finally:
+            await runner.cleanup()
+
+    results, state = asyncio.run(run())
+    assert len(results) == 6
+    assert state["max_active"] == 2
+
+def test_crawlers_sharing_a_pool_share_its_limits():
+    action_plan: ResearchActionPlanSchema = load_research_action_plan("./tests/test_data/parsed_user_prompt_for_research.json")
+    action_plan.search_queries = ["only"]
+
+    async def run():
+        runner, base_url, state = await start_fixture_server(delay=0.1)
+        try:
+            async with CrawlerPool(max_per_host=2) as pool:
+                # two papers crawling the same host at once
+                async def crawl_paper(first: int):
+                    search_fn = make_search_fn(base_url, {"only": [f"page{i}" for i in range(first, first + 3)]})
+                    async with Crawler(pool=pool, results_per_query=3, search_fn=search_fn, dedup=False) as crawler:
+                        return await crawl_search_results(action_plan, crawler)
+                results = await asyncio.gather(crawl_paper(0), crawl_paper(3))
+                # the papers are done, the pool stays open for the next ones
+                assert not pool.session.closed
+            return results, state
+        finally:
+            await runner.cleanup()
+
+    results, state = asyncio.run(run())
+    assert [len(paper_results) for paper_results in results] == [3, 3]
+    assert state["max_active"] == 2
+
+def test_crawl_search_results_drops_near_duplicate_pages():
+    action_plan: ResearchActionPlanSchema = load_research_action_plan("./tests/test_data/parsed_user_prompt_for_research.json")
+    action_plan.search_queries = ["first", "second"]
+
+    async def run():
+        runner, base_url, state = await start_fixture_server()
+        try:
+            search_fn = make_search_fn(base_url, {"first": ["a", "b"], "second": ["a", "b"]})
+            async with Crawler(search_fn=search_fn) as crawler:
+                results = await crawl_search_results(action_plan, crawler)
+            return results, crawler.dedup_index.stats
+        finally:
+            await runner.cleanup()
+
+    results, stats = asyncio.run(run())
+    # the second query found the same two pages again
+    assert [result.title for result in results] == ["a", "b"]
+    assert stats.duplicates == stats.llm_calls_saved == 2
+
+def test_lxml_extractor_skips_non_html_and_oversized_pages():
+    action_plan: ResearchActionPlanSchema = load_research_action_plan("./tests/test_data/parsed_user_prompt_for_research.json")
+    action_plan.search_queries = ["only"]
+
+    async def run():
+        runner, base_url, state = await start_fixture_server()
+        try:
+            search_fn = make_search_fn(base_url, {"only": ["a", "report.pdf", "huge"]})
+            async with Crawler(search_fn=search_fn, extractor="lxml", max_page_bytes=64 * 1024, dedup=False) as crawler:
+                return await crawl_search_results(action_plan, crawler)
+        finally:
+            await runner.cleanup()
+
+    results = asyncio.run(run())
+    assert [result.title for result in results] == ["a"]
+    assert results[0].content.startswith("a\nTaylor Morrison is one of the nation's leading homebuilders")
+
+def test_not_modified_without_a_cached_copy_is_an_error(tmp_path):
+    async def run():
+        runner, base_url, state = await start_fixture_server()
+        try:
+            async with Crawler(page_cache=PageCache(cache_dir=str(tmp_path)), dedup=False) as crawler:
+                try:
+                    await crawler.fetch_page_content(f"{base_url}/pages/not-modified")
+                    assert False, "there is no page to extract"
+                except Exception as e:
+                    return str(e), crawler.page_cache.get(f"{base_url}/pages/not-modified")
+        finally:
+            await runner.cleanup()
+
+    error, cached = asyncio.run(run())
+    assert "304" in error
+    assert cached is None
@@ -0,0 +1,35 @@
+from schemas import SearchResultSchema, ModelEnum, SearchResultSummary
+from utils import load_summary, est_tokens_search_result
+from dedup import simhash, hamming_distance, NearDuplicateIndex, dedupe_search_results
+
+def load_results() -> list[SearchResultSchema]:
+    summaries: list[SearchResultSummary] = load_summary("./tests/test_data/summary.json")
+    return [summary.source_material for summary in summaries]
+
+def test_simhash_is_close_for_mirrored_pages():
+    content = max(load_results(), key=lambda result: len(result.content)).content
+    mirrored = "Republished from the wire. " + content.replace("the", "a", 3) + " Share this article."
+    assert hamming_distance(simhash(content), simhash(mirrored)) <= 3
+    assert simhash("") is None
+
+def test_dedupe_search_results_drops_near_duplicates_and_counts_savings():
+    results = load_results()
+    longest = max(results, key=lambda result: len(result.content))
+    mirror = SearchResultSchema(title="Mirror", link="https://mirror.example.com/story", content="Republished from the wire. " + longest.content, cost=longest.cost, model=longest.model)
+    kept, stats = dedupe_search_results(results + [mirror])
+
+    # the newsroom front page and its releases listing carry the same text, and the mirror goes too
+    assert [result.link for result in results if result not in kept] == ["https://newsroom.taylormorrison.com/releases?l=100"]
+    assert mirror not in kept
+    assert stats.pages == len(results) + 1
+    assert stats.duplicates == stats.llm_calls_saved == 2
+    expected_tokens = sum(sum(est_tokens_search_result(result)) for result in (results[5], mirror))
+    assert stats.input_tokens_saved + stats.output_tokens_saved == expected_tokens
+    assert abs(stats.cost_saved - (results[5].cost + mirror.cost)) < 1e-9
+
+def test_near_duplicate_index_keeps_first_copy():
+    index = NearDuplicateIndex()
+    first = SearchResultSchema(title="a", link="https://a.example.com", content="one two three four five six seven eight", cost=0, model=ModelEnum.GPT3_5_TURBO_4K)
+    second = SearchResultSchema(title="b", link="https://b.example.com", content=first.content, cost=0, model=ModelEnum.GPT3_5_TURBO_4K)
+    assert index.add(first) is None
+    assert index.add(second) is first
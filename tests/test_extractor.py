@@ -0,0 +1,34 @@
+from extractor import extract_text, normalize_text, is_html_content_type
+from utils import load_summary
+
+def test_extract_text_keeps_the_article_and_drops_boilerplate():
+    sources = {summary.source_material.title: summary.source_material.content for summary in load_summary("./tests/test_data/summary.json")}
+    with open("./tests/test_data/html/newswire.html", "rb") as f:
+        text = extract_text(f.read())
+    content = sources["Taylor Morrison Named One of America's Most ..."]
+    # every paragraph of the story is there, on its own line
+    lines = text.split("\n")
+    assert all(paragraph in lines for paragraph in content.split("\n"))
+    for boilerplate in ("We use cookies", "Related stories", "Copyright 2023", "dataLayer", "Privacy"):
+        assert boilerplate not in text
+
+def test_extract_text_falls_back_to_main_and_body():
+    with open("./tests/test_data/html/wikipedia.html", "rb") as f:
+        text = extract_text(f.read())
+    assert text.startswith("Taylor Morrison\n")
+    assert "Home\nAbout" not in text
+    # line breaks come from block elements, not from the html source
+    assert extract_text(b"<html><body><p>Only   a\n body</p><div>and  more<br>after</div></body></html>") == "Only a body\nand more\nafter"
+    assert extract_text(b"") == ""
+
+def test_normalize_text_matches_clean_content():
+    from utils import clean_content
+    text = "  Title \n\n\n First  paragraph   here.\n\nSecond paragraph.  "
+    assert normalize_text(text) == "Title\nFirst paragraph here.\nSecond paragraph."
+    assert normalize_text(clean_content(text)) == normalize_text(text)
+
+def test_is_html_content_type():
+    assert is_html_content_type("text/html; charset=utf-8")
+    assert is_html_content_type("application/xhtml+xml")
+    assert is_html_content_type(None)
+    assert not is_html_content_type("application/pdf")
@@ -0,0 +1,61 @@
+from schemas import ModelEnum, SearchResultSchema
+from utils import load_summary, load_research_action_plan, est_cost_search_result
+from llm_client import LatencyProfile
+from forecast import forecast_run, forecast_wall_time, request_latency, DEFAULT_REQUEST_OVERHEAD
+
+def load_inputs():
+    action_plan = load_research_action_plan("./tests/test_data/parsed_user_prompt_for_research.json")
+    search_results: list[SearchResultSchema] = [summary.source_material for summary in load_summary("./tests/test_data/summary.json")]
+    return action_plan, search_results
+
+def test_forecast_run_covers_every_llm_stage():
+    action_plan, search_results = load_inputs()
+    forecast = forecast_run(action_plan, search_results, context_limit=4000)
+    summarize, lods, write = forecast.stages["summarize"], forecast.stages["lods"], forecast.stages["write"]
+
+    assert summarize.calls == len(search_results)
+    # the per-result estimate plus the system prompt sent with every call
+    assert summarize.cost > sum(est_cost_search_result(result) for result in search_results)
+    assert lods.calls == len(action_plan.paper_structure) - 1
+    assert write.calls == len(action_plan.paper_structure)
+    assert write.models == {"gpt-4": len(action_plan.paper_structure)}
+    # every section prompt stays within the context limit
+    assert write.input_tokens <= 4000 * write.calls
+    assert abs(forecast.cost - (summarize.cost + lods.cost + write.cost)) < 1e-9
+    assert forecast.to_json()["cost"] == forecast.cost
+
+def test_forecast_run_counts_chunk_fan_out():
+    action_plan, search_results = load_inputs()
+    chunked = search_results[0].model_copy(update={"chunks": ["first half", "second half", "third"]})
+    forecast = forecast_run(action_plan, [chunked])
+    assert forecast.stages["summarize"].calls == 3
+
+def test_parallel_sections_skip_lods_and_write_in_waves():
+    action_plan, search_results = load_inputs()
+    sequential = forecast_run(action_plan, search_results, context_limit=4000)
+    parallel = forecast_run(action_plan, search_results, context_limit=4000, parallel_sections=True, max_section_concurrency=3)
+    assert parallel.stages["lods"].calls == 0
+    assert parallel.stages["write"].wall_time < sequential.stages["write"].wall_time
+
+def test_measured_latency_replaces_defaults(tmp_path):
+    profile = LatencyProfile()
+    assert request_latency(ModelEnum.GPT4_8K, 100, profile) == DEFAULT_REQUEST_OVERHEAD + 100 * 0.05
+    profile.record("gpt-4", 10.0)
+    profile.record("gpt-4", 20.0)
+    assert request_latency(ModelEnum.GPT4_8K, 100, profile) == 15.0
+
+    path = str(tmp_path / "latency.json")
+    profile.save(path)
+    reloaded = LatencyProfile()
+    reloaded.load(path)
+    reloaded.record("gpt-4", 45.0)
+    assert reloaded.mean("gpt-4") == 25.0
+    # saving twice does not count the earlier runs again
+    reloaded.save(path)
+    reloaded.load(path)
+    assert reloaded.totals() == {"gpt-4": [3, 75.0]}
+
+def test_wall_time_is_bound_by_rate_limits():
+    # 7000 calls at 3500 rpm take at least another minute after the first minute's burst
+    assert forecast_wall_time(ModelEnum.GPT3_5_TURBO_4K, 7000, 0, 512, 100000) >= 60
+    assert forecast_wall_time(ModelEnum.GPT3_5_TURBO_4K, 10, 100, 512, 5) == 2 * (DEFAULT_REQUEST_OVERHEAD + 512 * 0.015)
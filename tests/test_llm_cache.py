@@ -0,0 +1,66 @@
+from llm_cache import LLMResponseCache, cache_key
+import llm_client
+from llm_client import chat_completion, set_response_cache
+import asyncio
+
+def make_params(content: str, temperature: float = 0) -> dict:
+    return {
+        "model": "gpt-3.5-turbo",
+        "messages": [{"role": "user", "content": content}],
+        "temperature": temperature,
+        "max_tokens": 512
+    }
+
+def make_response(content: str) -> dict:
+    return {"choices": [{"message": {"role": "assistant", "content": content}}], "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}}
+
+def test_cache_key_ignores_api_key():
+    assert cache_key({**make_params("a"), "api_key": "one"}) == cache_key({**make_params("a"), "api_key": "two"})
+    assert cache_key(make_params("a")) != cache_key(make_params("b"))
+    assert cache_key(make_params("a")) != cache_key(make_params("a", temperature=0.7))
+
+def test_sampled_responses_need_opt_in(tmp_path):
+    cache = LLMResponseCache(path=str(tmp_path / "llm.sqlite3"))
+    cache.put(make_params("a", temperature=0.7), make_response("answer"))
+    assert cache.get(make_params("a", temperature=0.7), "summarize") is None
+    assert cache.stats["summarize"].bypassed == 1
+
+    cache = LLMResponseCache(path=str(tmp_path / "llm.sqlite3"), reuse_sampled=True)
+    assert cache.get(make_params("a", temperature=0.7), "summarize") is None
+    cache.put(make_params("a", temperature=0.7), make_response("answer"))
+    assert cache.get(make_params("a", temperature=0.7), "summarize") == make_response("answer")
+    assert cache.stats["summarize"].misses == 1
+    assert cache.stats["summarize"].hits == 1
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = LLMResponseCache(path=str(tmp_path / "llm.sqlite3"))
+    cache.put(make_params("first"), make_response("1"))
+    cache.put(make_params("second"), make_response("2"))
+    cache.get(make_params("first"))
+    # room for two responses of this size
+    cache.max_bytes = cache.size()
+    cache.put(make_params("third"), make_response("3"))
+    assert cache.get(make_params("first")) is not None
+    assert cache.get(make_params("second")) is None
+    assert cache.get(make_params("third")) is not None
+
+def test_chat_completion_serves_cached_responses(tmp_path, monkeypatch):
+    calls = []
+
+    async def fake_acreate(**params):
+        calls.append(params)
+        from openai.openai_object import OpenAIObject
+        return OpenAIObject.construct_from(make_response("fresh"))
+
+    monkeypatch.setattr(llm_client.openai.ChatCompletion, "acreate", fake_acreate)
+    cache = LLMResponseCache(path=str(tmp_path / "llm.sqlite3"))
+    set_response_cache(cache)
+    try:
+        first = asyncio.run(chat_completion("lods", **make_params("prompt")))
+        second = asyncio.run(chat_completion("lods", **make_params("prompt")))
+    finally:
+        set_response_cache(None)
+    assert len(calls) == 1
+    assert first.choices[0].message.content == second.choices[0].message.content == "fresh"
+    assert second.usage.total_tokens == 15
+    assert cache.stats["lods"].hits == 1
@@ -0,0 +1,168 @@
+from schemas import SearchResultSchema, ModelEnum
+from utils import load_research_action_plan, summarize_results
+from llm_client import llm_session, chat_completion, RetryPolicy, set_retry_policy, get_retry_policy, get_call_stats, get_latency_profile
+from budget import BudgetGovernor, set_budget_governor
+from benchmarks.openai_stub import OpenAIStub, default_responder
+import openai
+import asyncio
+import time
+
+def make_result(i: int) -> SearchResultSchema:
+    return SearchResultSchema(title=f"Result {i}", link=f"https://example.com/{i}", content="Test Content", cost=0.1, model=ModelEnum.GPT3_5_TURBO_4K)
+
+def test_calls_share_one_connection_pool():
+    action_plan = load_research_action_plan("./tests/test_data/parsed_user_prompt_for_research.json")
+
+    async def run():
+        async with OpenAIStub(delay=0.05) as stub:
+            async with llm_session(pool_size=2) as session:
+                summaries = await summarize_results([make_result(i) for i in range(8)], action_plan)
+                completion = await chat_completion("write_section", model="gpt-4", messages=[{"role": "user", "content": "hi"}])
+                assert openai.aiosession.get() is session
+            assert openai.aiosession.get() is None
+            assert session.closed
+            return stub, summaries, completion
+
+    stub, summaries, completion = asyncio.run(run())
+    assert len(stub.requests) == 9
+    assert all(summary.error is None for summary in summaries)
+    assert completion.choices[0].message.content
+    # nine requests over at most two kept-alive connections
+    assert len(stub.peers) <= 2
+
+def test_nested_sessions_reuse_the_outer_pool():
+    async def run():
+        async with llm_session() as outer:
+            async with llm_session() as inner:
+                assert inner is outer
+            assert not outer.closed
+
+    asyncio.run(run())
+
+class Delays:
+    # stub latency that hands out the given delays in order, then answers at once
+    def __init__(self, *delays: float):
+        self.delays = list(delays)
+
+    def sample(self) -> float:
+        return self.delays.pop(0) if self.delays else 0.0
+
+def run_with_policy(policy: RetryPolicy, coro_fn):
+    previous = get_retry_policy()
+    set_retry_policy(policy)
+    try:
+        return asyncio.run(coro_fn())
+    finally:
+        set_retry_policy(previous)
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+def test_rate_limits_wait_for_retry_after_then_give_up():
+    async def run():
+        async with OpenAIStub(error_rate_429=1.0, retry_after=0.3) as stub:
+            start = time.monotonic()
+            try:
+                await chat_completion("test_rate_limit", model="gpt-4", messages=MESSAGES)
+                assert False, "every request is rate limited"
+            except openai.error.RateLimitError:
+                pass
+            return stub, time.monotonic() - start
+
+    stub, elapsed = run_with_policy(RetryPolicy(max_retries=1, base_delay=0.001), run)
+    assert len(stub.requests) == 2
+    assert elapsed >= 0.3
+    stats = get_call_stats()["test_rate_limit"]
+    assert (stats.calls, stats.retries, stats.failures) == (1, 1, 1)
+
+def test_server_errors_and_slow_attempts_are_retried():
+    calls = []
+
+    def fail_twice(body: dict) -> str:
+        calls.append(body)
+        if len(calls) <= 2:
+            raise Exception("overloaded")
+        return default_responder(body)
+
+    async def run():
+        # the first request hangs past the attempt timeout, the next two fail with a 500
+        async with OpenAIStub(responder=fail_twice, latency={"default": Delays(1.0)}) as stub:
+            start = time.monotonic()
+            completion = await chat_completion("test_retry", model="gpt-4", messages=MESSAGES)
+            return stub, completion, time.monotonic() - start
+
+    stub, completion, elapsed = run_with_policy(RetryPolicy(max_retries=3, base_delay=0.001, attempt_timeout=0.3), run)
+    assert completion.choices[0].message.content
+    assert len(stub.requests) == 4
+    assert elapsed < 0.9
+    stats = get_call_stats()["test_retry"]
+    assert (stats.retries, stats.timeouts, stats.failures) == (3, 1, 0)
+
+def test_slow_requests_are_hedged():
+    latency_profile = get_latency_profile()
+    for _ in range(20):
+        latency_profile.record("gpt-hedge-test", 0.01)
+
+    async def run():
+        async with OpenAIStub(latency={"default": Delays(1.0)}) as stub:
+            start = time.monotonic()
+            completion = await chat_completion("test_hedge", model="gpt-hedge-test", messages=MESSAGES)
+            return stub, completion, time.monotonic() - start
+
+    try:
+        stub, completion, elapsed = run_with_policy(RetryPolicy(hedge_percentile=95), run)
+    finally:
+        latency_profile.recent.pop("gpt-hedge-test")
+        latency_profile.measured.pop("gpt-hedge-test")
+    assert completion.choices[0].message.content
+    # the duplicate answered long before the first request would have
+    assert len(stub.requests) == 2
+    assert elapsed < 0.5
+    stats = get_call_stats()["test_hedge"]
+    assert (stats.hedges, stats.hedge_wins, stats.retries) == (1, 1, 0)
+
+def test_failed_attempts_count_against_the_budget_by_estimate():
+    calls = []
+
+    def fail_once(body: dict) -> str:
+        calls.append(body)
+        if len(calls) == 1:
+            raise Exception("overloaded")
+        return default_responder(body)
+
+    governor = BudgetGovernor(max_cost=100.0)
+    set_budget_governor(governor)
+
+    async def run():
+        async with OpenAIStub(responder=fail_once) as stub:
+            return await chat_completion("test_unbilled_attempts", model="gpt-4", messages=MESSAGES, max_tokens=50)
+
+    try:
+        run_with_policy(RetryPolicy(max_retries=1, base_delay=0.001), run)
+    finally:
+        set_budget_governor(None)
+    usage = governor.usage[ModelEnum.GPT4_8K]
+    # the answered request by its usage, the 500 as the prompt plus max_tokens on the side
+    assert usage.requests == 1
+    assert usage.estimated_unbilled >= 50 * 0.06 / 1000
+    assert governor.cost == usage.cost + usage.estimated_unbilled
+
+def test_rate_limited_attempts_cost_nothing():
+    governor = BudgetGovernor(max_cost=0.01)
+    set_budget_governor(governor)
+
+    async def run():
+        async with OpenAIStub(error_rate_429=1.0, retry_after=0) as stub:
+            try:
+                await chat_completion("test_rate_limit_storm", model="gpt-4", messages=MESSAGES, max_tokens=500)
+                assert False, "every request is rate limited"
+            except openai.error.RateLimitError:
+                pass
+            return stub
+
+    try:
+        stub = run_with_policy(RetryPolicy(max_retries=5, base_delay=0.001), run)
+    finally:
+        set_budget_governor(None)
+    assert len(stub.requests) == 6
+    assert governor.cost == 0.0
+    assert governor.exceeded() is None
@@ -0,0 +1,111 @@
+from schemas import ResearchActionPlanSchema
+from utils import load_research_action_plan
+from page_cache import PageCache, canonical_url
+from crawler import Crawler, crawl_search_results
+from aiohttp import web
+from collections import namedtuple
+import asyncio
+import os
+import time
+
+FakeSearchResult = namedtuple("FakeSearchResult", ["url", "title", "description"])
+
+PAGE = """<html><head><title>Cached</title></head><body><article>
+<p>Taylor Morrison is one of the nation's leading homebuilders and developers, based in Scottsdale, Arizona, with operations across 19 markets in 11 states.</p>
+<p>The company serves first-time, move-up, luxury and resort lifestyle homebuyers and renters under its family of brands.</p>
+</article></body></html>"""
+
+def test_canonical_url():
+    assert canonical_url("HTTPS://Example.com:443/a?b=2&utm_source=x&a=1#frag") == "https://example.com/a?a=1&b=2"
+    assert canonical_url("http://example.com") == "http://example.com/"
+    assert canonical_url("http://example.com:8080/a") == "http://example.com:8080/a"
+
+def test_store_lookup_and_read_only(tmp_path):
+    cache = PageCache(cache_dir=str(tmp_path))
+    cache.store("https://example.com/a?utm_campaign=x", b"<html>a</html>", "text a", etag='"v1"')
+    entry = cache.lookup("https://example.com/a")
+    assert entry.text == "text a"
+    assert cache.get_html(entry) == b"<html>a</html>"
+    assert cache.stats.hits == 1
+    assert cache.stats.bytes_saved == len(b"<html>a</html>")
+
+    # stale entries are not served, except when reading offline
+    expired = PageCache(cache_dir=str(tmp_path), ttl=0)
+    assert expired.lookup("https://example.com/a") is None
+    offline = PageCache(cache_dir=str(tmp_path), ttl=0, read_only=True)
+    assert offline.lookup("https://example.com/a").text == "text a"
+    offline.store("https://example.com/b", b"<html>b</html>", "text b")
+    assert offline.get("https://example.com/b") is None
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = PageCache(cache_dir=str(tmp_path), max_bytes=10**9)
+    cache.store("https://example.com/old", b"o" * 1000, "old")
+    cache.store("https://example.com/new", b"n" * 1000, "new")
+    old_path = cache._entry_path("https://example.com/old")
+    os.utime(old_path, (time.time() - 100, time.time() - 100))
+    cache.max_bytes = cache.size() - 1
+    cache.evict()
+    assert cache.get("https://example.com/old") is None
+    assert cache.get("https://example.com/new").text == "new"
+    assert cache.size() <= cache.max_bytes
+    assert cache.stats.evictions == 1
+
+def test_eviction_frees_room_for_the_next_stores(tmp_path):
+    cache = PageCache(cache_dir=str(tmp_path), max_bytes=10**9)
+    for i in range(10):
+        cache.store(f"https://example.com/{i}", str(i).encode("utf-8") * 1000, str(i))
+        path = cache._entry_path(f"https://example.com/{i}")
+        os.utime(path, (time.time() - 100 + i, time.time() - 100 + i))
+    cache.max_bytes = cache.size()
+    cache.store("https://example.com/10", b"x" * 1000, "10")
+    # down to the low water mark, not just under the bound
+    assert cache.size() <= cache.max_bytes * cache.low_water
+    evictions = cache.stats.evictions
+    # more than the one entry it took to get back under max_bytes, oldest first
+    assert evictions >= 2
+    assert cache.get("https://example.com/0") is None and cache.get("https://example.com/1") is None
+    assert cache.get("https://example.com/10").text == "10"
+    # the next store fits without another scan
+    cache.store("https://example.com/11", b"y" * 10, "11")
+    assert cache.stats.evictions == evictions
+
+def test_crawler_revalidates_with_etag(tmp_path):
+    action_plan: ResearchActionPlanSchema = load_research_action_plan("./tests/test_data/parsed_user_prompt_for_research.json")
+    action_plan.search_queries = ["only"]
+    statuses = []
+
+    async def page(request: web.Request):
+        if request.headers.get("If-None-Match") == '"v1"':
+            statuses.append(304)
+            return web.Response(status=304, headers={"ETag": '"v1"'})
+        statuses.append(200)
+        return web.Response(text=PAGE, content_type="text/html", headers={"ETag": '"v1"'})
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/page", page)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        search_fn = lambda query, num_results: [FakeSearchResult(f"http://127.0.0.1:{port}/page", "Cached", "")]
+        results = []
+        try:
+            for cache in caches:
+                async with Crawler(search_fn=search_fn, page_cache=cache) as crawler:
+                    results.append(await crawl_search_results(action_plan, crawler))
+        finally:
+            await runner.cleanup()
+        return results
+
+    fresh_cache = PageCache(cache_dir=str(tmp_path))
+    stale_cache = PageCache(cache_dir=str(tmp_path), ttl=0)
+    caches = [PageCache(cache_dir=str(tmp_path)), fresh_cache, stale_cache]
+    first, second, third = asyncio.run(run())
+
+    assert first[0].content == second[0].content == third[0].content
+    # fetched once, served from disk once, then revalidated once the ttl ran out
+    assert statuses == [200, 304]
+    assert fresh_cache.stats.hits == 1
+    assert stale_cache.stats.revalidated == 1
@@ -0,0 +1,94 @@
+from schemas import ResearchActionPlanSchema, SearchResultSummary, SearchResultSchema, ModelEnum
+from utils import load_research_action_plan
+from crawler import Crawler
+from rate_limiter import RateLimitScheduler
+from pipeline import search_and_summarize_streaming
+import llm_client
+import pipeline
+from openai.openai_object import OpenAIObject
+from aiohttp import web
+from collections import namedtuple
+import asyncio
+import time
+
+FakeSearchResult = namedtuple("FakeSearchResult", ["url", "title", "description"])
+
+PAGE_TEMPLATE = """<html><head><title>{title}</title></head><body><article>
+<p>Taylor Morrison is one of the nation's leading homebuilders and developers, based in Scottsdale, Arizona, with operations across 19 markets in 11 states.</p>
+<p>The company serves first-time, move-up, luxury and resort lifestyle homebuyers and renters under its family of brands. Page {title}.</p>
+</article></body></html>"""
+
+RAW_SUMMARY = """Author(s): not found
+Date: not found
+- A detail
+Relevancy:
+- Introduction: 5
+"""
+
+def test_streaming_overlaps_crawl_and_summaries(monkeypatch):
+    action_plan: ResearchActionPlanSchema = load_research_action_plan("./tests/test_data/parsed_user_prompt_for_research.json")
+    action_plan.search_queries = ["fast", "slow"]
+    events = []
+
+    async def fake_acreate(**params):
+        events.append(("summarize", time.monotonic()))
+        return OpenAIObject.construct_from({"choices": [{"message": {"role": "assistant", "content": RAW_SUMMARY}}]})
+
+    monkeypatch.setattr(llm_client.openai.ChatCompletion, "acreate", fake_acreate)
+
+    async def page(request: web.Request):
+        name = request.match_info["name"]
+        if name.startswith("slow"):
+            await asyncio.sleep(0.5)
+        events.append(("served", time.monotonic()))
+        return web.Response(text=PAGE_TEMPLATE.format(title=name), content_type="text/html")
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/pages/{name}", page)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        def search_fn(query: str, num_results: int):
+            return [FakeSearchResult(f"http://127.0.0.1:{port}/pages/{query}{i}", f"{query}{i}", "") for i in range(2)]
+
+        try:
+            async with Crawler(search_fn=search_fn, dedup=False) as crawler:
+                return await search_and_summarize_streaming(action_plan, crawler, RateLimitScheduler(), queue_size=1, num_summarizers=2)
+        finally:
+            await runner.cleanup()
+
+    summaries: list[SearchResultSummary] = asyncio.run(run())
+    assert [summary.source_material.title for summary in summaries] == ["fast0", "fast1", "slow0", "slow1"]
+    first_summary = min(t for kind, t in events if kind == "summarize")
+    last_served = max(t for kind, t in events if kind == "served")
+    # summaries of the fast pages went out while the slow pages were still downloading
+    assert first_summary < last_served
+
+def test_streaming_fails_instead_of_hanging_when_a_summarizer_raises(monkeypatch):
+    action_plan: ResearchActionPlanSchema = load_research_action_plan("./tests/test_data/parsed_user_prompt_for_research.json")
+    action_plan.search_queries = ["only"]
+
+    class FakeCrawler:
+        async def stream_query(self, query_index, query, research_action_plan, queue):
+            for i in range(20):
+                result = SearchResultSchema(title=f"{query}{i}", link=f"https://example.com/{i}", content="Test Content", cost=0.1, model=ModelEnum.GPT3_5_TURBO_4K)
+                await queue.put(((query_index, i), result))
+
+    async def failing_summary(search_result, research_action_plan, scheduler):
+        raise ValueError("unparseable summary")
+
+    monkeypatch.setattr(pipeline, "summarize_result_scheduled", failing_summary)
+
+    async def run():
+        # the producer still has results to hand out when the summarizers are gone
+        return await asyncio.wait_for(search_and_summarize_streaming(action_plan, FakeCrawler(), RateLimitScheduler(), queue_size=8, num_summarizers=2), 5)
+
+    try:
+        asyncio.run(run())
+        assert False, "the summarizer failed"
+    except ValueError as e:
+        assert "unparseable" in str(e)
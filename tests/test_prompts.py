@@ -0,0 +1,102 @@
+from schemas import ResearchActionPlanSchema, PaperSchema, SectionSchema, ModelEnum
+from utils import load_research_action_plan, get_num_tokens
+import prompts
+from prompts import get_l2_write_prompt, get_l2_write_prompt_text, LOD_FULL
+import asyncio
+
+def load_plan() -> ResearchActionPlanSchema:
+    return load_research_action_plan("./tests/test_data/parsed_user_prompt_for_research.json")
+
+def make_section(name: str, num_words: int) -> SectionSchema:
+    return SectionSchema(name=name, lods=["word " * num_words, "key " * (num_words // 10), "critical " * 5])
+
+def test_l2_write_prompt_keeps_full_lods_when_under_budget():
+    action_plan = load_plan()
+    paper = PaperSchema(sections=[make_section("Introduction", 50), make_section("Company Overview", 50)])
+    l2_text = asyncio.run(get_l2_write_prompt(action_plan, 2, paper, max_tokens=2000))
+    assert l2_text == get_l2_write_prompt_text(action_plan, 2, paper, [LOD_FULL, LOD_FULL])
+
+def test_l2_write_prompt_reduces_farthest_sections_first():
+    action_plan = load_plan()
+    paper = PaperSchema(sections=[make_section(name, 300) for name in action_plan.paper_structure[:4]])
+    full_tokens = get_num_tokens(get_l2_write_prompt_text(action_plan, 4, paper, [LOD_FULL] * 4), ModelEnum.GPT4_8K)
+    l2_text = asyncio.run(get_l2_write_prompt(action_plan, 4, paper, max_tokens=full_tokens // 2))
+    assert get_num_tokens(l2_text, ModelEnum.GPT4_8K) <= full_tokens // 2
+    # the closest section stays in full while the first one is reduced
+    assert "> The critical information from what you wrote the Introduction section is:" in l2_text
+    assert "> In the Financial Performance section, you wrote:" in l2_text
+
+def test_l2_write_prompt_generates_missing_lods(monkeypatch):
+    generated = []
+
+    async def fake_generate_lods(section, action_plan):
+        generated.append(section.name)
+        section.lods += ["key " * 5, "critical"]
+        section.max_lod_generated = True
+        return section
+
+    monkeypatch.setattr(prompts, "generate_lods", fake_generate_lods)
+    action_plan = load_plan()
+    paper = PaperSchema(sections=[SectionSchema(name="Introduction", lods=["word " * 500])])
+    l2_text = asyncio.run(get_l2_write_prompt(action_plan, 1, paper, max_tokens=100))
+    assert generated == ["Introduction"]
+    assert "The key details of what you wrote in the Introduction section are:" in l2_text
+
+def test_l2_write_prompt_waits_for_background_lods(monkeypatch):
+    async def fail_generate_lods(section, action_plan):
+        raise AssertionError("LODs were already being generated in the background")
+
+    async def background_lods(section):
+        await asyncio.sleep(0.01)
+        section.lods += ["key " * 5, "critical"]
+        section.max_lod_generated = True
+        return section
+
+    async def run(paper):
+        lod_tasks = {0: asyncio.create_task(background_lods(paper.sections[0]))}
+        l2_text = await get_l2_write_prompt(action_plan, 1, paper, max_tokens=100, lod_tasks=lod_tasks)
+        return l2_text, lod_tasks
+
+    monkeypatch.setattr(prompts, "generate_lods", fail_generate_lods)
+    action_plan = load_plan()
+    paper = PaperSchema(sections=[SectionSchema(name="Introduction", lods=["word " * 500])])
+    l2_text, lod_tasks = asyncio.run(run(paper))
+    assert lod_tasks == {}
+    assert len(paper.sections[0].lods) == 3
+    assert "The key details of what you wrote in the Introduction section are:" in l2_text
+
+def test_l2_write_prompt_raises_when_content_cannot_fit():
+    action_plan = load_plan()
+    paper = PaperSchema(sections=[make_section("Introduction", 300)])
+    try:
+        asyncio.run(get_l2_write_prompt(action_plan, 1, paper, max_tokens=5))
+        assert False, "expected an exception"
+    except Exception as e:
+        assert str(e) == "Cannot reduce content further to meet token limit."
+
+def test_l2_outline_prompt_fits_its_budget():
+    from prompts import get_l2_outline_prompt, get_l2_outline_prompt_text
+    action_plan = load_plan()
+    full_text = get_l2_outline_prompt_text(action_plan, 2)
+    full_tokens = get_num_tokens(full_text, ModelEnum.GPT4_8K)
+    assert get_l2_outline_prompt(action_plan, 2, max_tokens=full_tokens) == full_text
+    # the research plan goes first, the outline and the instructions stay
+    l2_text = get_l2_outline_prompt(action_plan, 2, max_tokens=full_tokens - 5)
+    assert get_num_tokens(l2_text, ModelEnum.GPT4_8K) <= full_tokens - 5
+    assert action_plan.research_plan[-1] not in l2_text
+    assert "(you are writing this section)" in l2_text
+    # past that the text is cut, keeping the instructions at the end
+    l2_text = get_l2_outline_prompt(action_plan, 2, max_tokens=20)
+    assert get_num_tokens(l2_text, ModelEnum.GPT4_8K) <= 20
+    assert full_text.endswith(l2_text)
+    assert get_l2_outline_prompt(action_plan, 2, max_tokens=0) == ""
+
+def test_l3_write_prompt_does_not_mutate_research():
+    from utils import load_summary
+    from prompts import get_l3_write_prompt
+    summaries = load_summary("./tests/test_data/summary.json")
+    details_before = [list(summary.details) for summary in summaries]
+    l3_text = get_l3_write_prompt("Company Overview", summaries, max_tokens=150)
+    assert get_num_tokens(l3_text, ModelEnum.GPT4_8K) <= 150
+    assert l3_text.startswith("> Notes:")
+    assert [summary.details for summary in summaries] == details_before
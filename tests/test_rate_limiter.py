@@ -0,0 +1,46 @@
+from schemas import ModelEnum
+from rate_limiter import RateLimitScheduler, TokenBucket
+import asyncio
+import time
+
+def test_token_bucket_refills():
+    bucket = TokenBucket(capacity=10, refill_per_second=100)
+    bucket.take(10)
+    assert bucket.time_until(5) > 0
+    time.sleep(0.06)
+    assert bucket.time_until(5) == 0
+
+def test_scheduler_queues_requests_over_token_quota():
+    # 6000 tokens per minute is 100 per second, so the third 100 token request waits about a second
+    scheduler = RateLimitScheduler(limits={ModelEnum.GPT3_5_TURBO_4K: (1000, 6000)})
+    scheduler.limiter(ModelEnum.GPT3_5_TURBO_4K).tokens.tokens = 200
+    admitted = []
+    depths = []
+
+    async def request(i: int):
+        async with scheduler.admit(ModelEnum.GPT3_5_TURBO_4K, 100):
+            admitted.append((i, time.monotonic()))
+
+    async def run():
+        start = time.monotonic()
+        tasks = [asyncio.create_task(request(i)) for i in range(3)]
+        await asyncio.sleep(0.1)
+        depths.append(scheduler.queue_depth(ModelEnum.GPT3_5_TURBO_4K))
+        await asyncio.gather(*tasks)
+        return start
+
+    start = asyncio.run(run())
+    assert [i for i, _ in admitted] == [0, 1, 2]
+    assert admitted[1][1] - start < 0.5
+    assert admitted[2][1] - start >= 0.9
+    assert depths == [1]
+    stats = scheduler.stats()["gpt-3.5-turbo"]
+    assert stats["admitted"] == 3
+    assert stats["queued"] == 1
+    assert stats["max_wait"] >= 0.9
+
+def test_share_scales_quota():
+    scheduler = RateLimitScheduler(share=0.5)
+    limiter = scheduler.limiter(ModelEnum.GPT4_8K)
+    assert limiter.requests.capacity == ModelEnum.GPT4_8K.value.rpm // 2
+    assert limiter.tokens.capacity == ModelEnum.GPT4_8K.value.tpm // 2
@@ -0,0 +1,36 @@
+from schemas import SearchResultSummary, ModelEnum
+from utils import load_summary, load_research_action_plan, get_num_tokens
+from prompts import get_l3_write_prompt_text
+from research_index import ResearchIndex
+
+def load_index() -> ResearchIndex:
+    action_plan = load_research_action_plan("./tests/test_data/parsed_user_prompt_for_research.json")
+    summaries = load_summary("./tests/test_data/summary.json")
+    return ResearchIndex(summaries, action_plan.paper_structure)
+
+def test_relevancy_matrix():
+    index = load_index()
+    assert index.relevancy.shape == (12, 6)
+    # first summary in summary.json
+    assert list(index.relevancy[0]) == [7, 10, 3, 2, 8, 1]
+
+def test_render_notes_matches_l3_prompt_text():
+    index = load_index()
+    for section in index.sections:
+        for rel_limit, detail_limit in [(0, -1), (5, -1), (10, 3), (10, 1)]:
+            assert index.render_notes(section, rel_limit, detail_limit) == get_l3_write_prompt_text(index.research, rel_limit, section, detail_limit)
+
+def test_select_notes_fits_budget():
+    index = load_index()
+    for section in index.sections:
+        for max_tokens in [300, 800, 5000]:
+            notes = index.select_notes(section, max_tokens)
+            assert get_num_tokens(notes, ModelEnum.GPT4_8K) <= max_tokens
+
+def test_select_notes_raises_when_nothing_fits():
+    index = load_index()
+    try:
+        index.select_notes("Company Overview", 1)
+        assert False, "expected an exception"
+    except Exception as e:
+        assert str(e) == "Cannot reduce content further to meet token limit."
@@ -0,0 +1,122 @@
+from service import ResearchService, Job
+from benchmarks.openai_stub import OpenAIStub, canned_responder
+from benchmarks.fixture_web import FixtureWeb
+from aiohttp import web, ClientSession
+import asyncio
+import json
+import time
+
+PLAN_FILE = "./tests/test_data/parsed_user_prompt_for_research.json"
+
+async def read_events(response) -> list[tuple[str, dict]]:
+    events = []
+    event = None
+    async for line in response.content:
+        line = line.decode("utf-8").strip()
+        if line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: "):
+            events.append((event, json.loads(line[len("data: "):])))
+    return events
+
+def test_service_queues_jobs_and_streams_progress(run_paths):
+    with open(PLAN_FILE) as f:
+        research_action_plan = json.load(f)
+    responder = canned_responder(research_action_plan)
+
+    async def run():
+        async with OpenAIStub(responder=responder, delay=0.05), FixtureWeb() as fixture_web:
+            service = ResearchService(
+                max_workers=1, max_queued_jobs=1,
+                search_fn=fixture_web.search_fn,
+                **run_paths
+            )
+            runner = web.AppRunner(service.app())
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            base_url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+            try:
+                async with ClientSession() as session:
+                    async with session.post(f"{base_url}/jobs", data="not json") as response:
+                        assert response.status == 400
+                    async with session.get(f"{base_url}/jobs/missing") as response:
+                        assert response.status == 404
+
+                    # the one worker takes the first job, the second fills the queue
+                    jobs = []
+                    for i in range(3):
+                        async with session.post(f"{base_url}/jobs", json={"prompt": f"Write a briefing on Taylor Morrison, take {i}"}) as response:
+                            jobs.append((response.status, await response.json()))
+                    assert [status for status, _ in jobs] == [202, 202, 503]
+                    job_id = jobs[0][1]["id"]
+
+                    async with session.get(f"{base_url}/jobs/{job_id}/events") as response:
+                        assert response.headers["Content-Type"] == "text/event-stream"
+                        events = await read_events(response)
+                    async with session.get(f"{base_url}/jobs/{job_id}/paper.json") as response:
+                        assert response.status == 200
+                        paper = await response.json()
+                    async with session.get(f"{base_url}/jobs/{job_id}/paper.pdf") as response:
+                        assert response.status == 404
+                    async with session.get(f"{base_url}/jobs/{jobs[1][1]['id']}/events") as response:
+                        second_events = await read_events(response)
+            finally:
+                await runner.cleanup()
+            return events, paper, second_events
+
+    events, paper, second_events = asyncio.run(run())
+    names = [event for event, _ in events]
+    stages = [data["stage"] for event, data in events if event == "stage"]
+    assert stages == ["plan", "search", "summarize", "write"]
+    sections = [data for event, data in events if event == "section"]
+    assert len(sections) == len(research_action_plan["paper_structure"]) == len(paper["sections"])
+    assert "token" in names
+    # the streamed tokens add up to the section text
+    first_section = "".join(data["text"] for event, data in events if event == "token" and data["section"] == research_action_plan["paper_structure"][0])
+    assert first_section == sections[0]["lods"][0]
+    assert names[-1] == "done" and events[-1][1]["status"] == "done"
+    assert second_events[-1][0] == "done"
+
+def test_finished_jobs_drop_their_tokens_and_expire():
+    job = Job("job-1", "prompt", "./outputs/job-1")
+    job.publish("stage", {"stage": "write"})
+    for word in ("Taylor", " Morrison"):
+        job.publish("token", {"section": "Introduction", "text": word})
+    job.publish("section", {"name": "Introduction", "lods": ["Taylor Morrison"]})
+    job.finish("done")
+    assert [event for _, event, _ in job.events] == ["stage", "section", "done"]
+    # a subscriber that already saw the first token picks up where it left off
+    assert [event for _, event, _ in job.events_after(1)] == ["section", "done"]
+
+    service = ResearchService(job_ttl=60, max_finished_jobs=2)
+    now = time.time()
+    for i, finished_at in enumerate([now - 120, now - 30, now - 20, now - 10, None]):
+        job = Job(f"job-{i}", "prompt", f"./outputs/job-{i}")
+        job.finished_at = finished_at
+        service.jobs[job.id] = job
+    service.forget_finished_jobs()
+    # job-0 is past its ttl, job-1 the oldest beyond the two finished ones kept
+    assert sorted(service.jobs) == ["job-2", "job-3", "job-4"]
+
+def test_submit_fails_once_the_workers_are_gone(tmp_path, run_paths, caplog):
+    async def run():
+        # a directory where the response cache file should be, so the workers never start
+        service = ResearchService(**dict(run_paths, llm_cache_path=str(tmp_path)))
+        runner = web.AppRunner(service.app())
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        base_url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+        try:
+            await asyncio.sleep(0.1)
+            async with ClientSession() as session:
+                async with session.post(f"{base_url}/jobs", json={"prompt": "Write a briefing on Taylor Morrison"}) as response:
+                    return response.status, await response.json()
+        finally:
+            await runner.cleanup()
+
+    status, body = asyncio.run(run())
+    assert status == 503
+    assert "not running" in body["error"]
+    assert "Service workers stopped" in caplog.text
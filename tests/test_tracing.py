@@ -0,0 +1,106 @@
+from schemas import ResearchActionPlanSchema, SearchResultSummary
+from utils import load_summary, load_research_action_plan
+from writer import write_paper
+from tracing import Tracer, span, annotate, set_tracer
+from benchmarks.openai_stub import OpenAIStub, canned_responder
+import asyncio
+import json
+import os
+
+def test_spans_nest_across_tasks_and_export_json_lines(tmp_path):
+    trace_path = tmp_path / "trace.jsonl"
+    tracer = Tracer(run_id="run-1", path=str(trace_path))
+    set_tracer(tracer)
+
+    async def child(i: int):
+        with span("child", index=i):
+            await asyncio.sleep(0.01)
+            annotate(done=True)
+
+    async def run():
+        with span("stage", stage="write") as parent:
+            await asyncio.gather(*[child(i) for i in range(3)])
+        return parent
+
+    try:
+        parent = asyncio.run(run())
+        try:
+            with span("failing"):
+                raise ValueError("boom")
+        except ValueError:
+            pass
+    finally:
+        set_tracer(None)
+
+    lines = [json.loads(line) for line in trace_path.read_text().splitlines()]
+    assert len(lines) == 5
+    assert all(line["run_id"] == "run-1" for line in lines)
+    children = [line for line in lines if line["name"] == "child"]
+    assert len(children) == 3
+    assert all(line["parent_id"] == parent.span_id and line["attributes"]["done"] for line in children)
+    assert all(line["duration"] >= 0.01 for line in children)
+    failing = [line for line in lines if line["name"] == "failing"][0]
+    assert failing["error"] == "ValueError: boom"
+    assert tracer.summary()["child"]["count"] == 3
+
+def test_long_lived_tracer_keeps_totals_and_earlier_traces(tmp_path):
+    trace_path = tmp_path / "trace.jsonl"
+    for run_id in ("service-1", "service-2"):
+        tracer = Tracer(run_id=run_id, path=str(trace_path), keep_spans=False)
+        set_tracer(tracer)
+        try:
+            for _ in range(3):
+                with span("completion"):
+                    pass
+        finally:
+            set_tracer(None)
+        assert tracer.spans == []
+        assert tracer.summary()["completion"]["count"] == 3
+
+    # a restart adds to the trace instead of replacing it
+    lines = [json.loads(line) for line in trace_path.read_text().splitlines()]
+    assert [line["run_id"] for line in lines] == ["service-1"] * 3 + ["service-2"] * 3
+
+def test_profiled_stage_dumps_cprofile_and_memory_peak(tmp_path):
+    tracer = Tracer(run_id="run-2", path=str(tmp_path / "trace.jsonl"), profile_stages=["summarize"])
+    set_tracer(tracer)
+    try:
+        with span("stage", stage="summarize") as profiled:
+            data = [list(range(1000)) for _ in range(100)]
+        with span("stage", stage="write") as unprofiled:
+            pass
+    finally:
+        set_tracer(None)
+    assert os.path.exists(profiled.attributes["profile"])
+    assert profiled.attributes["peak_memory_kib"] > 0
+    assert "profile" not in unprofiled.attributes
+
+def test_write_paper_spans_carry_usage_and_loop_counts(tmp_path):
+    action_plan: ResearchActionPlanSchema = load_research_action_plan("./tests/test_data/parsed_user_prompt_for_research.json")
+    summaries: list[SearchResultSummary] = load_summary("./tests/test_data/summary.json")
+    with open("./tests/test_data/parsed_user_prompt_for_research.json") as f:
+        responder = canned_responder(json.load(f))
+    tracer = Tracer(run_id="run-3", path=str(tmp_path / "trace.jsonl"))
+    set_tracer(tracer)
+
+    async def run():
+        async with OpenAIStub(responder=responder):
+            return await write_paper(action_plan, summaries, context_limit=2000)
+
+    try:
+        asyncio.run(run())
+    finally:
+        set_tracer(None)
+
+    by_name = {}
+    for recorded in tracer.spans:
+        by_name.setdefault(recorded.name, []).append(recorded)
+    assert len(by_name["write_section"]) == len(action_plan.paper_structure)
+    assert all(recorded.attributes["model"] == "gpt-4" for recorded in by_name["write_section"])
+    # every section after the first fits its previous sections into the L2 budget
+    renders = by_name["render_prompt"]
+    assert all("l2_iterations" in recorded.attributes for recorded in renders[1:])
+    assert all("l3_renders" in recorded.attributes for recorded in renders)
+    completions = [recorded for recorded in by_name["completion"] if recorded.attributes["site"] == "write_section"]
+    assert all(recorded.attributes["prompt_tokens"] == 10 and recorded.attributes["retries"] == 0 for recorded in completions)
+    assert len(by_name["lods"]) == len(action_plan.paper_structure) - 1
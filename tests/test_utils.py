@@ -235,4 +235,116 @@ These recent developments reinforce Taylor Morrison's position as a leading home
     section = asyncio.run(generate_lods(section, research_action_plan))
     for lod in section.lods:
         print(lod)
-        print()
\ No newline at end of file
+        print()
+
+def test_get_encoder_is_shared():
+    from utils import get_encoder
+    assert get_encoder(ModelEnum.GPT4_8K) is get_encoder(ModelEnum.GPT4_8K)
+
+def test_token_count_cache_hits_and_misses():
+    from utils import TokenCountCache, get_encoder
+    cache = TokenCountCache(max_entries=8)
+    text = "Taylor Morrison is based in Scottsdale, Arizona."
+    expected = len(get_encoder(ModelEnum.GPT4_8K).encode(text))
+    assert cache.count(text, ModelEnum.GPT4_8K) == expected
+    assert cache.count(text, ModelEnum.GPT4_8K) == expected
+    # gpt-4 and gpt-3.5-turbo share an encoding so the count is reused
+    assert cache.count(text, ModelEnum.GPT3_5_TURBO_4K) == expected
+    stats = cache.stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 2
+    assert stats["entries"] == 1
+
+def test_token_count_cache_evicts_least_recently_used():
+    from utils import TokenCountCache
+    cache = TokenCountCache(max_entries=2)
+    cache.count("first")
+    cache.count("second")
+    cache.count("first")
+    cache.count("third")
+    assert cache.stats()["entries"] == 2
+    cache.count("first")
+    assert cache.stats()["misses"] == 3
+    cache.count("second")
+    assert cache.stats()["misses"] == 4
+
+def make_long_content(num_paragraphs: int) -> str:
+    return "\n".join(f"Paragraph {i} describes the homebuilder's results in market number {i} in some detail. " * 8 for i in range(num_paragraphs))
+
+def test_build_search_result_chunks_oversized_pages():
+    from utils import build_search_result, get_num_tokens, fits_in_model, est_cost_search_result, SUMMARY_OUTPUT_TOKENS
+    from prompts import get_research_summary_prompt, prepare_source_material_for_summary_prompt
+    action_plan = load_research_action_plan("./tests/test_data/parsed_user_prompt_for_research.json")
+    content = make_long_content(150)
+    assert build_search_result("Long report", "https://example.com/report", content, action_plan) is None
+
+    result = build_search_result("Long report", "https://example.com/report", content, action_plan, chunk_oversized=True, max_chunks=100)
+    assert result.model == ModelEnum.GPT3_5_TURBO_4K
+    assert len(result.chunks) > 4
+    # chunks are made of whole paragraphs and together cover the page
+    assert "\n".join(result.chunks) == content
+    for chunk in result.chunks:
+        chunk_result = result.model_copy(update={"content": chunk, "chunks": []})
+        assert fits_in_model(get_research_summary_prompt(action_plan) + prepare_source_material_for_summary_prompt(chunk_result), ModelEnum.GPT3_5_TURBO_4K, padding_tokens=100)
+    # one summary per chunk is paid for
+    input_tokens = sum(get_num_tokens(chunk, ModelEnum.GPT3_5_TURBO_4K) for chunk in result.chunks)
+    assert abs(result.cost - (input_tokens * 0.0015 + len(result.chunks) * SUMMARY_OUTPUT_TOKENS * 0.002) / 1000) < 1e-9
+
+    capped = build_search_result("Long report", "https://example.com/report", content, action_plan, chunk_oversized=True, max_chunks=2)
+    assert capped.chunks == result.chunks[:2]
+
+def test_summarize_result_chunked_merges_chunk_summaries():
+    from benchmarks.openai_stub import OpenAIStub
+    from utils import summarize_results
+    action_plan = load_research_action_plan("./tests/test_data/parsed_user_prompt_for_research.json")
+    search_result = SearchResultSchema(title="Long report", link="https://example.com/report", content="part one\npart two", cost=0, model=ModelEnum.GPT3_5_TURBO_4K, chunks=["part one", "part two"])
+
+    def responder(body):
+        part = "one" if "part one" in body["messages"][1]["content"] else "two"
+        return f"""Author(s): Author {part}
+Date: {"2023-10-01" if part == "two" else "not found"}
+- Shared detail
+- Detail from part {part}
+Relevancy:
+- Introduction: {3 if part == "one" else 8}
+- Conclusion: {6 if part == "one" else 2}
+"""
+
+    async def run():
+        async with OpenAIStub(responder=responder) as stub:
+            return await summarize_results([search_result], action_plan), stub
+
+    (summary,), stub = asyncio.run(run())
+    assert len(stub.requests) == 2
+    assert summary.source_material is search_result
+    assert summary.details == ["Shared detail", "Detail from part one", "Detail from part two"]
+    assert summary.authors == ["Author one", "Author two"]
+    assert summary.date == "2023-10-01"
+    assert summary.relevancy == {"Introduction": 8, "Conclusion": 6}
+    assert summary.error is None
+
+def test_token_count_cache_counts_in_batches():
+    from utils import TokenCountCache, get_encoder
+    cache = TokenCountCache()
+    texts = ["first page", "second page with more words", "first page"]
+    cache.count("second page with more words", ModelEnum.GPT4_8K)
+    counts = cache.count_batch(texts, ModelEnum.GPT4_8K, num_threads=2)
+    assert counts == [len(get_encoder(ModelEnum.GPT4_8K).encode(text)) for text in texts]
+    # only the pages missing from the cache were encoded
+    assert cache.stats()["entries"] == 2
+
+def test_build_search_results_tokenizes_each_page_once():
+    from utils import build_search_result, build_search_results, token_count_cache, est_tokens_search_result
+    action_plan = load_research_action_plan("./tests/test_data/parsed_user_prompt_for_research.json")
+    sources = [summary.source_material for summary in load_summary("./tests/test_data/summary.json")]
+    candidates = [(source.title, source.link, source.content) for source in sources]
+
+    results = build_search_results(candidates, action_plan)
+    expected = [build_search_result(*candidate, action_plan) for candidate in candidates]
+    assert [(result.model, result.num_tokens, result.cost) for result in results] == [(result.model, result.num_tokens, result.cost) for result in expected]
+
+    misses = token_count_cache.misses
+    for result in results:
+        assert est_tokens_search_result(result)[0] == result.num_tokens
+    assert token_count_cache.misses == misses
+    assert results[0].to_json()["num_tokens"] == results[0].num_tokens
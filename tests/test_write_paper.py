@@ -17,4 +17,106 @@ def test_write_paper():
     # save the paper to file
     with open('./outputs/paper.json', 'w') as outfile:
         import json
-        json.dump(paper.to_json(), outfile, indent=4)
\ No newline at end of file
+        json.dump(paper.to_json(), outfile, indent=4)
+
+def test_write_paper_parallel():
+    from benchmarks.openai_stub import OpenAIStub
+    import time
+    action_plan: ResearchActionPlanSchema = load_research_action_plan("./tests/test_data/parsed_user_prompt_for_research.json")
+    summaries: list[SearchResultSummary] = load_summary("./tests/test_data/summary.json")
+
+    async def run():
+        async with OpenAIStub(responder=lambda body: "## Section\nWritten in parallel.", delay=0.2) as stub:
+            start = time.monotonic()
+            paper = await write_paper(action_plan, summaries, context_limit=4000, parallel=True, max_concurrency=3)
+            return stub, paper, time.monotonic() - start
+
+    stub, paper, elapsed = asyncio.run(run())
+    assert [section.name for section in paper.sections] == action_plan.paper_structure
+    assert stub.max_active == 3
+    # six sections in two waves of three rather than six round trips
+    assert elapsed < 6 * 0.2
+    prompts = [body["messages"][0]["content"] for body in stub.requests]
+    assert all("The full outline of the paper is:" in prompt for prompt in prompts)
+    assert not any("you wrote:" in prompt for prompt in prompts)
+
+def test_write_paper_streams_tokens_and_appends_sections(tmp_path):
+    from benchmarks.openai_stub import OpenAIStub
+    from paper_output import PaperOutput
+    import json
+    action_plan: ResearchActionPlanSchema = load_research_action_plan("./tests/test_data/parsed_user_prompt_for_research.json")
+    summaries: list[SearchResultSummary] = load_summary("./tests/test_data/summary.json")
+    action_plan.paper_structure = action_plan.paper_structure[:2]
+    section_text = "## Section\nStreamed word by word."
+    tokens = []
+    paper_output = PaperOutput(output_dir=str(tmp_path))
+
+    async def run():
+        async with OpenAIStub(responder=lambda body: section_text):
+            return await write_paper(action_plan, summaries, context_limit=4000, on_token=lambda name, delta: tokens.append((name, delta)), on_section=paper_output.append_section)
+
+    paper = asyncio.run(run())
+    assert [section.lods[0] for section in paper.sections] == [section_text] * 2
+    # the reply arrived in several pieces
+    assert len([delta for name, delta in tokens if name == "Introduction"]) > 1
+    assert "".join(delta for name, delta in tokens if name == "Introduction") == section_text
+    with open(paper_output.jsonl_path) as f:
+        assert [json.loads(line)["name"] for line in f] == ["Introduction", "Company Overview"]
+    with open(paper_output.markdown_path) as f:
+        assert f.read() == (section_text + "\n\n") * 2
+
+def test_write_paper_generates_lods_in_background():
+    from benchmarks.openai_stub import OpenAIStub
+    import time
+    action_plan: ResearchActionPlanSchema = load_research_action_plan("./tests/test_data/parsed_user_prompt_for_research.json")
+    summaries: list[SearchResultSummary] = load_summary("./tests/test_data/summary.json")
+    action_plan.paper_structure = action_plan.paper_structure[:3]
+
+    def responder(body):
+        if "Create a concise bullet point summary" in body["messages"][0]["content"]:
+            return "Key Details:\n- a detail\nCritical Info: the critical part"
+        return "## Section\nWritten one after the other."
+
+    async def run():
+        async with OpenAIStub(responder=responder, delay=0.2) as stub:
+            start = time.monotonic()
+            paper = await write_paper(action_plan, summaries, context_limit=4000)
+            return stub, paper, time.monotonic() - start
+
+    stub, paper, elapsed = asyncio.run(run())
+    # every section but the last gets its LODs, each one alongside the next section's write
+    assert [len(section.lods) for section in paper.sections] == [3, 3, 1]
+    assert stub.max_active == 2
+    assert elapsed < 5 * 0.2
+
+def test_write_paper_parallel_reports_sections_in_paper_order(monkeypatch):
+    import writer
+    action_plan: ResearchActionPlanSchema = load_research_action_plan("./tests/test_data/parsed_user_prompt_for_research.json")
+    summaries: list[SearchResultSummary] = load_summary("./tests/test_data/summary.json")
+    section_count = len(action_plan.paper_structure)
+    started = []
+
+    async def generate_section_content(writing_prompt, model=ModelEnum.GPT4_8K, on_token=None):
+        # the later sections finish first
+        index = len(started)
+        started.append(index)
+        for piece in (f"{index}a ", f"{index}b "):
+            await asyncio.sleep(0.01 * (section_count - index))
+            await on_token(piece)
+        return f"{index}a {index}b "
+
+    monkeypatch.setattr(writer, "generate_section_content", generate_section_content)
+    tokens = []
+    sections = []
+    resumed = SectionSchema(name=action_plan.paper_structure[2], lods=["kept"])
+    paper = asyncio.run(write_paper(
+        action_plan, summaries, context_limit=4000, parallel=True, max_concurrency=section_count,
+        on_token=lambda name, delta: tokens.append((name, delta)), on_section=sections.append,
+        resume_sections={2: resumed}
+    ))
+    assert [section.name for section in sections] == action_plan.paper_structure
+    assert sections[2] is resumed
+    assert [section.name for section in paper.sections] == action_plan.paper_structure
+    # the streamed text reads like a sequential run, one section after the other
+    assert [name for name, _ in tokens] == [name for i, name in enumerate(action_plan.paper_structure) if i != 2 for _ in range(2)]
+    assert "".join(delta for _, delta in tokens) == "".join(section.lods[0] for i, section in enumerate(sections) if i != 2)
@@ -0,0 +1,137 @@
+import contextlib
+import contextvars
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+import uuid
+from dataclasses import dataclass, field, asdict
+
+@dataclass
+class Span:
+    name: str
+    span_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    parent_id: str = None
+    # wall clock start, for lining spans up with logs, and monotonic duration in seconds
+    start: float = field(default_factory=time.time)
+    duration: float = None
+    attributes: dict = field(default_factory=dict)
+    error: str = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, name: str, amount: int = 1):
+        # counters like loop iterations or retries
+        self.attributes[name] = self.attributes.get(name, 0) + amount
+
+    def to_json(self):
+        return asdict(self)
+
+# innermost open span of the running task, tasks started inside a span inherit it as their parent
+_current_span: contextvars.ContextVar[Span] = contextvars.ContextVar("current_span", default=None)
+
+class Tracer:
+    # Collects the spans of one run and appends each one to a JSON lines file as it
+    # finishes, so a run that dies part way still leaves its trace behind. Earlier runs'
+    # lines are kept, every line carries its run_id. Stage spans named in profile_stages
+    # also get a cProfile dump and their tracemalloc peak recorded. A long-lived process
+    # passes keep_spans=False to only keep the per-name totals in memory.
+    def __init__(self, run_id: str = None, path: str = None, profile_stages: list[str] = None, profile_dir: str = None, keep_spans: bool = True):
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.path = path
+        self.profile_stages = set(profile_stages or [])
+        self.profile_dir = profile_dir or (os.path.dirname(path) if path else ".")
+        self.keep_spans = keep_spans
+        self.spans: list[Span] = []
+        # count, total seconds and errors per span name
+        self.totals: dict[str, dict] = {}
+        self._profiling = False
+        if path is not None and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def finish(self, span: Span):
+        if self.keep_spans:
+            self.spans.append(span)
+        name_totals = self.totals.setdefault(span.name, {"count": 0, "seconds": 0.0, "errors": 0})
+        name_totals["count"] += 1
+        name_totals["seconds"] += span.duration
+        name_totals["errors"] += span.error is not None
+        if self.path is not None:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(dict(span.to_json(), run_id=self.run_id)) + "\n")
+
+    @contextlib.contextmanager
+    def profile(self, span: Span):
+        # one profiler at a time, a stage nested in a profiled one is not profiled again
+        stage = span.attributes.get("stage")
+        if span.name != "stage" or stage not in self.profile_stages or self._profiling:
+            yield
+            return
+        self._profiling = True
+        profiler = cProfile.Profile()
+        tracing_memory = tracemalloc.is_tracing()
+        if not tracing_memory:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            span.set(peak_memory_kib=tracemalloc.get_traced_memory()[1] / 1024)
+            if not tracing_memory:
+                tracemalloc.stop()
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profile_path = os.path.join(self.profile_dir, f"profile-{self.run_id}-{stage}.prof")
+            profiler.dump_stats(profile_path)
+            span.set(profile=profile_path)
+            self._profiling = False
+
+    def summary(self) -> dict[str, dict]:
+        # count and total seconds per span name
+        return {name: dict(name_totals) for name, name_totals in self.totals.items()}
+
+# tracer shared by every span in the process, None records nothing
+_tracer: Tracer = None
+
+def set_tracer(tracer: Tracer):
+    global _tracer
+    _tracer = tracer
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+def current_span() -> Span:
+    return _current_span.get()
+
+def annotate(**attributes):
+    # add attributes to the innermost open span, if there is one
+    span = _current_span.get()
+    if span is not None:
+        span.set(**attributes)
+
+@contextlib.contextmanager
+def span(name: str, activate: bool = True, **attributes):
+    # activate=False leaves the parent as the current span, for async generators whose
+    # body runs in the consumer's context between yields
+    parent = _current_span.get()
+    new_span = Span(name, parent_id=parent.span_id if parent is not None else None, attributes=attributes)
+    token = _current_span.set(new_span) if activate else None
+    tracer = _tracer
+    start = time.monotonic()
+    try:
+        with tracer.profile(new_span) if tracer is not None else contextlib.nullcontext():
+            yield new_span
+    except BaseException as e:
+        # an async generator closed early is not a failure
+        if not isinstance(e, GeneratorExit):
+            new_span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        new_span.duration = time.monotonic() - start
+        if token is not None:
+            _current_span.reset(token)
+        if tracer is not None:
+            tracer.finish(new_span)
@@ -2,15 +2,23 @@ from bs4 import BeautifulSoup
 from newspaper import Article
 import tiktoken
 from schemas import ResearchActionPlanSchema, SearchResultSchema, ModelEnum, str_to_model_enum, SearchResultSummary, SectionSchema, PaperSchema
-from googlesearch import search
 import re
 import os
 import openai
-from aiohttp import ClientSession
 import asyncio
 import json
+import hashlib
+import threading
+import logging
+import time
+from collections import OrderedDict
 from md2pdf.core import md2pdf
+from llm_client import chat_completion, llm_session
+from rate_limiter import RateLimitScheduler
+from tracing import span
+from budget import get_budget_governor
 
+logger = logging.getLogger(__name__)
 
 
 def load_research_action_plan(file_path: str) -> ResearchActionPlanSchema:
@@ -18,100 +26,288 @@ def load_research_action_plan(file_path: str) -> ResearchActionPlanSchema:
         result_data = json_file.read()
         return ResearchActionPlanSchema.model_validate_json(result_data)
     
+def search_result_from_json(data: dict) -> SearchResultSchema:
+    return SearchResultSchema(
+        title=data["title"],
+        link=data["link"],
+        content=data["content"],
+        cost=data["cost"],
+        model=str_to_model_enum(data["model"]),
+        chunks=data.get("chunks", []),
+        num_tokens=data.get("num_tokens"),
+        rank=data.get("rank")
+        )
+
+def summary_from_json(summary: dict) -> SearchResultSummary:
+    return SearchResultSummary(
+        source_material=search_result_from_json(summary["source_material"]),
+        details=summary["details"],
+        authors=summary["authors"],
+        date=summary["date"],
+        relevancy=summary["relevancy"],
+        error=summary["error"]
+    )
+
 def load_summary(file_path: str) -> list[SearchResultSummary]:
-    summaries: list[SearchResultSummary] = []
     with open(file_path) as json_file:
-        temp_results = json.load(json_file)
-        for summary in temp_results:
-            result = SearchResultSchema(
-                title=summary["source_material"]["title"],
-                link=summary["source_material"]["link"],
-                content=summary["source_material"]["content"],
-                cost=summary["source_material"]["cost"],
-                model=str_to_model_enum(summary["source_material"]["model"])
-                )
-            res = SearchResultSummary(
-                source_material=result,
-                details=summary["details"],
-                authors=summary["authors"],
-                date=summary["date"],
-                relevancy=summary["relevancy"],
-                error=summary["error"]
-            )
-            summaries.append(res)
-    return summaries
-
-
-def fetch_site_content(url:str):
+        return [summary_from_json(summary) for summary in json.load(json_file)]
+
+def load_search_results(file_path: str) -> list[SearchResultSchema]:
+    with open(file_path) as json_file:
+        return [search_result_from_json(result) for result in json.load(json_file)]
+
+
+def fetch_site_content(url:str, page_cache=None):
     article = Article(url)
-    article.download()
+    entry = page_cache.lookup(url) if page_cache is not None else None
+    if entry is not None:
+        article.download(input_html=page_cache.get_html(entry))
+    elif page_cache is not None and page_cache.read_only:
+        raise Exception(f"{url} is not in the page cache")
+    else:
+        article.download()
     article.parse()
     if article.text == "":
         raise Exception("Article text is empty")
+    if page_cache is not None and entry is None:
+        page_cache.record_miss()
+        page_cache.store(url, article.html.encode("utf-8"), clean_content(article.text))
     return article
 
+# one encoder per model, built on first use and shared for the life of the process
+_encoders: dict[ModelEnum, tiktoken.Encoding] = {}
+_encoders_lock = threading.Lock()
+
+def get_encoder(model: ModelEnum = ModelEnum.GPT4_8K) -> tiktoken.Encoding:
+    enc = _encoders.get(model)
+    if enc is None:
+        with _encoders_lock:
+            enc = _encoders.get(model)
+            if enc is None:
+                enc = tiktoken.encoding_for_model(model.value.official_name)
+                _encoders[model] = enc
+    return enc
+
+DEFAULT_TOKENIZER_THREADS = 8
+
+class TokenCountCache:
+    # bounded LRU of token counts keyed by (encoding name, content hash) so
+    # large prompts are not kept alive just to remember their length
+    def __init__(self, max_entries: int = 8192):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple[str, bytes], int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(text: str, enc: tiktoken.Encoding) -> tuple[str, bytes]:
+        return (enc.name, hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest())
+
+    def lookup(self, text: str, enc: tiktoken.Encoding):
+        key = self._key(text, enc)
+        with self._lock:
+            count = self._entries.get(key)
+            if count is None:
+                self.misses += 1
+                return key, None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return key, count
+
+    def store(self, key: tuple[str, bytes], count: int):
+        with self._lock:
+            self._entries[key] = count
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def count(self, text: str, model: ModelEnum = ModelEnum.GPT4_8K) -> int:
+        enc = get_encoder(model)
+        key, count = self.lookup(text, enc)
+        if count is None:
+            count = len(enc.encode(text))
+            self.store(key, count)
+        return count
+
+    def count_batch(self, texts: list[str], model: ModelEnum = ModelEnum.GPT4_8K, num_threads: int = DEFAULT_TOKENIZER_THREADS) -> list[int]:
+        # every text missing from the cache is encoded in one batched call, which
+        # tiktoken spreads over num_threads threads outside the GIL
+        enc = get_encoder(model)
+        keys = []
+        counts = []
+        for text in texts:
+            key, count = self.lookup(text, enc)
+            keys.append(key)
+            counts.append(count)
+        missing = [i for i, count in enumerate(counts) if count is None]
+        if missing:
+            encoded = enc.encode_batch([texts[i] for i in missing], num_threads=num_threads)
+            for i, tokens in zip(missing, encoded):
+                counts[i] = len(tokens)
+                self.store(keys[i], counts[i])
+        return counts
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries
+        }
+
+token_count_cache = TokenCountCache()
+
+def get_token_cache_stats() -> dict:
+    return token_count_cache.stats()
+
 def str_cost_analysis(input: str="", num_output_tokens: int=0, model: ModelEnum=ModelEnum.GPT4_8K):
-    enc = tiktoken.encoding_for_model(model.value.official_name)
     input_pricing_per_thousand = model.value.pricing['input']
     output_pricing_per_thousand = model.value.pricing['output']
-    num_input_tokens = len(enc.encode(input))
+    num_input_tokens = token_count_cache.count(input, model)
     input_cost = num_input_tokens * input_pricing_per_thousand / 1000
     output_cost = num_output_tokens * output_pricing_per_thousand / 1000
     total_cost = input_cost + output_cost
     return total_cost
 
 def get_num_tokens(input:str="", model=ModelEnum.GPT4_8K):
-    enc = tiktoken.encoding_for_model(model.value.official_name)
-    num_input_tokens = len(enc.encode(input))
-    return num_input_tokens
+    return token_count_cache.count(input, model)
+
+def get_num_tokens_batch(inputs: list[str], model=ModelEnum.GPT4_8K, num_threads: int = DEFAULT_TOKENIZER_THREADS) -> list[int]:
+    return token_count_cache.count_batch(inputs, model, num_threads)
 
 def fits_in_model(context:str, model:ModelEnum, padding_tokens: int = 0):
-    enc = tiktoken.encoding_for_model(model.value.official_name)
-    context_tokens = len(enc.encode(context))
+    context_tokens = token_count_cache.count(context, model)
     return context_tokens + padding_tokens <= model.value.max_context
 
 
-def est_cost_search_result(search_result: SearchResultSchema):
+SUMMARY_OUTPUT_TOKENS = 512
+
+def est_tokens_search_result(search_result: SearchResultSchema) -> tuple[int, int]:
     # input tokens will be content of search result
     # output tokens need to be estimated, for now assume 512 tokens
-    return str_cost_analysis(input=search_result.content, num_output_tokens=512, model=search_result.model)
+    if search_result.chunks:
+        # one summary call per chunk, each with its own output
+        input_tokens = sum(get_num_tokens(chunk, search_result.model) for chunk in search_result.chunks)
+        return input_tokens, SUMMARY_OUTPUT_TOKENS * len(search_result.chunks)
+    if search_result.num_tokens is not None:
+        return search_result.num_tokens, SUMMARY_OUTPUT_TOKENS
+    return get_num_tokens(search_result.content, search_result.model), SUMMARY_OUTPUT_TOKENS
+
+def est_cost_search_result(search_result: SearchResultSchema):
+    input_tokens, output_tokens = est_tokens_search_result(search_result)
+    pricing = search_result.model.value.pricing
+    return (input_tokens * pricing['input'] + output_tokens * pricing['output']) / 1000
+
+# oversized pages are cut into at most this many chunks, the rest of the page is dropped
+MAX_SUMMARY_CHUNKS = 8
 
+def split_content_into_chunks(content: str, max_tokens: int, model: ModelEnum = ModelEnum.GPT3_5_TURBO_4K) -> list[str]:
+    # greedily packs whole paragraphs into chunks of at most max_tokens,
+    # a paragraph that is too long on its own is cut on token boundaries
+    chunks = []
+    paragraphs, paragraphs_tokens = [], 0
+    for paragraph in content.split("\n"):
+        if not paragraph.strip():
+            continue
+        tokens = get_num_tokens(paragraph + "\n", model)
+        if paragraphs and paragraphs_tokens + tokens > max_tokens:
+            chunks.append("\n".join(paragraphs))
+            paragraphs, paragraphs_tokens = [], 0
+        if tokens > max_tokens:
+            enc = get_encoder(model)
+            ids = enc.encode(paragraph)
+            chunks += [enc.decode(ids[i:i + max_tokens]) for i in range(0, len(ids), max_tokens)]
+            continue
+        paragraphs.append(paragraph)
+        paragraphs_tokens += tokens
+    if paragraphs:
+        chunks.append("\n".join(paragraphs))
+    return chunks
 
-def generate_search_results(research_action_plan: ResearchActionPlanSchema) -> list[SearchResultSchema]:
+def chunk_search_result_content(search_result: SearchResultSchema, research_action_plan: ResearchActionPlanSchema, max_chunks: int = MAX_SUMMARY_CHUNKS) -> list[str]:
+    # every chunk has to fit next to the system prompt and the title, with the same
+    # padding build_search_result uses and a few tokens for the joins
+    overhead = get_summary_prompt_tokens(search_result.title, research_action_plan)
+    chunk_tokens = search_result.model.value.max_context - overhead - 100 - 10
+    chunks = split_content_into_chunks(search_result.content, chunk_tokens, search_result.model)
+    if len(chunks) > max_chunks:
+        logger.info(f"Only summarizing the first {max_chunks} of {len(chunks)} chunks of {search_result.link}")
+        chunks = chunks[:max_chunks]
+    return chunks
+
+
+def parse_site_content(url: str, html) -> str:
+    # parse already downloaded html the same way fetch_site_content does
+    article = Article(url)
+    article.download(input_html=html)
+    article.parse()
+    if article.text == "":
+        raise Exception("Article text is empty")
+    return article.text
+
+def get_summary_prompt_tokens(title: str, research_action_plan: ResearchActionPlanSchema) -> int:
+    # tokens of a summary request without the page content: the system prompt, which
+    # is the same for every page of a plan and comes from the token cache after the
+    # first page, plus the title and template around the content
     from prompts import get_research_summary_prompt, prepare_source_material_for_summary_prompt
+    model = ModelEnum.GPT3_5_TURBO_4K
+    empty_result = SearchResultSchema(title=title, link="", content="", cost=0, model=model)
+    return get_num_tokens(get_research_summary_prompt(research_action_plan), model) + get_num_tokens(prepare_source_material_for_summary_prompt(empty_result), model)
 
-    search_results = []
-    for query in research_action_plan.search_queries:
-        res = list(search(query, num_results=3, advanced=True))
-        for search_result in res:
-            link = search_result.url
-            site_content = None
-            try:
-                site_content = fetch_site_content(link)
-                site_content = clean_content(site_content.text)
-            except:
-                continue
-            if len(site_content) < 10:
-                # site content is too short, skip this result
-                continue
-            new_result = SearchResultSchema(
-                title=search_result.title,
-                link=search_result.url,
-                content=site_content,
-                cost=0,
-                model=ModelEnum.GPT3_5_TURBO_16K
-            )
-            # check what model to use based on content length
-            if fits_in_model(get_research_summary_prompt(research_action_plan) + prepare_source_material_for_summary_prompt(new_result), ModelEnum.GPT3_5_TURBO_4K, padding_tokens=100):
-                new_result.model = ModelEnum.GPT3_5_TURBO_4K
-            elif fits_in_model(get_research_summary_prompt(research_action_plan) + prepare_source_material_for_summary_prompt(new_result), ModelEnum.GPT3_5_TURBO_16K, padding_tokens=100):
-                new_result.model = ModelEnum.GPT3_5_TURBO_16K
-            else:
-                # skip this result
-                continue
-            new_result.cost = est_cost_search_result(new_result)
-            search_results.append(new_result)
-    return search_results
+def build_search_result(title: str, link: str, site_content: str, research_action_plan: ResearchActionPlanSchema, chunk_oversized: bool = False, max_chunks: int = MAX_SUMMARY_CHUNKS, num_tokens: int = None):
+    if len(site_content) < 10:
+        # site content is too short, skip this result
+        return None
+    # the content is tokenized once, here or in a batch by the caller, and the count
+    # is kept on the result for model selection, cost and rate limiting
+    if num_tokens is None:
+        num_tokens = get_num_tokens(site_content, ModelEnum.GPT3_5_TURBO_4K)
+    new_result = SearchResultSchema(
+        title=title,
+        link=link,
+        content=site_content,
+        cost=0,
+        model=ModelEnum.GPT3_5_TURBO_16K,
+        num_tokens=num_tokens
+    )
+    # check what model to use based on content length
+    prompt_tokens = get_summary_prompt_tokens(title, research_action_plan) + num_tokens
+    if prompt_tokens + 100 <= ModelEnum.GPT3_5_TURBO_4K.value.max_context:
+        new_result.model = ModelEnum.GPT3_5_TURBO_4K
+    elif prompt_tokens + 100 <= ModelEnum.GPT3_5_TURBO_16K.value.max_context:
+        new_result.model = ModelEnum.GPT3_5_TURBO_16K
+    elif chunk_oversized:
+        # too long for any summary model, summarize it in chunks on the cheapest one
+        new_result.model = ModelEnum.GPT3_5_TURBO_4K
+        new_result.chunks = chunk_search_result_content(new_result, research_action_plan, max_chunks)
+    else:
+        # skip this result
+        return None
+    new_result.cost = est_cost_search_result(new_result)
+    return new_result
+
+def build_search_results(candidates: list[tuple[str, str, str]], research_action_plan: ResearchActionPlanSchema, chunk_oversized: bool = False, max_chunks: int = MAX_SUMMARY_CHUNKS, num_threads: int = DEFAULT_TOKENIZER_THREADS) -> list[SearchResultSchema]:
+    # candidates are (title, link, content), all tokenized in one batched call
+    num_tokens = get_num_tokens_batch([content for _, _, content in candidates], ModelEnum.GPT3_5_TURBO_4K, num_threads)
+    return [
+        build_search_result(title, link, content, research_action_plan, chunk_oversized, max_chunks, count)
+        for (title, link, content), count in zip(candidates, num_tokens)
+    ]
+
+def generate_search_results(research_action_plan: ResearchActionPlanSchema, **kwargs) -> list[SearchResultSchema]:
+    # searches and page fetches run concurrently, see crawler.py for the limits,
+    # near-duplicate pages are dropped unless dedup=False is passed
+    from crawler import crawl_search_results
+    return asyncio.run(crawl_search_results(research_action_plan, **kwargs))
 
 def parse_raw_summary(raw_summary: str, search_result: SearchResultSchema) -> SearchResultSummary:
     lines = [line.strip() for line in raw_summary.strip().split("\n")]
@@ -161,7 +357,8 @@ def parse_raw_summary(raw_summary: str, search_result: SearchResultSchema) -> Se
 
 async def summarize_result_async(search_result: SearchResultSchema, research_action_plan: ResearchActionPlanSchema) -> SearchResultSummary:
     from prompts import get_research_summary_prompt, prepare_source_material_for_summary_prompt
-    completion = await openai.ChatCompletion.acreate(
+    completion = await chat_completion(
+        "summarize",
         model=search_result.model.value.official_name,
         messages=[
             {
@@ -183,32 +380,49 @@ async def summarize_result_async(search_result: SearchResultSchema, research_act
     return parse_raw_summary(raw_result, search_result)
 
 async def generate_lods(section: SectionSchema, action_plan: ResearchActionPlanSchema) -> SectionSchema:
-    print(f"!!!Generating LODs for section: {section.name}!!!")
+    with span("lods", section=section.name) as lods_span:
+        from prompts import get_lod_generation_prompt
+        # check if can fit in 3.5-turbo-4k and then 3.5-turbo-16k
+        curr_model: ModelEnum = ModelEnum.GPT3_5_TURBO_4K
+        prompt = get_lod_generation_prompt(section, action_plan)
+        if not fits_in_model(prompt, curr_model, padding_tokens=100):
+            curr_model = ModelEnum.GPT3_5_TURBO_16K
+        governor = get_budget_governor()
+        if governor is not None and governor.lod_model(curr_model) != curr_model:
+            # near the budget, summarize only as much of the section as the 4K model takes
+            curr_model = governor.lod_model(curr_model)
+            prompt = truncate_lod_prompt(section, action_plan, curr_model)
+            lods_span.set(downgraded=True)
+        lods_span.set(model=curr_model.value.official_name)
+        logger.debug(f"Generating LODs for section {section.name} with {curr_model.value.official_name}")
+        completion = await chat_completion(
+            "lods",
+            model=curr_model.value.official_name,
+            messages=[
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            temperature=0.7,
+            max_tokens=512,
+            top_p=1,
+            frequency_penalty=0,
+            presence_penalty=0
+        )
+        raw_result: str = completion.choices[0].message.content
+        new_section:SectionSchema = parse_raw_lod(raw_result, section)
+        new_section.max_lod_generated = True
+        return new_section
+
+def truncate_lod_prompt(section: SectionSchema, action_plan: ResearchActionPlanSchema, model: ModelEnum) -> str:
     from prompts import get_lod_generation_prompt
-    # check if can fit in 3.5-turbo-4k and then 3.5-turbo-16k
-    curr_model: ModelEnum = ModelEnum.GPT3_5_TURBO_4K
-    prompt = get_lod_generation_prompt(section, action_plan)
-    print(f"Prompt: {prompt}")
-    if not fits_in_model(prompt, curr_model, padding_tokens=100):
-        curr_model = ModelEnum.GPT3_5_TURBO_16K
-    completion = await openai.ChatCompletion.acreate(
-        model=curr_model.value.official_name,
-        messages=[
-            {
-                "role": "user",
-                "content": prompt
-            }
-        ],
-        temperature=0.7,
-        max_tokens=512,
-        top_p=1,
-        frequency_penalty=0,
-        presence_penalty=0
-    )
-    raw_result: str = completion.choices[0].message.content
-    new_section:SectionSchema = parse_raw_lod(raw_result, section)
-    new_section.max_lod_generated = True
-    return new_section
+    # room left for the section text once the rest of the prompt, the padding and the reply are in
+    overhead = get_num_tokens(get_lod_generation_prompt(section.model_copy(update={"lods": [""]}), action_plan), model)
+    section_tokens = model.value.max_context - overhead - 100 - 512
+    enc = get_encoder(model)
+    text = enc.decode(enc.encode(section.lods[0])[:max(0, section_tokens)])
+    return get_lod_generation_prompt(section.model_copy(update={"lods": [text]}), action_plan)
 
 def parse_raw_lod(raw_lod: str, section: SectionSchema) -> SectionSchema:
     # Split the string by the "Critical Info:" marker
@@ -226,20 +440,91 @@ def parse_raw_lod(raw_lod: str, section: SectionSchema) -> SectionSchema:
     
     return section
 
-async def summarize_results(search_results: list[SearchResultSchema], research_action_plan: ResearchActionPlanSchema) -> list[SearchResultSummary]:
-    # Create a new aiohttp client session
-    session = ClientSession()
-    openai.aiosession.set(session)
+def merge_chunk_summaries(search_result: SearchResultSchema, chunk_summaries: list[SearchResultSummary]) -> SearchResultSummary:
+    # reduce step for chunked pages, done locally without another LLM call
+    details = []
+    seen_details = set()
+    authors = []
+    date = ""
+    relevancy = {}
+    for summary in chunk_summaries:
+        for detail in summary.details:
+            key = " ".join(detail.lower().split())
+            if key not in seen_details:
+                seen_details.add(key)
+                details.append(detail)
+        for author in summary.authors:
+            if author not in authors:
+                authors.append(author)
+        date = date or summary.date
+        # a source is as relevant to a section as its most relevant part
+        for section, score in summary.relevancy.items():
+            relevancy[section] = max(score, relevancy.get(section, score))
+
+    error_messages = []
+    if not details:
+        error_messages.append("Details section is missing or empty.")
+    if not relevancy:
+        error_messages.append("Relevancy section is missing or empty.")
+    error = None if not error_messages else " ".join(error_messages)
 
-    # Parallelize the summarization of search results
-    summaries: list[SearchResultSummary] = await asyncio.gather(
-        *[summarize_result_async(result, research_action_plan) for result in search_results]
+    return SearchResultSummary(
+        source_material=search_result,
+        details=details,
+        authors=authors,
+        date=date,
+        relevancy=relevancy,
+        error=error
     )
 
-    # Close the session at the end
-    await session.close()
-    
-    return summaries
+async def summarize_result_chunked(search_result: SearchResultSchema, research_action_plan: ResearchActionPlanSchema, scheduler: RateLimitScheduler = None) -> SearchResultSummary:
+    # map: every chunk is summarized on its own, all at once
+    async def summarize_chunk(chunk: str) -> SearchResultSummary:
+        chunk_result = search_result.model_copy(update={"content": chunk, "chunks": [], "num_tokens": None})
+        if scheduler is None:
+            return await summarize_result_async(chunk_result, research_action_plan)
+        return await summarize_result_scheduled(chunk_result, research_action_plan, scheduler)
+
+    chunk_summaries = await asyncio.gather(*[summarize_chunk(chunk) for chunk in search_result.chunks])
+    return merge_chunk_summaries(search_result, [summary for summary in chunk_summaries if summary is not None])
+
+async def summarize_result_scheduled(search_result: SearchResultSchema, research_action_plan: ResearchActionPlanSchema, scheduler: RateLimitScheduler) -> SearchResultSummary:
+    # None when the budget governor no longer admits the result
+    with span("summarize", link=search_result.link, model=search_result.model.value.official_name, chunks=len(search_result.chunks)) as summarize_span:
+        governor = get_budget_governor()
+        if governor is not None and not governor.admit_summary(search_result):
+            summarize_span.set(skipped=True)
+            return None
+        if search_result.chunks:
+            # each chunk is admitted on its own
+            return await summarize_result_chunked(search_result, research_action_plan, scheduler)
+        # admitted by the same token estimate the cost estimate uses
+        input_tokens, output_tokens = est_tokens_search_result(search_result)
+        queued_at = time.monotonic()
+        async with scheduler.admit(search_result.model, input_tokens + output_tokens):
+            summarize_span.set(queue_wait=time.monotonic() - queued_at)
+            summary = await summarize_result_async(search_result, research_action_plan)
+        if summary.error:
+            summarize_span.set(summary_error=summary.error)
+        return summary
+
+async def summarize_results(search_results: list[SearchResultSchema], research_action_plan: ResearchActionPlanSchema, scheduler: RateLimitScheduler = None, on_summary=None) -> list[SearchResultSummary]:
+    # requests beyond each model's rpm/tpm quota wait in the scheduler's queue,
+    # on_summary(summary) is called with every summary as soon as it is done
+    if scheduler is None:
+        scheduler = RateLimitScheduler()
+
+    async def summarize(result: SearchResultSchema) -> SearchResultSummary:
+        summary = await summarize_result_scheduled(result, research_action_plan, scheduler)
+        if summary is not None and on_summary is not None:
+            on_summary(summary)
+        return summary
+
+    # Parallelize the summarization of search results over the shared connection pool
+    async with llm_session():
+        summaries: list[SearchResultSummary] = await asyncio.gather(*[summarize(result) for result in search_results])
+
+    return [summary for summary in summaries if summary is not None]
 
 def clean_content(content: str) -> str:
     # Replace multiple newline characters with a single newline
@@ -254,9 +539,9 @@ def clean_content(content: str) -> str:
     return cleaned_content
 
 
-def convert_paper_to_pdf(paper: PaperSchema):
+def convert_paper_to_pdf(paper: PaperSchema, output_dir: str = "./outputs"):
     content = ""
     for section in paper.sections:
         content += section.lods[0] + "\n\n"
 
-    md2pdf("./outputs/paper.pdf", md_content=content)
\ No newline at end of file
+    md2pdf(os.path.join(output_dir, "paper.pdf"), md_content=content)
\ No newline at end of file
@@ -1,13 +1,17 @@
 from prompt_renderer import render_writing_prompt
 from schemas import ResearchActionPlanSchema, ModelEnum, PaperSchema, SearchResultSummary, SectionSchema
 import asyncio
+import inspect
 import openai
 from dotenv import load_dotenv
 import os
+from research_index import ResearchIndex
+from llm_client import chat_completion, stream_chat_completion, llm_session
+from utils import generate_lods
+from tracing import span, annotate
 
-async def generate_section_content(writing_prompt: str, model: ModelEnum=ModelEnum.GPT4_8K):
-    print(f"!!!Generating section content with model: {model.value.official_name}!!!")
-    completion = await openai.ChatCompletion.acreate(
+def section_completion_params(writing_prompt: str, model: ModelEnum) -> dict:
+    return dict(
         model=model.value.official_name,
         messages=[
             {
@@ -21,22 +25,180 @@ async def generate_section_content(writing_prompt: str, model: ModelEnum=ModelEn
         frequency_penalty=0,
         presence_penalty=0
     )
+
+async def stream_section_content(writing_prompt: str, model: ModelEnum=ModelEnum.GPT4_8K):
+    # async iterator over the section text as the model produces it
+    async for delta in stream_chat_completion("write_section", **section_completion_params(writing_prompt, model)):
+        yield delta
+
+async def call_callback(callback, *args):
+    # callbacks may be plain functions or coroutines
+    result = callback(*args)
+    if inspect.isawaitable(result):
+        await result
+
+async def generate_section_content(writing_prompt: str, model: ModelEnum=ModelEnum.GPT4_8K, on_token=None):
+    annotate(model=model.value.official_name)
+    if on_token is not None:
+        pieces = []
+        async for delta in stream_section_content(writing_prompt, model):
+            pieces.append(delta)
+            await call_callback(on_token, delta)
+        return "".join(pieces)
+
+    completion = await chat_completion("write_section", **section_completion_params(writing_prompt, model))
     new_section: str = completion.choices[0].message.content
     return new_section
 
+DEFAULT_MAX_CONCURRENCY = 4
+
+def section_token_callback(on_token, section_name: str):
+    if on_token is None:
+        return None
+    return lambda delta: on_token(section_name, delta)
+
+async def write_paper_parallel(research_action_plan: ResearchActionPlanSchema, research: list[SearchResultSummary], max_context: int, research_index: ResearchIndex, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, on_token=None, on_section=None, resume_sections: dict[int, SectionSchema] = None, on_progress=None) -> PaperSchema:
+    # every section is written at once from the research plan and outline instead of
+    # the prose of the sections before it, at most max_concurrency at a time
+    semaphore = asyncio.Semaphore(max_concurrency)
+    paper = PaperSchema()
+    section_names = research_action_plan.paper_structure
+    # on_token and on_section still see the sections in paper order: only the first
+    # unfinished section streams its tokens straight through, later ones are held back
+    # until every section before them is done
+    finished: dict[int, SectionSchema] = dict(resume_sections or {})
+    buffered: dict[int, list[str]] = {}
+    live: int = None
+    next_index = 0
+    emit_lock = asyncio.Lock()
+
+    async def emit_in_order():
+        nonlocal live, next_index
+        async with emit_lock:
+            live = None
+            while next_index < len(section_names):
+                # catch up on what the section streamed while the ones before it were written
+                pending = buffered.setdefault(next_index, [])
+                while pending:
+                    await call_callback(on_token, section_names[next_index], pending.pop(0))
+                if next_index not in finished:
+                    live = next_index
+                    return
+                del buffered[next_index]
+                if on_section is not None:
+                    await call_callback(on_section, finished[next_index])
+                next_index += 1
+
+    def section_tokens(curr_section: int):
+        if on_token is None:
+            return None
+
+        async def forward(delta: str):
+            if curr_section == live:
+                await call_callback(on_token, section_names[curr_section], delta)
+            else:
+                buffered.setdefault(curr_section, []).append(delta)
+        return forward
+
+    async def write_section(curr_section: int) -> SectionSchema:
+        if curr_section in finished:
+            return finished[curr_section]
+        async with semaphore:
+            section_name = section_names[curr_section]
+            with span("write_section", section=section_name, index=curr_section):
+                prompt = await render_writing_prompt(research_action_plan, paper, curr_section, research, total_tokens=max_context, research_index=research_index, outline_context=True)
+                raw_new_section_text = await generate_section_content(prompt, on_token=section_tokens(curr_section))
+            new_section = SectionSchema(name=section_name, lods=[raw_new_section_text])
+            if on_progress is not None:
+                await call_callback(on_progress, curr_section, new_section)
+            finished[curr_section] = new_section
+            await emit_in_order()
+            return new_section
+
+    await emit_in_order()
+    async with llm_session():
+        paper.sections = await asyncio.gather(*[write_section(i) for i in range(len(section_names))])
+    return paper
+
 async def write_paper(research_action_plan: ResearchActionPlanSchema, research: list[SearchResultSummary], **kwargs):
     # check if kwargs has a context_limit int
     # if it does, then use that as the max_tokens
+    # on_token(section_name, text) streams each section as it is generated and
+    # on_section(section) is called with every finished section, kept ones included,
+    # both in paper order
+    on_token = kwargs.get("on_token")
+    on_section = kwargs.get("on_section")
+    # sections a previous attempt already wrote, by index, are kept instead of rewritten,
+    # and on_progress(index, section) is called whenever a section or its LODs are done
+    resume_sections: dict[int, SectionSchema] = kwargs.get("resume_sections") or {}
+    on_progress = kwargs.get("on_progress")
     max_context = kwargs.get("context_limit", ModelEnum.GPT4_8K.value.max_context)
     paper = PaperSchema()
+    # relevancy matrix and note costs for every section, built once for the whole paper
+    research_index = ResearchIndex(research, research_action_plan.paper_structure)
+    if kwargs.get("parallel", False):
+        return await write_paper_parallel(research_action_plan, research, max_context, research_index, kwargs.get("max_concurrency", DEFAULT_MAX_CONCURRENCY), on_token, on_section, resume_sections, on_progress)
     curr_section = 0
     ttl_sections = len(research_action_plan.paper_structure)
-    while curr_section < ttl_sections:
-        prompt = await render_writing_prompt(research_action_plan, paper, curr_section, research, total_tokens=max_context)
-        print(prompt)
-        raw_new_section_text = await generate_section_content(prompt)
-        new_section:SectionSchema = SectionSchema(name=research_action_plan.paper_structure[curr_section], lods=[raw_new_section_text])
-        print(new_section)
-        paper.sections.append(new_section)
+    # LODs of every finished section are generated in the background while the next
+    # section is written, the L2 allocator only waits on the ones it actually needs
+    eager_lods = kwargs.get("eager_lods", True)
+    lod_tasks: dict[int, asyncio.Task] = {}
+    # sections whose LODs on_progress has already seen
+    lods_reported: set[int] = set()
+
+    async def report_lods():
+        # LODs come from the background tasks or straight from the L2 allocator
+        for i, section in enumerate(paper.sections):
+            if section.max_lod_generated and i not in lods_reported:
+                lods_reported.add(i)
+                if on_progress is not None:
+                    await call_callback(on_progress, i, section)
+
+    async def generate_section_lods(section: SectionSchema) -> SectionSchema:
+        updated_section = await generate_lods(section, research_action_plan)
+        await report_lods()
+        return updated_section
+
+    def start_lods(index: int, section: SectionSchema):
+        # no later section reads the LODs of the last one
+        if eager_lods and index < ttl_sections - 1 and not section.max_lod_generated:
+            lod_tasks[index] = asyncio.create_task(generate_section_lods(section))
+
+    # carry on after the sections an earlier attempt finished in order
+    while curr_section in resume_sections:
+        paper.sections.append(resume_sections[curr_section])
+        if paper.sections[-1].max_lod_generated:
+            lods_reported.add(curr_section)
+        if on_section is not None:
+            await call_callback(on_section, paper.sections[-1])
         curr_section += 1
-    return paper
\ No newline at end of file
+    # section writes and LOD generation reuse one pooled connection
+    async with llm_session():
+        try:
+            for i, section in enumerate(paper.sections):
+                start_lods(i, section)
+            while curr_section < ttl_sections:
+                section_name = research_action_plan.paper_structure[curr_section]
+                with span("write_section", section=section_name, index=curr_section):
+                    prompt = await render_writing_prompt(research_action_plan, paper, curr_section, research, total_tokens=max_context, research_index=research_index, lod_tasks=lod_tasks)
+                    await report_lods()
+                    raw_new_section_text = await generate_section_content(prompt, on_token=section_token_callback(on_token, section_name))
+                new_section:SectionSchema = SectionSchema(name=section_name, lods=[raw_new_section_text])
+                paper.sections.append(new_section)
+                if on_progress is not None:
+                    await call_callback(on_progress, curr_section, new_section)
+                start_lods(curr_section, new_section)
+                if on_section is not None:
+                    await call_callback(on_section, new_section)
+                curr_section += 1
+        except BaseException:
+            # a failed or cancelled run does not wait for LODs nobody will read
+            for task in lod_tasks.values():
+                task.cancel()
+            raise
+        finally:
+            # LODs still in flight are kept in the paper if they finish, failures are dropped
+            await asyncio.gather(*lod_tasks.values(), return_exceptions=True)
+            await report_lods()
+    return paper